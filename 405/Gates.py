@@ -1,10 +1,24 @@
-import machine
-from machine import Pin, I2C, SPI
+from machine import Pin, I2C, SPI, ADC
+import micropython
 import time
 import os
-import json
+from array import array
 import ds3231
-import sdcard
+from event_ring import EventRing
+from direction import DirectionTracker
+from gpio_sample import GpioSampler, pin_mask
+from eventlog import EventLog, PAIRS, DIRECTIONS, pack_flags, to_csv
+from buttons import Buttons
+import timebase
+import config_cache
+from bootprof import BootProfile
+from sd_session import SdSession
+
+micropython.alloc_emergency_exception_buf(100)
+
+# ticks_us() of every init phase, printed when ready ("boot_log": true also saves it to flash)
+boot = BootProfile()
+boot.mark("imports")
 
 # =========================================================
 # --- Load Config ---
@@ -12,16 +26,18 @@ import sdcard
 CONFIG_FILE = "config.json"
 
 def load_config(file_path):
+    # Validated with the defaults filled in, from config_c.py while config.json is unchanged
     try:
-        with open(file_path, "r") as f:
-            return json.load(f)
+        config, cached = config_cache.load(file_path)
+        return config, "cache" if cached else "json"
     except Exception as e:
         print("Failed to load config:", e)
-        return None
+        return None, None
 
-config = load_config(CONFIG_FILE)
+config, config_source = load_config(CONFIG_FILE)
 if not config:
     raise Exception("Cannot continue without a valid config file")
+boot.mark(f"config ({config_source})")
 
 # =========================================================
 # --- RTC Setup ---
@@ -29,6 +45,20 @@ if not config:
 i2c = I2C(0, scl=Pin(config["rtc_i2c"]["scl"]), sda=Pin(config["rtc_i2c"]["sda"]), freq=config["rtc_i2c"]["freq"])
 rtc = ds3231.DS3231(i2c)
 
+# Optional: DS3231 SQW pin wired to a GPIO. A 1 Hz IRQ then keeps a cached
+# datetime, so reading the time costs no I2C traffic at all.
+SQW_PIN = config.get("rtc_sqw_pin")
+if SQW_PIN is not None:
+    rtc_time = ds3231.SQWClock(rtc, Pin(SQW_PIN, Pin.IN, Pin.PULL_UP),
+                               resync_min=config.get("rtc_resync_min", 10))
+else:
+    rtc_time = rtc
+
+# Wall clock for event timestamps: anchored to the RTC, derived from ticks_us()
+clock = timebase.TimeBase(rtc_time, sync_ms=config.get("rtc_sync_s", 60) * 1000)
+TIMESTAMP_DIGITS = config.get("timestamp_digits", 3)  # 3 = ms, 6 = us
+boot.mark("rtc")
+
 def format_time(dt):
     _, _, _, _, hour, minute, second, _ = dt
     return f"{hour:02d}:{minute:02d}:{second:02d}"
@@ -41,14 +71,26 @@ def format_date(dt):
 # --- CSV / Data Setup ---
 # =========================================================
 DATA_DIR = config["data_dir"]
-if DATA_DIR not in os.listdir():
+try:
+    os.stat(DATA_DIR)  # no listdir() of the whole flash root
+except OSError:
     os.mkdir(DATA_DIR)
 
 file_name_A = None
 file_name_B = None
+writer_A = None
+writer_B = None
 test_running_A = False
 test_running_B = False
 
+# "bin": compact binary logs on flash, converted to CSV when copied to the SD card
+# "csv": write CSV on flash directly
+LOG_FORMAT = config.get("log_format", "bin")
+if LOG_FORMAT == "csv":
+    from csv_writer import CSVWriter
+CSV_BUFFER_BYTES = config.get("csv_buffer_bytes", 1024)
+CSV_FLUSH_MS = config.get("csv_flush_ms", 5000)
+
 # =========================================================
 # --- LEDs ---
 # =========================================================
@@ -73,24 +115,108 @@ DEBOUNCE = config["debounce_ms"]
 beam_A_pins = {name: Pin(pin, Pin.IN, Pin.PULL_UP) for name, pin in config["beam_pins_A"].items()}
 beam_B_pins = {name: Pin(pin, Pin.IN, Pin.PULL_UP) for name, pin in config["beam_pins_B"].items()}
 
-last_trigger_A = {name: 0 for name in beam_A_pins}
-sequence_A = []
-
-last_trigger_B = {name: 0 for name in beam_B_pins}
-sequence_B = []
+# Gate index -> name, the IRQs only deal with the index
+gate_names_A = list(beam_A_pins)
+gate_names_B = list(beam_B_pins)
+
+last_trigger_A = array("L", [0] * len(gate_names_A))
+last_trigger_B = array("L", [0] * len(gate_names_B))
+
+# Captured breaks (ADC/PIO below) arrive in batches, they are debounced on
+# the ticks_us the capture recorded, not on when they were polled
+DEBOUNCE_US = DEBOUNCE * 1000
+last_break_A = array("L", [0] * len(gate_names_A))
+last_break_B = array("L", [0] * len(gate_names_B))
+
+# With "beam_adc_rate_hz" set, beams wired to the ADC pins (GPIO 26-28) are
+# sampled at that rate and timed from the samples (adc_capture.py) instead of
+# a pin IRQ.  Wire both beams of a pair to the ADC, so their order comes
+# from the same sample stream.
+BEAM_ADC_RATE_HZ = config.get("beam_adc_rate_hz", 0)
+adc_gates = []  # (gpio, set_id, gate), in ADC channel order
+if BEAM_ADC_RATE_HZ:
+    for set_id, pins in enumerate((config["beam_pins_A"], config["beam_pins_B"])):
+        for gate, gpio_pin in enumerate(pins.values()):
+            if 26 <= gpio_pin <= 28:
+                adc_gates.append((gpio_pin, set_id, gate))
+    adc_gates.sort()
+adc_pins = [gpio_pin for gpio_pin, _, _ in adc_gates]
+
+# With "beam_capture": "pio" the digital beams are watched by a PIO state
+# machine that timestamps every edge to "pio_tick_us" and drops pulses
+# shorter than "pio_glitch_ticks" ticks (pio_capture.py), with DMA into a
+# ring, instead of one Pin.irq per beam.  Firmware without rp2.DMA keeps
+# the IRQs.
+BEAM_CAPTURE = config.get("beam_capture", "irq")
+pio_gates = []  # (gpio, set_id, gate), in GPIO order
+if BEAM_CAPTURE == "pio":
+    for set_id, pins in enumerate((config["beam_pins_A"], config["beam_pins_B"])):
+        for gate, gpio_pin in enumerate(pins.values()):
+            if gpio_pin not in adc_pins:
+                pio_gates.append((gpio_pin, set_id, gate))
+    pio_gates.sort()
+
+# Half-completed crossings older than this are dropped
+CROSSING_TIMEOUT_MS = config.get("crossing_timeout_ms", 2000)
+tracker_A = DirectionTracker(gate_names_A, CROSSING_TIMEOUT_MS)
+tracker_B = DirectionTracker(gate_names_B, CROSSING_TIMEOUT_MS)
+
+# Events captured by the IRQs, drained by the main loop (or micropython.schedule)
+beam_events = EventRing(config.get("event_buffer_size", 64))
+# Breaks found by the ADC/PIO captures are pushed from the main loop, which
+# the IRQs can interrupt mid-push: they get a ring of their own
+captured_events = EventRing(beam_events.size) if adc_gates or pio_gates else None
+SCHEDULE_DRAIN = config.get("schedule_drain", False)
+drain_pending = False
+draining = False
+reported_overflows = 0
+reported_captured_overflows = 0
+
+# "single": one loop does everything.  "dual": core 0 captures and classifies,
+# core 1 (_thread) logs, offloads and runs the buttons/LEDs; crossings go
+# from core 0 to core 1 through the crossings queue.  "asyncio": one task
+# per job, woken by the IRQs (see main_async).
+RUNTIME = config.get("runtime", "single")
+CAPTURE_PERIOD_MS = config.get("capture_period_ms", 1)
+crossings = None
+if RUNTIME == "dual":
+    from spsc import SpscQueue
+    crossings = SpscQueue(config.get("crossing_queue_size", 64))
+reported_queue_overflows = 0
+# The trackers belong to whichever core drains the rings: core 1 starting a
+# test only sets its set's flag, and the drain resets that tracker itself
+tracker_reset = bytearray(2)
 
 # =========================================================
 # --- SD Card Setup ---
 # =========================================================
-spi = SPI(1, baudrate=config["spi"]["baudrate"], sck=Pin(config["spi"]["sck"]),
-          mosi=Pin(config["spi"]["mosi"]), miso=Pin(config["spi"]["miso"]))
-cs = Pin(config["spi"]["cs"], Pin.OUT)
+# The driver is imported and the SPI bus set up when the first card is
+# mounted, so neither sits between reset and armed gates
+sdcard = None
+spi = None
+cs = None
+SD_MAX_BAUDRATE = config["spi"].get("max_baudrate", 25000000)
 det_pin = Pin(config["sd_detect_pin"], Pin.IN)
-sd_present = False
 
 source = "/Data"
 destination = config["sd_destination"]
 
+# Copy buffer, sized to the card's cluster on the first download and kept
+copier = None
+COPY_BUFFER_MAX = config.get("copy_buffer_bytes", 32768)
+
+# Incremental sync (manifest + verify before delete); False copies everything every time
+SD_SYNC = config.get("sd_sync", True)
+
+# The sync runs as a job stepped from the main loop, a slice at a time
+OFFLOAD_SLICE_MS = config.get("offload_slice_ms", 5)
+OFFLOAD_CHUNK = config.get("offload_chunk_bytes", 4096)
+offload = None
+
+# Optional sector cache for FAT and directory blocks (slots of 512 bytes, 0 = off)
+SD_CACHE_SLOTS = config.get("sd_cache_slots", 0)
+sd_cache = None
+
 # =========================================================
 # --- Buttons ---
 # =========================================================
@@ -98,105 +224,281 @@ test_button_A = Pin(config["test_button_pin_A"], Pin.IN, Pin.PULL_UP)
 test_button_B = Pin(config["test_button_pin_B"], Pin.IN, Pin.PULL_UP)
 download_button = Pin(config["download_button_pin"], Pin.IN, Pin.PULL_UP)
 
-last_test_state_A = 1
-last_test_state_B = 1
-last_download_state = 1
-last_test_time_A = 0
-last_test_time_B = 0
-last_download_time = 0
-DEBOUNCE_MS = config["download_debounce_ms"]
+# Presses come from the pin IRQs, debounced by a one-shot timer (buttons.py), and
+# download_debounce_ms apart at least per button
+buttons = Buttons({"A": test_button_A, "B": test_button_B, "download": download_button},
+                  config.get("button_debounce_ms", 50), config.get("download_debounce_ms", 300))
+boot.mark("leds, beam pins, buttons")
 
 # =========================================================
-# --- Logging ---
+# --- Input Sampling ---
 # =========================================================
-def log_event(timestamp, pair, direction, set_label):
-    file_name = file_name_A if set_label == "A" else file_name_B
-    running = test_running_A if set_label == "A" else test_running_B
-    if running and file_name:
-        print(f"{timestamp} - {set_label} - {pair} - {direction}")
-        with open(file_name, 'a') as f:
-            f.write(f"{timestamp},{pair},{direction}\n")
+# Module detection reads all beams in one go and tests them with these masks
+# (analog beams have no digital level, only the digital ones are checked)
+BEAMS_A = pin_mask(pin for pin in config["beam_pins_A"].values() if pin not in adc_pins)
+BEAMS_B = pin_mask(pin for pin in config["beam_pins_B"].values() if pin not in adc_pins)
+
+input_pins = {}
+for name, pin in beam_A_pins.items():
+    input_pins[config["beam_pins_A"][name]] = pin
+for name, pin in beam_B_pins.items():
+    input_pins[config["beam_pins_B"][name]] = pin
+gpio = GpioSampler(input_pins)
+LOOP_PERIOD_MS = config.get("loop_period_ms", 20)
 
 # =========================================================
-# --- Direction Detection ---
+# --- Analog Module Detection ---
 # =========================================================
-def check_direction(sequence, set_label):
-    if len(sequence) >= 2:
-        first_gate, _ = sequence[0]
-        second_gate, second_time = sequence[1]
+# Optional LDR per set, e.g. "module_adc_pins": {"A": 26, "B": 27}.  When set
+# the module LEDs follow the scanner's connect/disconnect changes instead of
+# the beam levels; thresholds are calibrated from the ambient light at boot.
+MODULE_ADC_PINS = config.get("module_adc_pins")
+if MODULE_ADC_PINS and adc_pins:
+    raise ValueError("module_adc_pins and beam_adc_rate_hz both need the ADC, use one of them")
+module_leds = {"A": module_led_A, "B": module_led_B}
+module_scanner = None
+if MODULE_ADC_PINS:
+    from adc_scanner import AdcScanner
+    module_scanner = AdcScanner({name: ADC(pin) for name, pin in MODULE_ADC_PINS.items()},
+                                rate_hz=config.get("module_adc_rate_hz", 100),
+                                on_ms=config.get("module_adc_on_ms", 1000))
+    module_scanner.start()
+    if module_scanner.uncalibrated:
+        print(f"WARNING: module ADC {module_scanner.uncalibrated} already lit at boot, using a fixed threshold")
+    boot.mark("module scanner")
 
-        if first_gate.startswith("Left") and second_gate.startswith("Left"):
-            direction = "Right" if first_gate.endswith("Left") else "Left"
-            log_event(second_time, "Left Pair", direction, set_label)
-        elif first_gate.startswith("Right") and second_gate.startswith("Right"):
-            direction = "Right" if first_gate.endswith("Left") else "Left"
-            log_event(second_time, "Right Pair", direction, set_label)
-
-        sequence.clear()
+# =========================================================
+# --- Logging ---
+# =========================================================
+def log_event(stamp, pair, direction, set_label, gate=0):
+    # stamp: (seconds, us) from clock, pair/direction: indexes into PAIRS/DIRECTIONS
+    writer = writer_A if set_label == "A" else writer_B
+    running = test_running_A if set_label == "A" else test_running_B
+    if running and writer:
+        timestamp = timebase.format_time(stamp[0], stamp[1], TIMESTAMP_DIGITS)
+        print(f"{timestamp} - {set_label} - {PAIRS[pair]} - {DIRECTIONS[direction]}")
+        if LOG_FORMAT == "bin":
+            writer.write_event(stamp[0], stamp[1], pair, direction, gate)
+        else:
+            writer.write_row(f"{timestamp},{PAIRS[pair]},{DIRECTIONS[direction]}\n")
 
 # =========================================================
 # --- Beam Gate Interrupts ---
 # =========================================================
-def make_gate_callback(name, sequence, last_trigger, set_label):
+# The handler only timestamps the break and pushes it into beam_events.
+# No RTC reads, string formatting or file access happen in the interrupt.
+def make_gate_callback(gate, last_trigger, set_label):
+    set_id = 0 if set_label == "A" else 1
     def callback(pin):
+        global drain_pending
         running = test_running_A if set_label == "A" else test_running_B
         if not running:
             return
         now = time.ticks_ms()
-        if time.ticks_diff(now, last_trigger[name]) > DEBOUNCE:
-            sequence.append((name, format_time(rtc.datetime())))
-            check_direction(sequence, set_label)
-            last_trigger[name] = now
+        if time.ticks_diff(now, last_trigger[gate]) > DEBOUNCE:
+            last_trigger[gate] = now
+            beam_events.push(gate, time.ticks_us(), set_id)
+            if beam_flag:
+                beam_flag.set()  # asyncio runtime: wake capture_task
+            if SCHEDULE_DRAIN and not drain_pending:
+                drain_pending = True
+                try:
+                    micropython.schedule(drain_ref, 0)
+                except RuntimeError:
+                    drain_pending = False  # schedule queue full, the main loop will drain
     return callback
 
-for name, pin in beam_A_pins.items():
-    pin.irq(trigger=Pin.IRQ_FALLING, handler=make_gate_callback(name, sequence_A, last_trigger_A, "A"))
-
-for name, pin in beam_B_pins.items():
-    pin.irq(trigger=Pin.IRQ_FALLING, handler=make_gate_callback(name, sequence_B, last_trigger_B, "B"))
+def drain_events(_=None):
+    global drain_pending, draining
+    drain_pending = False
+    if draining:
+        return
+    draining = True
+    try:
+        if tracker_reset[0]:
+            tracker_reset[0] = 0
+            tracker_A.reset()
+        if tracker_reset[1]:
+            tracker_reset[1] = 0
+            tracker_B.reset()
+        while True:
+            # oldest first when both rings hold events
+            ring = beam_events
+            if captured_events and len(captured_events) and (
+                    not len(beam_events) or
+                    time.ticks_diff(captured_events.peek_ticks(), beam_events.peek_ticks()) < 0):
+                ring = captured_events
+            if not ring.pop():
+                break
+            gate = ring.gate
+            ticks = ring.ticks
+            tracker = tracker_A if ring.set_id == 0 else tracker_B
+            direction = tracker.event(gate, ticks)
+            if direction >= 0:
+                stamp = clock.stamp(ticks)
+                if crossings:
+                    crossings.push(ring.set_id, stamp[0], stamp[1], pack_flags(tracker.pair, direction, gate))
+                else:
+                    log_event(stamp, tracker.pair, direction, "A" if ring.set_id == 0 else "B", gate)
+    finally:
+        draining = False  # a failed write must not lock the drain out
+
+def drain_crossings():
+    # Dual-core runtime, core 1: log the crossings classified on core 0
+    while crossings.pop():
+        flags = crossings.flags
+        log_event((crossings.seconds, crossings.us), flags & 1, flags >> 1 & 1,
+                  "A" if crossings.set_id == 0 else "B", flags >> 2 & 0x07)
+
+drain_ref = drain_events  # bound once so the IRQ doesn't allocate
+
+def check_overflows():
+    global reported_overflows, reported_captured_overflows, reported_queue_overflows
+    if beam_events.overflows != reported_overflows:
+        print(f"WARNING: {beam_events.overflows - reported_overflows} beam events dropped (buffer full)")
+        reported_overflows = beam_events.overflows
+    if captured_events and captured_events.overflows != reported_captured_overflows:
+        print(f"WARNING: {captured_events.overflows - reported_captured_overflows} captured beam events dropped (buffer full)")
+        reported_captured_overflows = captured_events.overflows
+    if crossings and crossings.overflows != reported_queue_overflows:
+        print(f"WARNING: {crossings.overflows - reported_queue_overflows} crossings dropped (core 1 queue full)")
+        reported_queue_overflows = crossings.overflows
+
+def push_break(set_id, gate, ticks):
+    # A break timed by one of the captures below, same checks as the IRQs
+    running = test_running_A if set_id == 0 else test_running_B
+    if not running:
+        return
+    last_break = last_break_A if set_id == 0 else last_break_B
+    # A gate's breaks come in order, so a negative gap means ticks_us wrapped
+    # past the last one (idle for more than ~9 minutes)
+    gap = time.ticks_diff(ticks, last_break[gate])
+    if gap > DEBOUNCE_US or gap < 0:
+        last_break[gate] = ticks
+        captured_events.push(gate, ticks, set_id)
+        if beam_flag:
+            beam_flag.set()
+
+def adc_break(index, ticks):
+    # Found in the ADC samples by beam_capture.poll(), ticks interpolated
+    _, set_id, gate = adc_gates[index]
+    push_break(set_id, gate, ticks)
+
+def pio_break(index, ticks):
+    # Falling edge pushed by the PIO, decoded by pio_capture.poll()
+    _, set_id, gate = pio_gates[index]
+    push_break(set_id, gate, ticks)
+
+pio_capture = None
+if pio_gates:
+    from pio_capture import PioCapture
+    try:
+        pio_capture = PioCapture([gpio_pin for gpio_pin, _, _ in pio_gates], pio_break,
+                                 sm_id=config.get("pio_sm", 0),
+                                 tick_us=config.get("pio_tick_us", 1),
+                                 glitch_ticks=config.get("pio_glitch_ticks", 2),
+                                 size=config.get("pio_ring_words", 256))
+        pio_capture.start()
+        print(f"PIO beam timing on GPIO {[gpio_pin for gpio_pin, _, _ in pio_gates]}")
+    except (OSError, ValueError) as e:
+        print(f"PIO capture unavailable ({e}), using pin IRQs")
+        pio_gates = []
+irq_free_pins = adc_pins + [gpio_pin for gpio_pin, _, _ in pio_gates]
+
+for gate, name in enumerate(beam_A_pins):
+    if config["beam_pins_A"][name] not in irq_free_pins:
+        beam_A_pins[name].irq(trigger=Pin.IRQ_FALLING, handler=make_gate_callback(gate, last_trigger_A, "A"))
+
+for gate, name in enumerate(beam_B_pins):
+    if config["beam_pins_B"][name] not in irq_free_pins:
+        beam_B_pins[name].irq(trigger=Pin.IRQ_FALLING, handler=make_gate_callback(gate, last_trigger_B, "B"))
+
+beam_capture = None
+if adc_pins:
+    from adc_capture import AdcCapture
+    beam_capture = AdcCapture(adc_pins, adc_break, rate_hz=BEAM_ADC_RATE_HZ,
+                              size=config.get("beam_adc_ring_samples", 2048))
+    beam_capture.start()  # calibrates on the unbroken beams
+    print(f"Analog beam timing on GPIO {adc_pins} at {beam_capture.ring.rate_hz} Hz")
+boot.mark("gates armed")
 
 # =========================================================
 # --- Test Control ---
 # =========================================================
 def start_new_test(set_label):
-    global file_name_A, file_name_B, test_running_A, test_running_B
-    dt = rtc.datetime()
-    fname = f"{DATA_DIR}/{dt[0]:04d}-{dt[1]:02d}-{dt[2]:02d}_{set_label}_{dt[4]:02}-{dt[5]:02}-{dt[6]:02}.csv"
-    with open(fname, 'w') as f:
-        f.write(f"Date:,{format_date(dt)}\n")
-        f.write("Time,Pair,Direction\n")
+    global file_name_A, file_name_B, writer_A, writer_B, test_running_A, test_running_B
+    start_s, _ = clock.now()
+    dt = timebase.to_datetime(start_s)
+    fname = f"{DATA_DIR}/{dt[0]:04d}-{dt[1]:02d}-{dt[2]:02d}_{set_label}_{dt[4]:02}-{dt[5]:02}-{dt[6]:02}.{LOG_FORMAT}"
+    if LOG_FORMAT == "bin":
+        writer = EventLog(fname, set_label, start_s, flush_ms=CSV_FLUSH_MS)
+    else:
+        writer = CSVWriter(fname, header=f"Date:,{format_date(dt)}\nTime,Pair,Direction\n",
+                           buf_size=CSV_BUFFER_BYTES, flush_ms=CSV_FLUSH_MS)
     if set_label == "A":
         file_name_A = fname
+        writer_A = writer
+        tracker_reset[0] = 1
         test_running_A = True
         status_led_A.value(1)
     else:
         file_name_B = fname
+        writer_B = writer
+        tracker_reset[1] = 1
         test_running_B = True
         status_led_B.value(1)
     print(f"Started new test for Set {set_label}, logging to {fname}")
 
 def stop_test(set_label):
-    global test_running_A, test_running_B
+    global test_running_A, test_running_B, writer_A, writer_B
+    if crossings:
+        drain_crossings()  # core 0 keeps draining beam_events itself
+    else:
+        drain_events()
     if set_label == "A":
         test_running_A = False
+        writer, writer_A = writer_A, None
+        tracker = tracker_A
         status_led_A.value(0)
     else:
         test_running_B = False
+        writer, writer_B = writer_B, None
+        tracker = tracker_B
         status_led_B.value(0)
+    if writer:
+        writer.close()
+        print(f"Set {set_label} log stats: {writer.stats()}")
+    print(f"Set {set_label}: {tracker.crossings} crossings, {tracker.abandoned} abandoned half crossings")
     print(f"Test stopped for Set {set_label}, logging disabled")
 
 # =========================================================
 # --- SD Functions ---
 # =========================================================
-def mount_sd():
-    global sd_present
-    try:
-        sd = sdcard.SDCard(spi, cs)
-        vfs = os.VfsFat(sd)
-        os.mount(vfs, "/sd")
-        sd_present = True
-    except OSError:
-        sd_present = False
+def sd_driver():
+    global sdcard, spi, cs
+    if sdcard is None:
+        import sdcard as driver
+        spi = SPI(1, baudrate=config["spi"]["baudrate"], sck=Pin(config["spi"]["sck"]),
+                  mosi=Pin(config["spi"]["mosi"]), miso=Pin(config["spi"]["miso"]))
+        cs = Pin(config["spi"]["cs"], Pin.OUT, value=1)
+        sdcard = driver
+    return sdcard
+
+def new_sd_card():
+    # sd_session initialises it: 400 kHz, then the fastest clock the card and wiring pass a CRC check at
+    return sd_driver().SDCard(spi, cs, max_baudrate=SD_MAX_BAUDRATE, init=False)
+
+def sd_device(sd):
+    # What gets mounted: the card, or the block cache in front of it (emptied for every card)
+    global sd_cache
+    if not SD_CACHE_SLOTS:
+        return sd
+    if sd_cache is None:
+        from blockcache import BlockCache
+        sd_cache = BlockCache(sd, SD_CACHE_SLOTS)
+    else:
+        sd_cache.attach(sd)
+    return sd_cache
 
 def folder_exists(path):
     try:
@@ -205,7 +507,20 @@ def folder_exists(path):
     except OSError:
         return False
 
+def convert_log(src_path, dest_path):
+    # Binary event logs leave the device as CSV. False if src isn't an event log.
+    start = time.ticks_ms()
+    try:
+        rows, bad = to_csv(src_path, dest_path, TIMESTAMP_DIGITS)
+    except ValueError:
+        return False
+    print(f"{src_path}: {rows} events converted in {time.ticks_diff(time.ticks_ms(), start)} ms")
+    if bad:
+        print(f"{src_path}: {bad} damaged blocks skipped")
+    return True
+
 def copy_files(source, destination):
+    from sdcopy import kb_per_s
     try:
         os.mkdir(destination)
     except OSError:
@@ -215,20 +530,24 @@ def copy_files(source, destination):
         dest_path = f"{destination}/{item}"
         if os.stat(src_path)[0] & 0x4000:
             copy_files(src_path, dest_path)
+        elif item.endswith(".bin") and convert_log(src_path, dest_path[:-4] + ".csv"):
+            pass
         else:
-            with open(src_path, 'rb') as fsrc, open(dest_path, 'wb') as fdest:
-                while True:
-                    buf = fsrc.read(1024)
-                    if not buf:
-                        break
-                    fdest.write(buf)
-
-def delete_files(path):
+            nbytes, us = copier.copy(src_path, dest_path)
+            print(f"{item}: {nbytes} bytes, {kb_per_s(nbytes, us)} KB/s")
+
+def active_logs():
+    # Log files still held open by a running test (as paths under /Data)
+    return [f"/{w.path}" for w in (writer_A, writer_B) if w]
+
+def delete_files(path, keep=()):
     for item in os.listdir(path):
         item_path = f"{path}/{item}"
+        if item_path in keep:
+            continue
         try:
             if os.stat(item_path)[0] & 0x4000:
-                delete_files(item_path)
+                delete_files(item_path, keep)
                 os.rmdir(item_path)
             else:
                 os.remove(item_path)
@@ -242,52 +561,85 @@ def ensure_sd_data_folder():
     except OSError as e:
         print(f"Failed to create /sd/Data: {e}")
 
+def offload_job():
+    # Generator: syncs the Data folder a chunk per step, the card stays mounted
+    from sdsync import SdSync
+    sync = SdSync(source, destination, copier, digits=TIMESTAMP_DIGITS, chunk=OFFLOAD_CHUNK, cache=sd_cache)
+    progress = sync.progress
+    done = 0
+    try:
+        for _ in sync.job(keep=active_logs()):
+            if progress["files_done"] != done:
+                done = progress["files_done"]
+                print(f"SD offload: {done}/{progress['files_total']} files, {progress['bytes']} bytes")
+            yield
+        stats = sync.stats
+        for name, error in sync.failed:
+            print(f"{name}: not synced ({error}), kept on flash")
+        print(f"SD sync: {stats['files']} files, {stats['bytes']} bytes in {stats['ms']} ms, "
+              f"{stats['unchanged']} unchanged, {stats['deleted']} deleted, {stats['failed']} failed")
+        if not stats["failed"]:
+            sd_led.value(1)
+        if sd_cache:
+            print(f"SD block cache: {sd_cache.stats()}")
+    except OSError as e:
+        print("Error during SD transfer:", e)
+
+def step_offload():
+    # Run the offload job for up to OFFLOAD_SLICE_MS
+    global offload
+    start = time.ticks_ms()
+    try:
+        while time.ticks_diff(time.ticks_ms(), start) < OFFLOAD_SLICE_MS:
+            next(offload)
+    except StopIteration:
+        offload = None
+
 def download_callback(pin):
-    global sd_present, last_download_time
-    now = time.ticks_ms()
-    if time.ticks_diff(now, last_download_time) < DEBOUNCE_MS:
+    global copier, offload
+    if offload is not None:
+        print("SD offload already running")
         return
-    last_download_time = now
 
-    if det_pin.value() == 1:
-        mount_sd()
-        if not sd_present:
-            print("SD card not detected or failed to mount.")
-            return
+    # Normally mounted since it was inserted; mount() covers a card still settling or mounting
+    if not sd_session.mount():
+        print("SD card not detected or failed to mount.")
+        return
 
-        ensure_sd_data_folder()
+    ensure_sd_data_folder()
+    if copier is None:
+        from sdcopy import FileCopier, cluster_size
+        copier = FileCopier(cluster_size("/sd"), COPY_BUFFER_MAX)
 
-        if not folder_exists(source):
-            print(f"Source folder '{source}' not found. Nothing to copy.")
-            return
+    if not folder_exists(source):
+        print(f"Source folder '{source}' not found. Nothing to copy.")
+        return
 
-        try:
-            if len(os.listdir(source)) > 0:
-                copy_files(source, destination)
-                print("Data copied to SD card")
-                sd_led.value(1)
-                delete_files(source)
-                print("Local Data folder cleared.")
-            else:
-                print("No files to copy.")
-        except OSError as e:
-            print("Error during SD transfer:", e)
+    for writer in (writer_A, writer_B):
+        if writer:
+            writer.flush()
 
-        try:
-            os.umount("/sd")
-        except OSError:
-            pass
-        sd_present = False
+    if SD_SYNC:
+        offload = offload_job()
+        return
 
-def sd_detect_callback(pin):
-    global sd_present
-    if pin.value() == 1:
-        sd_present = True
-    else:
-        sd_present = False
-        sd_led.value(0)
+    try:
+        if len(os.listdir(source)) > 0:
+            copy_files(source, destination)
+            print("Data copied to SD card")
+            sd_led.value(1)
+            delete_files(source, active_logs())
+            print("Local Data folder cleared.")
+            if sd_cache:
+                print(f"SD block cache: {sd_cache.stats()}")
+        else:
+            print("No files to copy.")
+    except OSError as e:
+        print("Error during SD transfer:", e)
 
-det_pin.irq(trigger=Pin.IRQ_RISING | Pin.IRQ_FALLING, handler=sd_detect_callback)
+# Mounts the card in the background once it's inserted and keeps it mounted
+# until it's removed (sd_session.py), so a download starts writing at once
+sd_session = SdSession(det_pin, new_sd_card, "/sd", config.get("sd_settle_ms", 250), wrap=sd_device)
 
 # =========================================================
 # --- Main Loop ---
@@ -296,59 +648,247 @@ disconnect_delay = 500
 last_all_high_time_A = time.ticks_ms()
 last_all_high_time_B = time.ticks_ms()
 
-while True:
-    now = time.ticks_ms()
-
-    # Test button A
-    current_test_state_A = test_button_A.value()
-    if last_test_state_A == 1 and current_test_state_A == 0:
-        if time.ticks_diff(now, last_test_time_A) > DEBOUNCE_MS:
+def poll_storage():
+    # Log what core 0 classified (dual runtime), flush buffered rows on the time threshold
+    if crossings:
+        drain_crossings()
+    if writer_A:
+        writer_A.poll()
+    if writer_B:
+        writer_B.poll()
+
+def poll_buttons():
+    # Presses queued by the button IRQs since the last call
+    while True:
+        button = buttons.get()
+        if button == -1:
+            return
+        if button == "A":
             if test_running_A:
                 stop_test("A")
             else:
                 start_new_test("A")
-            last_test_time_A = now
-    last_test_state_A = current_test_state_A
-
-    # Test button B
-    current_test_state_B = test_button_B.value()
-    if last_test_state_B == 1 and current_test_state_B == 0:
-        if time.ticks_diff(now, last_test_time_B) > DEBOUNCE_MS:
+        elif button == "B":
             if test_running_B:
                 stop_test("B")
             else:
                 start_new_test("B")
-            last_test_time_B = now
-    last_test_state_B = current_test_state_B
-
-    # Download button
-    current_download_state = download_button.value()
-    if last_download_state == 1 and current_download_state == 0:
-        if time.ticks_diff(now, last_download_time) > DEBOUNCE_MS:
+        else:
             download_callback(None)
-            last_download_time = now
-    last_download_state = current_download_state
+
+def poll_modules(now, inputs):
+    global last_all_high_time_A, last_all_high_time_B
+
+    if module_scanner is not None:
+        # Changes published by the ADC scanner
+        while True:
+            name = module_scanner.get()
+            if name == -1:
+                return
+            module_leds[name].value(module_scanner.connected)
 
     # Module detection A
-    states_A = [p.value() for p in beam_A_pins.values()]
-    all_high_A = all(states_A)
-    all_low_A = not any(states_A)
-    if all_high_A:
+    beams_A = inputs & BEAMS_A
+    if beams_A == BEAMS_A:
         module_led_A.value(1)
         last_all_high_time_A = now
-    elif all_low_A:
+    elif not beams_A:
         if time.ticks_diff(now, last_all_high_time_A) > disconnect_delay:
             module_led_A.value(0)
 
     # Module detection B
-    states_B = [p.value() for p in beam_B_pins.values()]
-    all_high_B = all(states_B)
-    all_low_B = not any(states_B)
-    if all_high_B:
+    beams_B = inputs & BEAMS_B
+    if beams_B == BEAMS_B:
         module_led_B.value(1)
         last_all_high_time_B = now
-    elif all_low_B:
+    elif not beams_B:
         if time.ticks_diff(now, last_all_high_time_B) > disconnect_delay:
             module_led_B.value(0)
 
-    time.sleep_ms(20)
\ No newline at end of file
+def poll_ui(now):
+    # Buttons, SD card session and offload, module LEDs
+    poll_buttons()
+
+    # Mount a newly inserted card in the background; the SD LED goes out once it's removed
+    if not sd_session.poll():
+        sd_led.value(0)
+
+    # A slice of the SD offload, if one is running
+    if offload is not None:
+        step_offload()
+
+    poll_modules(now, gpio.read())
+
+def poll_rings():
+    # Breaks on the analog beams and edges from the PIO, both sit in a DMA ring until polled
+    if beam_capture is not None:
+        beam_capture.poll()
+    if pio_capture is not None:
+        pio_capture.poll()
+
+def poll_capture():
+    # Keep the clock anchor aligned with the RTC second
+    clock.poll()
+
+    # Breaks in the capture rings, then the beam events (backstop when schedule_drain is on)
+    poll_rings()
+    drain_events()
+    check_overflows()
+
+# Wakeups of the loop(s) or tasks, printed as a rate every WAKEUP_REPORT_S (0 = off)
+WAKEUP_REPORT_S = config.get("wakeup_report_s", 0)
+wakeups = 0
+wakeup_window_start = time.ticks_ms()
+
+def count_wakeup():
+    global wakeups, wakeup_window_start
+    wakeups += 1
+    if WAKEUP_REPORT_S:
+        now = time.ticks_ms()
+        elapsed = time.ticks_diff(now, wakeup_window_start)
+        if elapsed >= WAKEUP_REPORT_S * 1000:
+            print(f"{RUNTIME} runtime: {wakeups * 1000 // elapsed} wakeups/s")
+            wakeups = 0
+            wakeup_window_start = now
+
+def core1_loop():
+    # Dual runtime: files, SD and UI on core 1, so their latency never holds up core 0
+    while True:
+        count_wakeup()
+        poll_storage()
+        poll_ui(time.ticks_ms())
+        time.sleep_ms(LOOP_PERIOD_MS)
+
+# =========================================================
+# --- asyncio runtime ---
+# =========================================================
+# One task per job, each sleeping until it has work: the beam and button
+# IRQs set a ThreadSafeFlag, the clock, storage and module LEDs wake on
+# their own timers, and the SD offload gets a task only while it runs.
+MODULE_PERIOD_MS = config.get("module_period_ms", 100)
+STORAGE_PERIOD_MS = config.get("storage_period_ms", 1000)
+RING_POLL_MS = config.get("beam_ring_poll_ms", 20)
+beam_flag = None
+button_flag = None
+
+async def capture_task():
+    while True:
+        await beam_flag.wait()
+        count_wakeup()
+        drain_events()
+        check_overflows()
+
+async def ring_task(asyncio):
+    # Walks what the ADC and PIO rings collected meanwhile, a break wakes capture_task
+    while True:
+        count_wakeup()
+        poll_rings()
+        await asyncio.sleep_ms(RING_POLL_MS)
+
+async def clock_task(asyncio):
+    while True:
+        count_wakeup()
+        clock.poll()
+        await asyncio.sleep_ms(max(1, clock.idle_ms(LOOP_PERIOD_MS)))
+
+async def button_task(asyncio):
+    while True:
+        await button_flag.wait()
+        count_wakeup()
+        idle = offload is None
+        poll_buttons()
+        if idle and offload is not None:
+            asyncio.create_task(offload_task(asyncio))
+
+async def offload_task(asyncio):
+    while offload is not None:
+        count_wakeup()
+        step_offload()
+        await asyncio.sleep_ms(0)
+
+async def module_task(asyncio):
+    if module_scanner is not None:
+        # Only woken when a module is plugged in or pulled out
+        module_scanner.notify = flag = asyncio.ThreadSafeFlag()
+        while True:
+            await flag.wait()
+            count_wakeup()
+            poll_modules(time.ticks_ms(), 0)
+    while True:
+        count_wakeup()
+        poll_modules(time.ticks_ms(), gpio.read())
+        await asyncio.sleep_ms(MODULE_PERIOD_MS)
+
+async def sd_task(asyncio):
+    # Only woken by the card detect IRQ, mounts or unmounts once the pin has
+    # settled, then steps the mount between the driver's waits
+    sd_session.notify = flag = asyncio.ThreadSafeFlag()
+    while True:
+        if sd_session.mounting is not None:
+            await asyncio.sleep_ms(sd_session.wait_ms())
+        elif sd_session.pending:
+            await asyncio.sleep_ms(sd_session.settle_ms)
+        else:
+            await flag.wait()
+            continue
+        count_wakeup()
+        if not sd_session.poll():
+            sd_led.value(0)
+
+async def storage_task(asyncio):
+    while True:
+        count_wakeup()
+        poll_storage()
+        await asyncio.sleep_ms(STORAGE_PERIOD_MS)
+
+async def main_async(asyncio):
+    global beam_flag, button_flag
+    beam_flag = asyncio.ThreadSafeFlag()
+    button_flag = asyncio.ThreadSafeFlag()
+    buttons.notify = button_flag
+    asyncio.create_task(clock_task(asyncio))
+    if beam_capture is not None or pio_capture is not None:
+        asyncio.create_task(ring_task(asyncio))
+    asyncio.create_task(button_task(asyncio))
+    asyncio.create_task(module_task(asyncio))
+    asyncio.create_task(sd_task(asyncio))
+    asyncio.create_task(storage_task(asyncio))
+    print("asyncio runtime: tasks woken by the beam and button IRQs")
+    await capture_task()
+
+def report_boot():
+    # ticks_us() counts from reset, so the marks include the firmware start and imports
+    boot.mark("ready")
+    boot.report()
+    if config.get("boot_log", False):
+        boot.save("boot.txt")
+    print(f"Ready {boot.elapsed_us() // 1000} ms after reset, gates armed at {boot.elapsed_us('gates armed') // 1000} ms")
+
+def main():
+    report_boot()
+    if RUNTIME == "asyncio":
+        try:
+            import asyncio
+        except ImportError:
+            import uasyncio as asyncio
+        asyncio.run(main_async(asyncio))
+
+    if RUNTIME == "dual":
+        import _thread
+        _thread.start_new_thread(core1_loop, ())
+        print("Dual-core runtime: capture on core 0, storage and UI on core 1")
+        while True:
+            count_wakeup()
+            poll_capture()
+            time.sleep_ms(CAPTURE_PERIOD_MS)
+
+    while True:
+        count_wakeup()
+        poll_capture()
+        poll_storage()
+        poll_ui(time.ticks_ms())
+        time.sleep_ms(LOOP_PERIOD_MS)
+
+# Not run when imported (e.g. by bench.py)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Beam-break timing from analog beam receivers sampled at kHz rates.
+
+A dma_ring keeps sampling the beam channels into a ring buffer on its own;
+poll() walks the samples that came in since the last call and looks for
+breaks.  Each channel has a break level, `ratio` of its idle (unbroken)
+level measured by calibrate(), with a hysteresis band around it: a break is
+a fall through the bottom of the band and the channel re-arms only once the
+signal is back above the top, so noise and flicker near the level give a
+single edge.  The edge time is interpolated between the two samples either
+side of the bottom of the band, to a fraction of the sample period instead
+of whole milliseconds.
+
+Every break goes to on_break(index, ticks_us), index being the position of
+the channel in `pins`.  poll() has to run at least once per ring length
+(size / nch / rate_hz seconds); samples that were overwritten before it
+got to them are counted in `overruns`.
+
+Example usage:
+
+    def on_break(index, ticks):
+        print("beam", index, "broken at", ticks)
+
+    capture = AdcCapture([26, 27], on_break, rate_hz=2000)
+    capture.start()                 # calibrates on the idle beams
+    while True:
+        capture.poll()
+        time.sleep_ms(20)
+"""
+
+from array import array
+import micropython
+import time
+
+from dma_ring import make_ring
+
+
+class AdcCapture:
+    def __init__(self, pins, on_break, rate_hz=2000, size=1024, ratio=0.5, hysteresis=0.2):
+        """pins      : ADC GPIOs (26-29) in ascending order, one per beam
+        rate_hz   : samples per second per beam
+        ratio     : break level as a fraction of the idle level
+        hysteresis: width of the band around it, as a fraction of the idle level"""
+        self.ring = make_ring(pins, rate_hz, size)
+        self.nch = len(pins)
+        self.on_break = on_break
+        self.ratio = ratio
+        self.hysteresis = hysteresis
+        self.idle = array("H", bytes(2 * self.nch))
+        self.low = array("H", bytes(2 * self.nch))
+        self.high = array("H", bytes(2 * self.nch))
+        self._armed = bytearray(self.nch)
+        self._prev = array("H", bytes(2 * self.nch))
+        self._edge_prev = 0  # sample before the last break found by _scan()
+        self.done = 0
+        self.breaks = 0
+        self.overruns = 0
+
+    def start(self, calibrate_ms=50):
+        self.ring.start()
+        self.done = 0
+        if calibrate_ms:
+            time.sleep_ms(calibrate_ms)
+            self.calibrate()
+
+    def stop(self):
+        self.ring.stop()
+
+    def calibrate(self):
+        """Set the levels from the average of what's in the ring (beams unbroken)"""
+        ring = self.ring
+        end = ring.written()
+        count = min(end, ring.size) // self.nch * self.nch
+        if not count:
+            raise OSError("no ADC samples yet")
+        sums = [0] * self.nch
+        for s in range(end - count, end):
+            sums[s % self.nch] += ring.samples[ring.offset + (s & ring.mask)]
+        for i in range(self.nch):
+            idle = sums[i] * self.nch // count
+            band = int(idle * self.hysteresis / 2)
+            level = int(idle * self.ratio)
+            self.idle[i] = idle
+            self.low[i] = max(0, level - band)
+            self.high[i] = level + band
+            self._armed[i] = 1
+            self._prev[i] = idle
+        self.done = end
+
+    def poll(self):
+        """Find the breaks in the samples taken since the last call, returns how many"""
+        ring = self.ring
+        end = ring.written()
+        start = self.done
+        if end - start > ring.size:
+            self.overruns += end - start - ring.size
+            start = end - ring.size
+            start -= start % self.nch  # stay on a frame boundary
+        found = 0
+        s = self._scan(start, end)
+        while s >= 0:
+            # s: first sample of a channel below its low level
+            i = s % self.nch
+            found += 1
+            self.breaks += 1
+            self.on_break(i, self._edge_ticks(s, i))
+            s = self._scan(s + 1, end)
+        self.done = end
+        if ring.remaining() < ring.size:
+            ring.restart()
+            self.done = 0
+        else:
+            # keep the ring's time offsets short, back one frame for _edge_ticks()
+            ring.rebase(max(0, end - self.nch))
+        return found
+
+    @micropython.native
+    def _scan(self, start, end):
+        # Update the armed state up to `end`, stopping at the first break
+        samples = self.ring.samples
+        offset = self.ring.offset
+        mask = self.ring.mask
+        nch = self.nch
+        low = self.low
+        high = self.high
+        armed = self._armed
+        prev = self._prev
+        i = start % nch
+        s = start
+        while s < end:
+            value = samples[offset + (s & mask)]
+            if armed[i]:
+                if value < low[i]:
+                    armed[i] = 0
+                    self._edge_prev = prev[i]
+                    prev[i] = value
+                    return s
+            elif value > high[i]:
+                armed[i] = 1
+            prev[i] = value
+            s += 1
+            i += 1
+            if i == nch:
+                i = 0
+        return -1
+
+    def _edge_ticks(self, s, i):
+        # interpolate where the signal went through the low level, between
+        # the previous sample of the channel and this one
+        ring = self.ring
+        before = self._edge_prev
+        after = ring.samples[ring.offset + (s & ring.mask)]
+        t1 = ring.ticks_us(s)
+        if s < self.nch or before <= after:
+            return t1
+        t0 = ring.ticks_us(s - self.nch)
+        span = time.ticks_diff(t1, t0)
+        return time.ticks_add(t0, span * (before - self.low[i]) // (before - after))
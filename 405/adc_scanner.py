@@ -0,0 +1,172 @@
+"""
+Presence detection on analog inputs (e.g. an LDR lit by a module's LED).
+
+A machine.Timer samples every channel at rate_hz and keeps a moving average
+of the last `window` readings per channel, so the cost is fixed: channels x
+read_u16() per tick, whatever happens on the inputs.  Each channel has two
+thresholds, `on` and `off` = on - hysteresis; a channel becomes connected
+once its average has been above `on` for on_ms, and disconnected as soon as
+it drops below `off`.  By default `on` is calibrated at start() from the
+ambient level (the average with nothing plugged in) plus `margin`; pass
+threshold= to use a fixed value instead.  A calibration that leaves `on`
+within `hysteresis` of full scale could never be reached (a module already
+plugged in at boot, a lamp on the LDR): that channel gets `fallback` as its
+threshold instead and its name is listed in `uncalibrated`.
+
+State changes are queued like button presses: get() returns the name of the
+channel that changed, or -1, with the new state in `connected` and the
+ticks_ms in `ticks`.  Set `notify` to anything with a set() method to be
+woken on every change.
+
+Example usage:
+
+    scanner = AdcScanner({"A": ADC(26), "B": ADC(27)}, rate_hz=100)
+    scanner.start()                 # calibrate, then sample on the timer
+    while True:
+        name = scanner.get()
+        if name != -1:
+            print(name, "connected" if scanner.connected else "disconnected")
+"""
+
+from array import array
+from machine import Timer
+import time
+
+_FULL_SCALE = 65535
+
+
+class AdcScanner:
+    def __init__(self, adcs, rate_hz=100, window=8, margin=12000, hysteresis=3000,
+                 on_ms=1000, threshold=None, fallback=32768, size=8):
+        """adcs : {name: machine.ADC}"""
+        self.names = list(adcs)
+        self.adcs = [adcs[name] for name in self.names]
+        n = len(self.adcs)
+        self.rate_hz = rate_hz
+        self.window = window
+        self.margin = margin
+        self.hysteresis = hysteresis
+        self.threshold = threshold
+        self.fallback = fallback
+        self.uncalibrated = []  # names whose ambient level was implausible
+        self.on_ticks = max(1, on_ms * rate_hz // 1000)
+
+        self._samples = array("H", bytes(2 * n * window))
+        self._sums = array("L", [0] * n)
+        self._pos = 0
+        self.on = array("H", bytes(2 * n))
+        self.off = array("H", bytes(2 * n))
+        self._count = array("H", bytes(2 * n))
+        self._state = bytearray(n)
+        self._timer = Timer()
+        self._tick_ref = self._tick  # bound once so the timer doesn't allocate
+
+        # change queue
+        self.size = size
+        self._ids = bytearray(size)
+        self._states = bytearray(size)
+        self._ticks = array("L", [0] * size)
+        self.head = 0
+        self.tail = 0
+        self.overflows = 0
+        self.notify = None
+
+        # last popped change, read after get()
+        self.connected = 0
+        self.ticks = 0
+
+    def calibrate(self):
+        """Fill the averages from the inputs and set the thresholds from them"""
+        window = self.window
+        self.uncalibrated = []
+        for i, adc in enumerate(self.adcs):
+            total = 0
+            for k in range(window):
+                value = adc.read_u16()
+                self._samples[i * window + k] = value
+                total += value
+            self._sums[i] = total
+            if self.threshold is None:
+                on = total // window + self.margin
+                if on > _FULL_SCALE - self.hysteresis:
+                    on = self.fallback
+                    self.uncalibrated.append(self.names[i])
+            else:
+                on = self.threshold
+            self.on[i] = on
+            self.off[i] = max(0, on - self.hysteresis)
+        self._pos = 0
+
+    def start(self, calibrate=True):
+        if calibrate:
+            self.calibrate()
+        self._timer.init(mode=Timer.PERIODIC, freq=self.rate_hz, callback=self._tick_ref)
+
+    def stop(self):
+        self._timer.deinit()
+
+    def _tick(self, timer):
+        window = self.window
+        pos = self._pos
+        samples = self._samples
+        sums = self._sums
+        for i in range(len(self.adcs)):
+            value = self.adcs[i].read_u16()
+            slot = i * window + pos
+            sums[i] += value - samples[slot]
+            samples[slot] = value
+            average = sums[i] // window
+            if self._state[i]:
+                if average < self.off[i]:
+                    self._state[i] = 0
+                    self._count[i] = 0
+                    self._push(i, 0)
+            elif average > self.on[i]:
+                if self._count[i] < self.on_ticks:
+                    self._count[i] += 1
+                if self._count[i] >= self.on_ticks:
+                    self._state[i] = 1
+                    self._push(i, 1)
+            else:
+                self._count[i] = 0
+        pos += 1
+        self._pos = 0 if pos == window else pos
+
+    def _push(self, i, state):
+        head = self.head
+        nxt = head + 1
+        if nxt == self.size:
+            nxt = 0
+        if nxt == self.tail:
+            self.overflows += 1
+            return
+        self._ids[head] = i
+        self._states[head] = state
+        self._ticks[head] = time.ticks_ms()
+        self.head = nxt
+        if self.notify is not None:
+            self.notify.set()
+
+    def get(self):
+        """Name of the oldest channel change not yet read, -1 if there's none"""
+        tail = self.tail
+        if tail == self.head:
+            return -1
+        name = self.names[self._ids[tail]]
+        self.connected = self._states[tail]
+        self.ticks = self._ticks[tail]
+        tail += 1
+        if tail == self.size:
+            tail = 0
+        self.tail = tail
+        return name
+
+    def is_connected(self, name):
+        return self._state[self.names.index(name)] == 1
+
+    def level(self, name):
+        """Current moving average of a channel"""
+        return self._sums[self.names.index(name)] // self.window
+
+    def __len__(self):
+        return (self.head - self.tail) % self.size
@@ -0,0 +1,278 @@
+"""
+Beam-break storm benchmark for the capture path of Gates.py.
+
+Synthetic beam-break patterns are fed to the same gate callbacks the pin
+IRQs use (make_gate_callback -> drain_events -> DirectionTracker ->
+log_event), with the main loop work (clock poll, drain, log flushes) run in
+between at the main loop period.  Each pattern is played at a range of
+rates and every run reports:
+
+  * crossings expected / logged, dropped and misclassified crossings
+  * overlaps: crossings the pattern could not place because both pairs
+    were still occupied (first beam to second beam plus debounce_ms); they
+    would be ambiguous on real gates too, so they are neither played nor
+    counted as dropped
+  * ring buffer overflows
+  * ISR duration and ISR start latency percentiles (us)
+  * log write latency (writer stats)
+
+Every placed crossing respects debounce_ms on its gates, so a drop is the
+capture path's doing, not the pattern's.  Without a rate list the rates are
+swept upwards until the ring overflows, the pattern saturates (most offered
+crossings no longer fit) or MAX_RATE is reached; the report has the highest
+rate per pattern with no loss at all and where the sweep stopped.  Patterns:
+
+  crowd      random crossings on set A, both pairs, random directions
+  both_sets  every crossing happens on set A and set B at the same moment
+  bounce     crowd, each break followed by re-triggers inside the debounce
+
+On the Pico (beam modules idle, test not running):
+
+    import bench
+    bench.run(tag="v1.4")          # writes bench_v1.4.json
+
+On a PC: python 405/sim/run_bench.py --tag v1.4
+
+ISR durations measured here are the Python handler only, the IRQ entry
+overhead of the port is not included.  The patterns come from a fixed-seed
+generator, so every firmware version sees the same breaks.
+"""
+
+import json
+import os
+import sys
+import time
+from array import array
+
+import Gates
+
+PATTERNS = ("crowd", "both_sets", "bounce")
+SWEEP = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)  # crossings per second offered
+MAX_RATE = SWEEP[-1]
+
+
+class _Rand:
+    """xorshift32, same sequence on MicroPython and CPython"""
+
+    def __init__(self, seed):
+        self.state = seed or 1
+
+    def below(self, n):
+        x = self.state
+        x ^= (x << 13) & 0xFFFFFFFF
+        x ^= x >> 17
+        x ^= (x << 5) & 0xFFFFFFFF
+        self.state = x
+        return x % n
+
+
+# =========================================================
+# --- Patterns ---
+# =========================================================
+def _crossing_gates(set_id, pair, direction):
+    # (first, second) gate index, same naming rules as DirectionTracker
+    names = Gates.gate_names_A if set_id == 0 else Gates.gate_names_B
+    side = "Left" if pair == 0 else "Right"
+    first, second = ("Right", "Left") if direction == 0 else ("Left", "Right")
+    return names.index(f"{side}_{first}"), names.index(f"{side}_{second}")
+
+
+def make_pattern(name, rate, duration_ms, seed=1):
+    """returns (breaks, expected, overlaps): breaks sorted as (t_us, set_id, gate),
+    expected {(set_id, pair, direction): crossings}, overlaps the crossings
+    left out because both pairs were occupied"""
+    rand = _Rand(seed)
+    breaks = []
+    expected = {}
+    overlaps = 0
+    period_us = max(1, 1000000 // rate)
+    bounce_max = max(1, min(Gates.DEBOUNCE - 1, 50))
+    # a pair is free again once both its beams are past their debounce
+    # (+2 ms for the ms ticks the IRQ debounce compares)
+    hold_us = (Gates.DEBOUNCE + 2) * 1000
+    free_at = [0, 0]
+    t = 0
+    while True:
+        t += period_us // 2 + rand.below(period_us)  # mean spacing is one period
+        if t >= duration_ms * 1000:
+            break
+        pair = rand.below(2)
+        direction = rand.below(2)
+        gap = 60000 + rand.below(90000)  # first to second beam of a crossing
+        if free_at[pair] > t:
+            pair = 1 - pair  # someone is in that pair, take the other one
+            if free_at[pair] > t:
+                overlaps += 1
+                continue
+        free_at[pair] = t + gap + hold_us
+        for set_id in ((0, 1) if name == "both_sets" else (0,)):
+            first, second = _crossing_gates(set_id, pair, direction)
+            breaks.append((t, set_id, first))
+            breaks.append((t + gap, set_id, second))
+            if name == "bounce":
+                for gate, at in ((first, t), (second, t + gap)):
+                    for _ in range(1 + rand.below(3)):
+                        breaks.append((at + 1000 * (1 + rand.below(bounce_max)), set_id, gate))
+            key = (set_id, pair, direction)
+            expected[key] = expected.get(key, 0) + 1
+    breaks.sort()
+    return breaks, expected, overlaps
+
+
+# =========================================================
+# --- Running a pattern ---
+# =========================================================
+def _percentiles(values, n):
+    if not n:
+        return {"p50": 0, "p90": 0, "p99": 0, "max": 0}
+    v = sorted(values[:n])
+    return {"p50": v[n * 50 // 100], "p90": v[n * 90 // 100], "p99": v[n * 99 // 100], "max": v[-1]}
+
+
+def _loop_step():
+    # the part of Gates.main() that handles captured events
+    Gates.poll_capture()
+    Gates.poll_storage()
+
+
+def _replay(breaks, callbacks, isr_us, late_us):
+    n = len(breaks)
+    loop_us = Gates.LOOP_PERIOD_MS * 1000
+    next_loop = loop_us
+    start = time.ticks_add(time.ticks_us(), 1000)
+    i = 0
+    while i < n:
+        now = time.ticks_diff(time.ticks_us(), start)
+        due, set_id, gate = breaks[i]
+        if now >= due:
+            t0 = time.ticks_us()
+            callbacks[set_id][gate](None)
+            isr_us[i] = min(time.ticks_diff(time.ticks_us(), t0), 65535)
+            late_us[i] = time.ticks_diff(t0, start) - due
+            i += 1
+        elif now >= next_loop:
+            _loop_step()
+            next_loop += loop_us
+        else:
+            time.sleep_us(min(due, next_loop) - now)
+    # let the last crossings drain like the main loop would
+    for _ in range(3):
+        time.sleep_ms(Gates.LOOP_PERIOD_MS)
+        _loop_step()
+
+
+def run_pattern(name, rate, duration_ms=3000, seed=1):
+    breaks, expected, overlaps = make_pattern(name, rate, duration_ms, seed)
+    sets = ("A", "B") if name == "both_sets" else ("A",)
+    logged = {}
+    log_event = Gates.log_event
+
+    def capture(stamp, pair, direction, set_label, gate=0):
+        key = (0 if set_label == "A" else 1, pair, direction)
+        logged[key] = logged.get(key, 0) + 1
+        log_event(stamp, pair, direction, set_label, gate)
+
+    Gates.log_event = capture
+    callbacks = []
+    for last_trigger, set_label in ((Gates.last_trigger_A, "A"), (Gates.last_trigger_B, "B")):
+        callbacks.append([Gates.make_gate_callback(g, last_trigger, set_label) for g in range(len(last_trigger))])
+        for g in range(len(last_trigger)):
+            last_trigger[g] = time.ticks_add(time.ticks_ms(), -Gates.DEBOUNCE - 1)
+    overflows = Gates.beam_events.overflows
+    isr_us = array("H", [0] * len(breaks))
+    late_us = array("l", [0] * len(breaks))
+
+    writers = []
+    try:
+        for set_label in sets:
+            Gates.start_new_test(set_label)
+            writers.append(Gates.writer_A if set_label == "A" else Gates.writer_B)
+        _replay(breaks, callbacks, isr_us, late_us)
+    finally:
+        for set_label in sets:
+            Gates.stop_test(set_label)
+        Gates.log_event = log_event
+        for writer in writers:
+            try:
+                os.remove(writer.path)
+            except OSError:
+                pass
+
+    total = sum(expected.values())
+    correct = sum(min(count, logged.get(key, 0)) for key, count in expected.items())
+    stats = [w.stats() for w in writers]
+    return {
+        "pattern": name,
+        "rate": rate,
+        "duration_ms": duration_ms,
+        "breaks": len(breaks),
+        "crossings": total,
+        "overlaps": overlaps,
+        "logged": sum(logged.values()),
+        "dropped": total - correct,
+        "misclassified": sum(logged.values()) - correct,
+        "overflows": Gates.beam_events.overflows - overflows,
+        "isr_us": _percentiles(isr_us, len(breaks)),
+        "latency_us": _percentiles(late_us, len(breaks)),
+        "write_us": {
+            "flushes": sum(s["flushes"] for s in stats),
+            "avg": max(s["flush_us_avg"] for s in stats),
+            "max": max(s["flush_us_max"] for s in stats),
+        },
+    }
+
+
+# =========================================================
+# --- Suite ---
+# =========================================================
+def run(tag="dev", patterns=PATTERNS, rates=None, duration_ms=3000, path=None):
+    """rates: crossings per second to play, None sweeps SWEEP until the ring
+    overflows or the pattern saturates"""
+    results = []
+    max_rate = {}
+    stopped = {}  # why and where each pattern's sweep ended, empty with a rate list
+    for name in patterns:
+        max_rate[name] = 0
+        for rate in rates or SWEEP:
+            r = run_pattern(name, rate, duration_ms)
+            results.append(r)
+            lossless = not (r["dropped"] or r["misclassified"] or r["overflows"])
+            if lossless and rate > max_rate[name]:
+                max_rate[name] = rate
+            print(f"BENCH {name:9s} {rate:4d}/s crossings {r['crossings']:4d} overlaps {r['overlaps']:4d} "
+                  f"dropped {r['dropped']:4d} misclassified {r['misclassified']:4d} overflows {r['overflows']:3d} "
+                  f"isr p99 {r['isr_us']['p99']}us write max {r['write_us']['max']}us")
+            if rates:
+                continue
+            if r["overflows"]:
+                stopped[name] = {"reason": "overflow", "rate": rate}
+                break
+            if r["overlaps"] > r["crossings"]:
+                # most offered crossings no longer fit the pairs, more rate adds nothing
+                stopped[name] = {"reason": "saturated", "rate": rate}
+                break
+        if not rates and name not in stopped:
+            stopped[name] = {"reason": "max_rate", "rate": MAX_RATE}
+    report = {
+        "tag": tag,
+        "platform": sys.platform,
+        "config": {
+            "debounce_ms": Gates.DEBOUNCE,
+            "event_buffer_size": Gates.beam_events.size,
+            "schedule_drain": Gates.SCHEDULE_DRAIN,
+            "log_format": Gates.LOG_FORMAT,
+        },
+        "max_rate": max_rate,
+        "sweep_stopped": stopped,
+        "results": results,
+    }
+    if path is None:
+        path = f"bench_{tag}.json"
+    with open(path, "w") as f:
+        json.dump(report, f)
+    print(f"Benchmark results saved to {path}")
+    return report
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,142 @@
+"""
+Write-through sector cache for a block device (e.g. sdcard.SDCard).
+
+While a download copies many small files, the FAT driver reads the same FAT
+and directory sectors again and again, each one a full CMD17 round trip.
+BlockCache keeps the last `slots` single-sector reads and writes in RAM and
+evicts the least recently used one.  Writes always go straight to the
+device, so nothing is lost on unmount or card removal; multi-sector
+transfers (file data) bypass the cache so they don't evict the FAT and
+directory sectors, and any cached copy they overwrite is refreshed.
+
+Set read_through while reading back something just written to check it
+(sdsync verify): single-sector reads then come from the device, refreshing
+the slots they hit, instead of returning the copy the write left in RAM.
+
+RAM used is slots * 512 bytes, allocated once.  Use the hit/miss counters
+to size it:
+
+    cache = BlockCache(sdcard.SDCard(spi, cs), slots=8)
+    os.mount(os.VfsFat(cache), "/sd")
+    ...
+    print(cache.stats())   # {'slots': 8, 'hits': 412, 'misses': 37, ...}
+"""
+
+from array import array
+
+_EMPTY = -1
+_TICK_LIMIT = 1 << 29  # keep the LRU stamps small ints
+
+
+class BlockCache:
+    def __init__(self, dev, slots=8):
+        self.dev = dev
+        self.slots = slots
+        self._data = bytearray(slots * 512)
+        self._mv = memoryview(self._data)
+        self._blocks = array("l", [_EMPTY] * slots)  # sector held by each slot
+        self._used = array("L", [0] * slots)  # LRU stamp per slot
+        self._tick = 0
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.bypassed = 0  # multi-sector transfers sent straight to the device
+        self.read_through = False  # read from the device even on a hit
+
+    def attach(self, dev):
+        """Reuse the buffers for another device (e.g. the card was swapped)"""
+        self.dev = dev
+        self.invalidate()
+
+    def invalidate(self):
+        for slot in range(self.slots):
+            self._blocks[slot] = _EMPTY
+
+    def _find(self, block_num):
+        blocks = self._blocks
+        for slot in range(self.slots):
+            if blocks[slot] == block_num:
+                return slot
+        return -1
+
+    def _touch(self, slot):
+        self._tick += 1
+        if self._tick >= _TICK_LIMIT:
+            # restart the stamps, keeping the order
+            order = sorted(range(self.slots), key=lambda s: self._used[s])
+            for rank, s in enumerate(order):
+                self._used[s] = rank
+            self._tick = self.slots
+        self._used[slot] = self._tick
+
+    def _victim(self):
+        # an empty slot, else the least recently used one
+        blocks = self._blocks
+        used = self._used
+        victim = 0
+        for slot in range(self.slots):
+            if blocks[slot] == _EMPTY:
+                return slot
+            if used[slot] < used[victim]:
+                victim = slot
+        return victim
+
+    def _slot_view(self, slot):
+        return self._mv[slot * 512 : slot * 512 + 512]
+
+    def readblocks(self, block_num, buf):
+        if len(buf) != 512:
+            self.bypassed += 1
+            return self.dev.readblocks(block_num, buf)
+        slot = self._find(block_num)
+        if slot >= 0 and not self.read_through:
+            self.hits += 1
+        else:
+            self.misses += 1
+            if slot < 0:
+                slot = self._victim()
+            self._blocks[slot] = _EMPTY  # stays empty if the read fails
+            self.dev.readblocks(block_num, self._slot_view(slot))
+            self._blocks[slot] = block_num
+        self._touch(slot)
+        buf[:] = self._slot_view(slot)
+
+    def writeblocks(self, block_num, buf):
+        self.dev.writeblocks(block_num, buf)
+        self.writes += 1
+        nblocks = len(buf) // 512
+        if nblocks == 1:
+            slot = self._find(block_num)
+            if slot < 0:
+                slot = self._victim()
+            self._slot_view(slot)[:] = buf
+            self._blocks[slot] = block_num
+            self._touch(slot)
+            return
+        self.bypassed += 1
+        mv = memoryview(buf)
+        for slot in range(self.slots):
+            offset = self._blocks[slot] - block_num
+            if 0 <= offset < nblocks:
+                self._slot_view(slot)[:] = mv[offset * 512 : offset * 512 + 512]
+
+    def ioctl(self, op, arg):
+        if op == 1 or op == 2:  # init / deinit: the card may have changed
+            self.invalidate()
+        elif op == 6:  # erase block arg
+            slot = self._find(arg)
+            if slot >= 0:
+                self._blocks[slot] = _EMPTY
+        # op 3 (sync) has nothing to flush: every write already reached the device
+        return self.dev.ioctl(op, arg)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "slots": self.slots,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits * 100 // lookups if lookups else 0,
+            "writes": self.writes,
+            "bypassed": self.bypassed,
+        }
@@ -0,0 +1,63 @@
+"""
+Timeline of the boot, one time.ticks_us() mark per init phase.
+
+ticks_us() counts from reset, so a mark is also the time since power-on
+(or a brown-out reset), including the firmware start and the imports before
+the first mark.  mark() only stores the name and the ticks; report() prints
+the timeline and save() appends it to a file on flash, so boots that never
+reach a console can be looked at later.
+
+Example usage:
+
+    boot = BootProfile()
+    boot.mark("imports")
+    ...
+    boot.mark("gates armed")
+    boot.report()
+    boot.save("boot.txt")
+
+    imports          41.2 ms  (+41.2)
+    gates armed      52.9 ms  (+11.7)
+"""
+
+import time
+
+
+class BootProfile:
+    def __init__(self):
+        self.names = []
+        self.ticks = []
+
+    def mark(self, name):
+        self.ticks.append(time.ticks_us())
+        self.names.append(name)
+
+    def elapsed_us(self, name=None):
+        """Microseconds from reset to the mark `name` (default: the last one)"""
+        if not self.ticks:
+            return 0
+        if name is None:
+            return self.ticks[-1]
+        return self.ticks[self.names.index(name)]
+
+    def lines(self):
+        width = max(len(name) for name in self.names) if self.names else 0
+        previous = 0
+        for name, ticks in zip(self.names, self.ticks):
+            yield f"{name:<{width}} {ticks / 1000:8.1f} ms  (+{time.ticks_diff(ticks, previous) / 1000:.1f})"
+            previous = ticks
+
+    def report(self):
+        print("Boot timeline (since reset):")
+        for line in self.lines():
+            print("  " + line)
+
+    def save(self, path="boot.txt"):
+        """Append the timeline to `path`, one boot per block"""
+        try:
+            with open(path, "a") as f:
+                f.write("--- boot\n")
+                for line in self.lines():
+                    f.write(line + "\n")
+        except OSError as e:
+            print("Boot timeline not saved:", e)
@@ -0,0 +1,67 @@
+"""
+Compiles the modules listed in manifest.py to .mpy with mpy-cross, for a
+stock MicroPython firmware (freezing them needs a custom build).
+
+    python 405/build_mpy.py                 # -> 405/build/*.mpy
+    python 405/build_mpy.py --out DIR
+
+Copy the .mpy files to the Pico and delete the .py files of the same name
+there: imports take the .py first.  mpy-cross comes with MicroPython or from
+pip (pip install mpy-cross); its version has to match the firmware's .mpy
+version.  The modules are built for the RP2040 (-march=armv6m), so
+@micropython.native functions stay native.
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def manifest_modules(path=os.path.join(HERE, "manifest.py")):
+    """Source paths of the module() entries in the manifest, include() skipped"""
+    found = []
+
+    def module(name, base_path="."):
+        found.append(os.path.normpath(os.path.join(os.path.dirname(path), base_path, name)))
+
+    def include(manifest, **kwargs):
+        pass  # the port's own manifest
+
+    with open(path) as f:
+        exec(f.read(), {"module": module, "include": include})
+    return found
+
+
+def mpy_cross():
+    """Command line that runs mpy-cross, from PATH or the pip package"""
+    exe = shutil.which("mpy-cross")
+    if exe:
+        return [exe]
+    try:
+        import mpy_cross  # noqa: F401
+    except ImportError:
+        sys.exit("mpy-cross not found: install MicroPython's mpy-cross or pip install mpy-cross")
+    return [sys.executable, "-m", "mpy_cross"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the manifest modules to .mpy")
+    parser.add_argument("--out", default=os.path.join(HERE, "build"), help="output folder")
+    parser.add_argument("--march", default="armv6m", help="native code target (armv6m = RP2040)")
+    args = parser.parse_args()
+
+    command = mpy_cross()
+    os.makedirs(args.out, exist_ok=True)
+    for source in manifest_modules():
+        name = os.path.splitext(os.path.basename(source))[0] + ".mpy"
+        target = os.path.join(args.out, name)
+        subprocess.run(command + [f"-march={args.march}", "-o", target, source], check=True)
+        print(f"{name:18s} {os.path.getsize(source):6d} -> {os.path.getsize(target):6d} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Push buttons read by interrupts, debounced with a one-shot timer.
+
+A falling edge arms a one-shot machine.Timer for the button and further
+edges are ignored until it fires.  When it fires the pin is read again: if
+the button is still held the press is put in a queue, if the edge was a
+bounce or glitch (or the bounce of a release) nothing happens.  Between
+presses the buttons cost nothing, and nothing ever waits for a release, so
+the rest of the program keeps running while a button is held.  A press
+within min_interval_ms of the last accepted press of the same button is
+dropped too, so a double press doesn't start and stop a test.
+
+The queue is a preallocated ring of button ids with the ticks_us of each
+press's first edge, so a press is timed when it happened rather than when
+the queue was read; get() returns -1 when it's empty.  A press that finds the queue full
+is dropped and counted in `overflows`.  Set `notify` to anything with a
+set() method (e.g. asyncio.ThreadSafeFlag) to be woken on every press.
+
+Example usage:
+
+    buttons = Buttons({"start": Pin(14, Pin.IN, Pin.PULL_UP),
+                       "stop": Pin(15, Pin.IN, Pin.PULL_UP)}, debounce_ms=50, min_interval_ms=300)
+    while True:
+        name = buttons.get()
+        if name == "start":
+            print("start pressed at", clock.stamp(buttons.ticks))
+"""
+
+from array import array
+from machine import Pin, Timer
+import time
+
+
+class Buttons:
+    def __init__(self, pins, debounce_ms=50, min_interval_ms=0, size=8):
+        """pins            : {name: Pin} of buttons that pull the pin low when pressed
+        min_interval_ms : shortest time between two accepted presses of a button"""
+        self.names = list(pins)
+        self.pins = [pins[name] for name in self.names]
+        self.debounce_ms = debounce_ms
+        self.min_interval_ms = min_interval_ms
+        self.size = size
+        self._ids = bytearray(size)
+        self._ticks = array("L", [0] * size)
+        self._armed = bytearray(len(self.pins))
+        self._edge = array("L", [0] * len(self.pins))  # ticks_us of the edge that armed the timer
+        # ticks_ms of the last accepted press, a first press is never too soon
+        self._last = array("L", [time.ticks_add(time.ticks_ms(), -min_interval_ms)] * len(self.pins))
+        self._timers = [Timer() for _ in self.pins]
+        self.head = 0
+        self.tail = 0
+        self.overflows = 0
+        self.notify = None
+
+        # last popped press, read after get()
+        self.ticks = 0
+
+        # handlers made once, so the IRQs don't allocate
+        self._confirms = [self._make_confirm(i) for i in range(len(self.pins))]
+        for i, pin in enumerate(self.pins):
+            pin.irq(trigger=Pin.IRQ_FALLING, handler=self._make_edge(i))
+
+    def _make_edge(self, i):
+        def edge(pin):
+            if self._armed[i]:
+                return  # bounce, the timer is already running
+            self._armed[i] = 1
+            self._edge[i] = time.ticks_us()
+            self._timers[i].init(mode=Timer.ONE_SHOT, period=self.debounce_ms, callback=self._confirms[i])
+        return edge
+
+    def _make_confirm(self, i):
+        def confirm(timer):
+            self._armed[i] = 0
+            if self.pins[i].value() == 0:
+                now = time.ticks_ms()
+                if time.ticks_diff(now, self._last[i]) >= self.min_interval_ms:
+                    self._last[i] = now
+                    self._push(i)
+        return confirm
+
+    def _push(self, i):
+        head = self.head
+        nxt = head + 1
+        if nxt == self.size:
+            nxt = 0
+        if nxt == self.tail:
+            self.overflows += 1
+            return
+        self._ids[head] = i
+        self._ticks[head] = self._edge[i]
+        self.head = nxt
+        if self.notify is not None:
+            self.notify.set()
+
+    def get(self):
+        """Name of the oldest press not yet read, -1 if there's none"""
+        tail = self.tail
+        if tail == self.head:
+            return -1
+        name = self.names[self._ids[tail]]
+        self.ticks = self._ticks[tail]
+        tail += 1
+        if tail == self.size:
+            tail = 0
+        self.tail = tail
+        return name
+
+    def clear(self):
+        self.tail = self.head
+
+    def deinit(self):
+        for pin, timer in zip(self.pins, self._timers):
+            pin.irq(handler=None)
+            timer.deinit()
+
+    def __len__(self):
+        return (self.head - self.tail) % self.size
@@ -0,0 +1,217 @@
+"""
+config.json, validated once and cached as a Python module.
+
+load() parses config.json, fills in the defaults of every optional key and
+checks the pins once, and writes the result to config_c.py as a dict
+literal with the size and mtime of the JSON it came from and the SCHEMA of
+the firmware that checked it:
+
+    # Generated by config_cache.py from config.json, do not edit
+    SOURCE = (1234, 56789, 4)
+    CONFIG = {...}
+
+Later boots import that module instead, skipping the JSON and the checks,
+as long as config.json still has the same size and mtime and SCHEMA is
+unchanged.  Editing config.json (or deleting config_c.py) makes the next
+boot rebuild it; so does firmware with a new SCHEMA.  Whether this saves
+boot time on a given board shows in Gates.py's boot timeline, which marks
+the phase as "config (json)" or "config (cache)".
+
+Checks: required keys present, pins are GPIO 0-29, no GPIO used twice, the
+module ADC pins belong to a set and are ADC inputs, and the choice keys hold
+one of their known values.  Problems raise ValueError
+listing all of them.
+
+Also runs on a PC to check a config before copying it:
+
+    python config_cache.py config.json
+
+Example usage:
+
+    config, cached = config_cache.load("config.json")
+    print(config["spi"]["max_baudrate"])   # default filled in
+"""
+
+import json
+import os
+
+CACHE_MODULE = "config_c"
+
+# Part of the cache key: bump it whenever REQUIRED, DEFAULTS, CHOICES or the
+# checks in validate() change, so a config_c.py built by older firmware is
+# rebuilt instead of used
+SCHEMA = 4
+
+REQUIRED = (
+    "debounce_ms", "data_dir", "sd_destination",
+    "status_led_A_pin", "status_led_B_pin", "sd_led_pin",
+    "module_led_A_pin", "module_led_B_pin",
+    "test_button_pin_A", "test_button_pin_B", "download_button_pin",
+    "beam_pins_A", "beam_pins_B", "rtc_i2c", "spi", "sd_detect_pin",
+)
+REQUIRED_RTC_I2C = ("scl", "sda", "freq")
+REQUIRED_SPI = ("sck", "mosi", "miso", "baudrate", "cs")
+
+# Optional keys and the value used when they are missing
+DEFAULTS = {
+    "rtc_sqw_pin": None,
+    "rtc_resync_min": 10,
+    "rtc_sync_s": 60,
+    "timestamp_digits": 3,
+    "log_format": "bin",
+    "csv_buffer_bytes": 1024,
+    "csv_flush_ms": 5000,
+    "beam_adc_rate_hz": 0,
+    "beam_adc_ring_samples": 2048,
+    "beam_capture": "irq",
+    "pio_sm": 0,
+    "pio_tick_us": 1,
+    "pio_glitch_ticks": 2,
+    "pio_ring_words": 256,
+    "beam_ring_poll_ms": 20,
+    "crossing_timeout_ms": 2000,
+    "event_buffer_size": 64,
+    "schedule_drain": False,
+    "runtime": "single",
+    "capture_period_ms": 1,
+    "crossing_queue_size": 64,
+    "copy_buffer_bytes": 32768,
+    "sd_sync": True,
+    "offload_slice_ms": 5,
+    "offload_chunk_bytes": 4096,
+    "sd_cache_slots": 0,
+    "sd_settle_ms": 250,
+    "button_debounce_ms": 50,
+    "download_debounce_ms": 300,
+    "loop_period_ms": 20,
+    "module_adc_pins": None,
+    "module_adc_rate_hz": 100,
+    "module_adc_on_ms": 1000,
+    "module_period_ms": 100,
+    "storage_period_ms": 1000,
+    "wakeup_report_s": 0,
+    "boot_log": False,
+}
+DEFAULTS_SPI = {"max_baudrate": 25000000}
+
+CHOICES = {
+    "runtime": ("single", "dual", "asyncio"),
+    "log_format": ("bin", "csv"),
+    "beam_capture": ("irq", "pio"),
+}
+
+# module_adc_pins: one LDR per set, each on an ADC input
+MODULE_SETS = ("A", "B")
+ADC_PINS = (26, 27, 28)
+
+# Single pins, beside the beam, I2C, SPI and ADC pin groups
+PIN_KEYS = (
+    "status_led_A_pin", "status_led_B_pin", "sd_led_pin",
+    "module_led_A_pin", "module_led_B_pin",
+    "test_button_pin_A", "test_button_pin_B", "download_button_pin",
+    "sd_detect_pin", "rtc_sqw_pin", "pause_signal_pin",
+)
+
+
+def used_pins(config):
+    """(gpio, name) of every pin the config assigns"""
+    pins = []
+    for key in PIN_KEYS:
+        if config.get(key) is not None:
+            pins.append((config[key], key))
+    for group in ("beam_pins_A", "beam_pins_B", "module_adc_pins"):
+        for name, pin in (config.get(group) or {}).items():
+            pins.append((pin, f"{group}.{name}"))
+    for group, keys in (("rtc_i2c", ("scl", "sda")), ("spi", ("sck", "mosi", "miso", "cs"))):
+        for key in keys:
+            if key in config.get(group, {}):
+                pins.append((config[group][key], f"{group}.{key}"))
+    return pins
+
+
+def validate(config):
+    """config with the defaults filled in, raises ValueError listing every problem"""
+    problems = []
+    for key in REQUIRED:
+        if key not in config:
+            problems.append(f"missing {key}")
+    for group, keys in (("rtc_i2c", REQUIRED_RTC_I2C), ("spi", REQUIRED_SPI)):
+        for key in keys:
+            if group in config and key not in config[group]:
+                problems.append(f"missing {group}.{key}")
+    for key, allowed in CHOICES.items():
+        if key in config and config[key] not in allowed:
+            problems.append(f"{key} must be one of {allowed}, not {config[key]!r}")
+
+    for name, pin in (config.get("module_adc_pins") or {}).items():
+        if name not in MODULE_SETS:
+            problems.append(f"module_adc_pins.{name}: not a set, use one of {MODULE_SETS}")
+        if pin not in ADC_PINS:
+            problems.append(f"module_adc_pins.{name}: {pin!r} is not an ADC pin {ADC_PINS}")
+
+    owner = {}
+    for pin, name in used_pins(config):
+        if not isinstance(pin, int) or not 0 <= pin <= 29:
+            problems.append(f"{name}: {pin!r} is not a GPIO (0-29)")
+        elif pin in owner:
+            problems.append(f"GPIO {pin} used by both {owner[pin]} and {name}")
+        else:
+            owner[pin] = name
+    if problems:
+        raise ValueError("config: " + "; ".join(problems))
+
+    full = dict(DEFAULTS)
+    full.update(config)
+    spi = dict(DEFAULTS_SPI)
+    spi.update(config["spi"])
+    full["spi"] = spi
+    return full
+
+
+def _source(path):
+    st = os.stat(path)
+    return (st[6], st[8], SCHEMA)  # size, mtime, schema
+
+
+def write_cache(config, source, module=CACHE_MODULE):
+    # written next to it and renamed, so a reset mid-write leaves no half module
+    tmp = module + ".tmp"
+    with open(tmp, "w") as f:
+        f.write("# Generated by config_cache.py from config.json, do not edit\n")
+        f.write(f"SOURCE = {source!r}\n")
+        f.write(f"CONFIG = {config!r}\n")
+    try:
+        os.rename(tmp, module + ".py")
+    except OSError:
+        os.remove(module + ".py")  # filesystems that won't rename over a file
+        os.rename(tmp, module + ".py")
+
+
+def load(path="config.json", module=CACHE_MODULE):
+    """(config, cached): the cached config when it matches `path`, otherwise
+    the validated JSON (and the cache rewritten)"""
+    source = _source(path)
+    try:
+        cache = __import__(module)
+        if tuple(cache.SOURCE) == source:
+            return cache.CONFIG, True
+    except (ImportError, SyntaxError, AttributeError):
+        pass  # no cache yet, or a broken one: rebuilt below
+
+    with open(path, "r") as f:
+        config = validate(json.load(f))
+    try:
+        write_cache(config, source, module)
+    except OSError as e:
+        print("Config cache not written:", e)  # e.g. read-only filesystem
+    return config, False
+
+
+if __name__ == "__main__":
+    import sys
+
+    with open(sys.argv[1] if len(sys.argv) > 1 else "config.json") as f:
+        checked = validate(json.load(f))
+    for pin, name in sorted(used_pins(checked)):
+        print(f"GPIO {pin:2}: {name}")
+    print("OK")
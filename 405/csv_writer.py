@@ -0,0 +1,95 @@
+"""
+Buffered CSV writer that keeps the log file open for the whole test.
+
+Rows are collected in a preallocated bytearray and written to the file in
+one go when the buffer is full or when the oldest buffered row is older than
+flush_ms.  close() always flushes, so call it when the test stops.
+
+Example usage:
+
+    log = CSVWriter("Data/test.csv", header="Time,Pair,Direction\\n")
+    log.write_row("12:00:00,Left Pair,Right\\n")
+    log.poll()      # from the main loop, flushes on the time threshold
+    log.close()
+    print(log.stats())
+"""
+
+import time
+
+
+class CSVWriter:
+    def __init__(self, path, header=None, buf_size=1024, flush_ms=5000):
+        self.path = path
+        self.flush_ms = flush_ms
+        self._buf = bytearray(buf_size)
+        self._mv = memoryview(self._buf)
+        self._len = 0
+        self._oldest = 0  # ticks_ms of the oldest buffered row
+
+        # flush statistics
+        self.rows = 0
+        self.bytes_written = 0
+        self.flushes = 0
+        self.size_flushes = 0
+        self.time_flushes = 0
+        self.flush_us_total = 0
+        self.flush_us_max = 0
+
+        self._f = open(path, "w" if header else "a")
+        if header:
+            self._f.write(header)
+            self._f.flush()
+
+    def write_row(self, row):
+        data = row.encode()
+        n = len(data)
+        if self._len + n > len(self._buf):
+            self.size_flushes += 1
+            self.flush()
+        if n > len(self._buf):
+            # larger than the whole buffer, write it straight through
+            self._f.write(data)
+            self.bytes_written += n
+        else:
+            if not self._len:
+                self._oldest = time.ticks_ms()
+            self._mv[self._len : self._len + n] = data
+            self._len += n
+        self.rows += 1
+
+    def poll(self):
+        if self._len and time.ticks_diff(time.ticks_ms(), self._oldest) >= self.flush_ms:
+            self.time_flushes += 1
+            self.flush()
+
+    def flush(self):
+        if not self._len:
+            return
+        start = time.ticks_us()
+        self._f.write(self._mv[: self._len])
+        self._f.flush()
+        elapsed = time.ticks_diff(time.ticks_us(), start)
+        self.bytes_written += self._len
+        self._len = 0
+        self.flushes += 1
+        self.flush_us_total += elapsed
+        if elapsed > self.flush_us_max:
+            self.flush_us_max = elapsed
+
+    def close(self):
+        if self._f is None:
+            return
+        self.flush()
+        self._f.close()
+        self._f = None
+
+    def stats(self):
+        return {
+            "rows": self.rows,
+            "bytes": self.bytes_written,
+            "flushes": self.flushes,
+            "size_flushes": self.size_flushes,
+            "time_flushes": self.time_flushes,
+            "flush_us_avg": self.flush_us_total // self.flushes if self.flushes else 0,
+            "flush_us_max": self.flush_us_max,
+        }
@@ -0,0 +1,69 @@
+"""
+Per-pair direction detection for one set of beam gates.
+
+Each gate index is mapped once, from its config name "<Pair>_<Beam>"
+(e.g. "Left_Right" = Right beam of the Left Pair), to a pair and a beam
+side.  After that every event is a couple of array lookups:
+
+  * no half crossing pending on the pair -> remember the side and time
+  * the other beam of the pair breaks within timeout_ms -> crossing complete,
+    direction is where the person went (Left beam first = Right)
+  * the same beam again, or the pending half is older than timeout_ms ->
+    the old half is counted as abandoned and the new break starts over
+
+The pairs are tracked independently, so traffic through both pairs at the
+same time doesn't interfere.
+
+Example usage:
+
+    tracker = DirectionTracker(["Right_Left", "Right_Right", "Left_Left", "Left_Right"])
+    direction = tracker.event(gate, ticks_us)
+    if direction >= 0:
+        print(PAIRS[tracker.pair], DIRECTIONS[direction])
+"""
+
+import time
+from array import array
+
+_SIDES = ("Left", "Right")
+
+
+class DirectionTracker:
+    def __init__(self, gate_names, timeout_ms=2000):
+        self._pair = array("B", bytes(len(gate_names)))
+        self._side = array("B", bytes(len(gate_names)))
+        for gate, name in enumerate(gate_names):
+            pair, _, side = name.partition("_")
+            if pair not in _SIDES or side not in _SIDES:
+                raise ValueError(f"gate name {name!r} is not <Left|Right>_<Left|Right>")
+            self._pair[gate] = _SIDES.index(pair)
+            self._side[gate] = _SIDES.index(side)
+        self.timeout_us = timeout_ms * 1000
+        self._pending = array("b", [-1, -1])  # side of the half crossing per pair, -1 = none
+        self._since = array("L", [0, 0])  # ticks_us of that first break
+        self.pair = 0  # pair of the last completed crossing
+        self.crossings = 0
+        self.abandoned = 0
+
+    def reset(self):
+        self._pending[0] = -1
+        self._pending[1] = -1
+        self.crossings = 0
+        self.abandoned = 0
+
+    def event(self, gate, ticks):
+        """Feed one beam break; returns the direction (0 Left, 1 Right) if it
+        completes a crossing (pair in self.pair), otherwise -1"""
+        pair = self._pair[gate]
+        side = self._side[gate]
+        pending = self._pending[pair]
+        if pending >= 0:
+            if pending != side and time.ticks_diff(ticks, self._since[pair]) <= self.timeout_us:
+                self._pending[pair] = -1
+                self.pair = pair
+                self.crossings += 1
+                return 1 if pending == 0 else 0
+            self.abandoned += 1
+        self._pending[pair] = side
+        self._since[pair] = ticks
+        return -1
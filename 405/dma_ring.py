@@ -0,0 +1,245 @@
+"""
+Ring buffer of ADC samples taken at a fixed rate without the CPU.
+
+On the RP2040 the ADC converts the enabled channels in round robin into its
+FIFO, paced by its own clock divider, and a DMA channel copies every result
+into a ring of 16-bit samples.  The DMA write address wraps in hardware
+(ring_size), so the ring must be aligned to its size; a buffer twice as big
+is allocated and the aligned half used.  Nothing runs per sample: the
+consumer reads `written()` (samples written since start, all channels
+interleaved in ascending channel order) and the samples behind it.
+
+FifoRing is the DMA part on its own, for other FIFOs (pio_capture.py uses
+it for a PIO state machine's RX FIFO).
+
+Where rp2.DMA isn't available (older firmware, other ports, the simulator)
+TimerRing fills the same ring from a machine.Timer callback with
+ADC.read_u16(), one frame of all channels per tick, and keeps the
+ticks_us of every frame.
+
+Both give sample s of the stream at samples[offset + (s & mask)], for
+channel s % nch, taken at ticks_us(s).  The consumer calls rebase(s) with
+the last sample it is done with, so the DMA ring's time offsets stay far
+below the 2^29 us that time.ticks_add() accepts.
+Values are 12 bit (0-4095).  While the DMA ring runs the ADC belongs to it:
+ADC.read_u16() from other code would break the round robin.
+
+Example usage:
+
+    ring = make_ring([26, 27], rate_hz=2000, size=1024)
+    ring.start()
+    end = ring.written()
+    value = ring.samples[ring.offset + ((end - 1) & ring.mask)]
+"""
+
+from array import array
+from machine import ADC, Timer
+import time
+
+try:
+    from rp2 import DMA
+    from machine import mem32
+    import uctypes
+except ImportError:
+    DMA = None
+
+_ADC_BASE = 0x4004C000
+_ADC_CS = _ADC_BASE + 0x00
+_ADC_FCS = _ADC_BASE + 0x08
+_ADC_FIFO = _ADC_BASE + 0x0C
+_ADC_DIV = _ADC_BASE + 0x10
+_CS_EN = 1 << 0
+_CS_START_MANY = 1 << 3
+_FCS_EN = 1 << 0
+_FCS_DREQ_EN = 1 << 3
+_FCS_EMPTY = 1 << 8
+_FCS_THRESH_1 = 1 << 24
+_DREQ_ADC = 36
+_ADC_CLOCK_HZ = 48000000
+_UNITS_PER_US = _ADC_CLOCK_HZ // 1000000 * 256  # period is in 1/256 ADC cycles
+_MIN_CYCLES = 96  # 500 ksps
+_MAX_DIV = 0xFFFFFF  # DIV is INT (16 bits) . FRAC (8 bits)
+_COUNT = 0x3FFFFFFF  # stays a small int; restart() before it runs out
+
+
+def _channel(pin):
+    return pin - 26 if pin >= 26 else pin
+
+
+class FifoRing:
+    """Words read from a peripheral FIFO by DMA into an aligned ring, `buf`
+    holds the ring at buf[offset:offset + size]; typecode "H" or "L"."""
+
+    def __init__(self, read_addr, dreq, size=256, typecode="L"):
+        itemsize = 2 if typecode == "H" else 4
+        self.size = size
+        self.mask = size - 1
+        nbytes = itemsize * size
+        self.buf = array(typecode, bytes(2 * nbytes))
+        base = uctypes.addressof(self.buf)
+        aligned = (base + nbytes - 1) & ~(nbytes - 1)
+        self.offset = (aligned - base) // itemsize
+        self._addr = aligned
+        self._read_addr = read_addr
+        self._dma = DMA()
+        self._ctrl = self._dma.pack_ctrl(size=itemsize // 2, inc_read=False, inc_write=True,
+                                         ring_size=nbytes.bit_length() - 1, ring_sel=True, treq_sel=dreq)
+
+    def start(self):
+        self._dma.config(read=self._read_addr, write=self._addr, count=_COUNT, ctrl=self._ctrl, trigger=True)
+
+    def stop(self):
+        self._dma.active(0)
+
+    def remaining(self):
+        return self._dma.count
+
+    def written(self):
+        return _COUNT - self._dma.count
+
+    def close(self):
+        self._dma.active(0)
+        self._dma.close()
+
+
+class DmaRing:
+    def __init__(self, pins, rate_hz=2000, size=1024):
+        """pins : ADC GPIOs (26-29) or channels (0-3), rate_hz per channel, size in samples (power of 2)"""
+        self.adcs = [ADC(pin) for pin in pins]  # puts the pins in analog mode
+        channels = [_channel(pin) for pin in pins]
+        if channels != sorted(channels):
+            raise ValueError("ADC channels must be in ascending order")
+        self.nch = len(channels)
+        self._mask_bits = 0
+        for ch in channels:
+            self._mask_bits |= 1 << ch
+        self._first = channels[0]
+        self._fifo = FifoRing(_ADC_FIFO, _DREQ_ADC, size, "H")
+        self.size = size
+        self.mask = size - 1
+        self.samples = self._fifo.buf
+        self.offset = self._fifo.offset
+
+        # one conversion every 1 + DIV/256 cycles (DIV = INT.FRAC), 0 = back to back
+        period = _ADC_CLOCK_HZ * 256 // (rate_hz * self.nch)  # in 1/256 cycles
+        if period <= _MIN_CYCLES * 256:
+            period = _MIN_CYCLES * 256
+            self._div = 0
+        elif period - 256 > _MAX_DIV:
+            # would wrap the 16-bit INT field and sample far too fast
+            slowest = -(-_ADC_CLOCK_HZ * 256 // ((_MAX_DIV + 256) * self.nch))
+            raise ValueError(f"ADC rate {rate_hz} Hz below the divider's minimum, {slowest} Hz for {self.nch} channels")
+        else:
+            self._div = period - 256
+        self._period = period
+        self.rate_hz = _ADC_CLOCK_HZ * 256 // (period * self.nch)
+        self.t0 = 0  # ticks_us of sample _base, plus _rem / _UNITS_PER_US
+        self._base = 0
+        self._rem = 0
+
+    def start(self):
+        mem32[_ADC_CS] = _CS_EN | self._first << 12 | self._mask_bits << 16
+        mem32[_ADC_DIV] = self._div
+        mem32[_ADC_FCS] = _FCS_EN | _FCS_DREQ_EN | _FCS_THRESH_1
+        while not mem32[_ADC_FCS] & _FCS_EMPTY:
+            mem32[_ADC_FIFO]  # stale results
+        self._fifo.start()
+        mem32[_ADC_CS] |= _CS_START_MANY
+        self.t0 = time.ticks_us()
+        self._base = 0
+        self._rem = 0
+
+    def stop(self):
+        mem32[_ADC_CS] &= ~_CS_START_MANY
+        self._fifo.stop()
+        mem32[_ADC_FCS] = 0
+
+    def restart(self):
+        """Start the sample count again from 0 (needed every ~2^30 samples)"""
+        self.stop()
+        self.start()
+
+    def remaining(self):
+        return self._fifo.remaining()
+
+    def written(self):
+        return self._fifo.written()
+
+    def ticks_us(self, s):
+        # conversions are exactly period/48 MHz apart
+        return time.ticks_add(self.t0, ((s - self._base) * self._period + self._rem) // _UNITS_PER_US)
+
+    def rebase(self, s):
+        """Move the time reference to sample s, keeping the fraction of a us"""
+        us, self._rem = divmod((s - self._base) * self._period + self._rem, _UNITS_PER_US)
+        self.t0 = time.ticks_add(self.t0, us)
+        self._base = s
+
+    def close(self):
+        self.stop()
+        self._fifo.close()
+
+
+class TimerRing:
+    def __init__(self, pins, rate_hz=2000, size=1024):
+        """Same as DmaRing, sampled by a timer callback (rate_hz is limited by the callback cost)"""
+        self.adcs = [ADC(pin) for pin in pins]
+        self.nch = len(pins)
+        self.size = size
+        self.mask = size - 1
+        self.samples = array("H", bytes(2 * size))
+        self.offset = 0
+        frames = 1
+        while frames * self.nch < size:
+            frames *= 2
+        self._frame_ticks = array("L", [0] * frames)
+        self._frame_mask = frames - 1
+        self.rate_hz = rate_hz
+        self._count = 0
+        self._timer = Timer()
+        self._tick_ref = self._tick  # bound once so the timer doesn't allocate
+        self.t0 = 0
+
+    def _tick(self, timer):
+        s = self._count
+        mask = self.mask
+        samples = self.samples
+        for adc in self.adcs:
+            samples[s & mask] = adc.read_u16() >> 4
+            s += 1
+        self._frame_ticks[self._count // self.nch & self._frame_mask] = time.ticks_us()
+        self._count = s
+
+    def start(self):
+        self._count = 0
+        self.t0 = time.ticks_us()
+        self._timer.init(mode=Timer.PERIODIC, freq=self.rate_hz, callback=self._tick_ref)
+
+    def stop(self):
+        self._timer.deinit()
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def remaining(self):
+        return _COUNT - self._count
+
+    def written(self):
+        return self._count
+
+    def ticks_us(self, s):
+        return self._frame_ticks[s // self.nch & self._frame_mask]
+
+    def rebase(self, s):
+        pass  # every frame has its own ticks
+
+    def close(self):
+        self.stop()
+
+
+def make_ring(pins, rate_hz=2000, size=1024):
+    """DmaRing where the firmware has rp2.DMA, TimerRing otherwise"""
+    if DMA is not None:
+        return DmaRing(pins, rate_hz, size)
+    return TimerRing(pins, rate_hz, size)
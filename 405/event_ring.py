@@ -0,0 +1,75 @@
+"""
+Preallocated ring buffer for beam-break events.
+
+The pin IRQ handlers only call push(), which stores a gate index, the
+time.ticks_us() value and a set id into fixed arrays.  Nothing is allocated
+and no I2C or file access happens inside the interrupt.  The main loop (or a
+micropython.schedule callback) calls pop() to drain the events.
+
+Single producer (IRQ) / single consumer (main loop): the producer only moves
+`head`, the consumer only moves `tail`, so no locking is needed.  A second
+producer (e.g. the main loop next to the IRQs) needs a ring of its own.
+
+Example usage:
+
+    ring = EventRing(64)
+    ring.push(gate, time.ticks_us(), set_id)   # inside the IRQ
+    while ring.pop():                          # in the main loop
+        print(ring.gate, ring.ticks, ring.set_id)
+"""
+
+from array import array
+
+
+class EventRing:
+    def __init__(self, size=64):
+        self.size = size
+        self._gates = array("B", bytes(size))
+        self._ticks = array("L", [0] * size)
+        self._sets = array("B", bytes(size))
+        self.head = 0
+        self.tail = 0
+        self.overflows = 0
+
+        # last popped event, read by the consumer after pop()
+        self.gate = 0
+        self.ticks = 0
+        self.set_id = 0
+
+    def push(self, gate, ticks, set_id):
+        # called from the IRQ: no allocation allowed here
+        head = self.head
+        nxt = head + 1
+        if nxt == self.size:
+            nxt = 0
+        if nxt == self.tail:
+            self.overflows += 1
+            return False
+        self._gates[head] = gate
+        self._ticks[head] = ticks
+        self._sets[head] = set_id
+        self.head = nxt
+        return True
+
+    def pop(self):
+        tail = self.tail
+        if tail == self.head:
+            return False
+        self.gate = self._gates[tail]
+        self.ticks = self._ticks[tail]
+        self.set_id = self._sets[tail]
+        tail += 1
+        if tail == self.size:
+            tail = 0
+        self.tail = tail
+        return True
+
+    def peek_ticks(self):
+        """ticks of the oldest event, only valid while the ring isn't empty"""
+        return self._ticks[self.tail]
+
+    def __len__(self):
+        return (self.head - self.tail) % self.size
+
+    def clear(self):
+        self.tail = self.head
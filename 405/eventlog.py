@@ -0,0 +1,231 @@
+"""
+Compact binary event log, converted to CSV when it leaves the device.
+
+File layout (little endian):
+
+    header  "GLOG", version u8, set label u8, reserved u16, start seconds u32
+    blocks  marker 0xB5 u8, record count u8, base seconds u32,
+            count x record, CRC32 u32 over marker..last record
+    record  microseconds since the block base u32, flags u8, set id u8
+    flags   bit 0 pair (0 Left Pair, 1 Right Pair)
+            bit 1 direction (0 Left, 1 Right)
+            bits 2-4 index of the gate that completed the crossing
+
+Seconds count from 2000-01-01 (see timebase).  A record is 6 bytes against
+~25-30 bytes for the matching CSV row.  Records are collected in a
+preallocated block buffer which is written out when it is full, when the
+oldest record is older than flush_ms, and on close().  A block cut short by a
+power loss fails its CRC and is skipped by the converter.
+
+On the host:
+
+    python eventlog.py Data/2025-10-06_A_19-15-00.bin [out.csv]
+"""
+
+import struct
+import time
+from binascii import crc32
+
+import timebase
+
+MAGIC = b"GLOG"
+VERSION = 1
+HEADER = "<4sBBHI"
+HEADER_LEN = 12
+BLOCK_MARKER = 0xB5
+BLOCK_HEAD = "<BBI"
+BLOCK_HEAD_LEN = 6
+RECORD = "<IBB"
+RECORD_LEN = 6
+CRC_LEN = 4
+MAX_DELTA_US = 0xFFFFFFFF  # u32 microseconds cover 71 minutes past the block base
+
+PAIRS = ("Left Pair", "Right Pair")
+DIRECTIONS = ("Left", "Right")
+
+
+def pack_flags(pair, direction, gate):
+    return pair | direction << 1 | (gate & 0x07) << 2
+
+
+class EventLog:
+    def __init__(self, path, set_label, start_s, records=40, flush_ms=5000):
+        self.path = path
+        self.set_id = 0 if set_label == "A" else 1
+        self.flush_ms = flush_ms
+        self._max = records
+        self._block = bytearray(BLOCK_HEAD_LEN + records * RECORD_LEN + CRC_LEN)
+        self._mv = memoryview(self._block)
+        self._count = 0
+        self._base = 0
+        self._oldest = 0  # ticks_ms of the oldest buffered record
+
+        # flush statistics, same names as CSVWriter
+        self.rows = 0
+        self.bytes_written = 0
+        self.flushes = 0
+        self.size_flushes = 0
+        self.time_flushes = 0
+        self.flush_us_total = 0
+        self.flush_us_max = 0
+
+        self._f = open(path, "wb")
+        self._f.write(struct.pack(HEADER, MAGIC, VERSION, ord(set_label), 0, start_s))
+        self._f.flush()
+        self.bytes_written += HEADER_LEN
+
+    def write_event(self, seconds, us, pair, direction, gate=0):
+        # A stamp before the block base (clock stepped back, captures drained
+        # out of order) or too far past it can't be stored as an offset:
+        # close the block and start a new one based on this stamp
+        delta = (seconds - self._base) * 1000000 + us
+        if self._count and not 0 <= delta <= MAX_DELTA_US:
+            self.flush()
+        if not self._count:
+            self._base = seconds
+            self._oldest = time.ticks_ms()
+            delta = us
+        offset = BLOCK_HEAD_LEN + self._count * RECORD_LEN
+        struct.pack_into(RECORD, self._block, offset, delta, pack_flags(pair, direction, gate), self.set_id)
+        self._count += 1
+        self.rows += 1
+        if self._count == self._max:
+            self.size_flushes += 1
+            self.flush()
+
+    def poll(self):
+        if self._count and time.ticks_diff(time.ticks_ms(), self._oldest) >= self.flush_ms:
+            self.time_flushes += 1
+            self.flush()
+
+    def flush(self):
+        if not self._count:
+            return
+        start = time.ticks_us()
+        end = BLOCK_HEAD_LEN + self._count * RECORD_LEN
+        struct.pack_into(BLOCK_HEAD, self._block, 0, BLOCK_MARKER, self._count, self._base)
+        struct.pack_into("<I", self._block, end, crc32(self._mv[:end]))
+        self._f.write(self._mv[: end + CRC_LEN])
+        self._f.flush()
+        elapsed = time.ticks_diff(time.ticks_us(), start)
+        self.bytes_written += end + CRC_LEN
+        self._count = 0
+        self.flushes += 1
+        self.flush_us_total += elapsed
+        if elapsed > self.flush_us_max:
+            self.flush_us_max = elapsed
+
+    def close(self):
+        if self._f is None:
+            return
+        self.flush()
+        self._f.close()
+        self._f = None
+
+    def stats(self):
+        return {
+            "rows": self.rows,
+            "bytes": self.bytes_written,
+            "flushes": self.flushes,
+            "size_flushes": self.size_flushes,
+            "time_flushes": self.time_flushes,
+            "flush_us_avg": self.flush_us_total // self.flushes if self.flushes else 0,
+            "flush_us_max": self.flush_us_max,
+        }
+
+
+class LogReader:
+    """Reads back an open log file.
+
+    Iterating yields (seconds, us, pair, direction, gate, set_id).  Reading
+    stops at the first truncated block and skips blocks with a bad CRC; the
+    number of skipped blocks ends up in bad_blocks, and end is the file
+    offset just past the last complete block.  seek() resumes at a block
+    boundary taken from end."""
+
+    def __init__(self, f):
+        head = f.read(HEADER_LEN)
+        if len(head) < HEADER_LEN:
+            raise ValueError("not an event log")
+        magic, version, set_label, _, start_s = struct.unpack(HEADER, head)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not an event log")
+        self.f = f
+        self.set_label = chr(set_label)
+        self.start_s = start_s
+        self.bad_blocks = 0
+        self.end = HEADER_LEN
+
+    def seek(self, offset):
+        if offset > HEADER_LEN:
+            self.f.seek(offset)
+            self.end = offset
+
+    def __iter__(self):
+        f = self.f
+        while True:
+            head = f.read(BLOCK_HEAD_LEN)
+            if len(head) < BLOCK_HEAD_LEN:
+                return
+            marker, count, base = struct.unpack(BLOCK_HEAD, head)
+            size = count * RECORD_LEN
+            body = f.read(size + CRC_LEN)
+            if marker != BLOCK_MARKER or len(body) < size + CRC_LEN:
+                self.bad_blocks += 1
+                return
+            self.end += BLOCK_HEAD_LEN + size + CRC_LEN
+            if crc32(body[:size], crc32(head)) != struct.unpack_from("<I", body, size)[0]:
+                self.bad_blocks += 1
+                continue
+            for i in range(count):
+                delta, flags, set_id = struct.unpack_from(RECORD, body, i * RECORD_LEN)
+                yield base + delta // 1000000, delta % 1000000, flags & 1, flags >> 1 & 1, flags >> 2 & 0x07, set_id
+
+
+def csv_chunks(log, digits=3, header=True, rows=32):
+    """Yield the events of a LogReader as CSV text, up to `rows` rows at a time"""
+    if header:
+        year, month, day = timebase.civil_from_days(log.start_s // 86400)
+        yield f"Date:,{year:04d}-{month:02d}-{day:02d}\nTime,Pair,Direction\n"
+    lines = []
+    for seconds, us, pair, direction, _, _ in log:
+        lines.append(f"{timebase.format_time(seconds, us, digits)},{PAIRS[pair]},{DIRECTIONS[direction]}\n")
+        if len(lines) == rows:
+            yield "".join(lines)
+            lines = []
+    if lines:
+        yield "".join(lines)
+
+
+def write_csv(log, fdst, digits=3, header=True):
+    """Write the events of a LogReader as CSV rows to the open file fdst.
+
+    returns : rows written"""
+    rows = 0
+    for chunk in csv_chunks(log, digits, header):
+        fdst.write(chunk)
+        rows += chunk.count("\n")
+    return rows - 2 if header else rows
+
+
+def to_csv(src_path, dst_path, digits=3):
+    """Convert a binary log to the CSV layout Gates.py used to write.
+
+    returns : (rows written, blocks skipped)"""
+    with open(src_path, "rb") as fsrc:
+        log = LogReader(fsrc)  # check the header before creating the CSV
+        with open(dst_path, "w") as fdst:
+            rows = write_csv(log, fdst, digits)
+    return rows, log.bad_blocks
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 2:
+        print("usage: python eventlog.py LOG.bin [OUT.csv]")
+        sys.exit(1)
+    src = sys.argv[1]
+    dst = sys.argv[2] if len(sys.argv) > 2 else src.rsplit(".", 1)[0] + ".csv"
+    rows, bad = to_csv(src, dst)
+    print(f"{src} -> {dst}: {rows} events, {bad} bad blocks")
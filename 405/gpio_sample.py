@@ -0,0 +1,52 @@
+"""
+Reads every GPIO input at once.
+
+On the RP2040 the SIO block mirrors the level of all 30 GPIOs in one
+register (GPIO_IN, 0xd0000004).  One machine.mem32 read replaces a
+Pin.value() call per pin, and the result is a small int, so testing a set of
+pins is a mask and a compare with no allocation:
+
+    BEAMS_A = pin_mask(config["beam_pins_A"].values())
+    inputs = sampler.read()
+    if inputs & BEAMS_A == BEAMS_A:     # all beams of set A high
+        ...
+    pressed = last & ~inputs            # pins that went 1 -> 0
+
+On other ports (or without mem32) read() builds the same bit mask from the
+Pin objects given to the sampler.
+"""
+
+import sys
+
+from micropython import const
+
+try:
+    from machine import mem32
+except ImportError:
+    mem32 = None
+
+_SIO_GPIO_IN = const(0xD0000004)
+
+
+def pin_mask(pin_ids):
+    mask = 0
+    for pin_id in pin_ids:
+        mask |= 1 << pin_id
+    return mask
+
+
+class GpioSampler:
+    def __init__(self, pins):
+        """pins : {gpio number: Pin}, only used when GPIO_IN can't be read"""
+        self.mask = pin_mask(pins)
+        self.direct = mem32 is not None and sys.platform == "rp2"
+        self._pins = [(1 << pin_id, pin) for pin_id, pin in pins.items()]
+
+    def read(self):
+        if self.direct:
+            return mem32[_SIO_GPIO_IN]
+        inputs = 0
+        for bit, pin in self._pins:
+            if pin.value():
+                inputs |= bit
+        return inputs
@@ -0,0 +1,19 @@
+# Modules frozen into a custom MicroPython build for the gates Pico, so boot
+# doesn't compile them from .py on flash.  Build the firmware with:
+#   make -C ports/rp2 BOARD=RPI_PICO FROZEN_MANIFEST=/path/to/405/manifest.py
+# build_mpy.py compiles the same list to .mpy for a stock firmware instead.
+# A .py of the same name on the Pico's flash is imported before the frozen
+# or .mpy copy, so remove those after switching.
+include("$(PORT_DIR)/boards/manifest.py")
+
+# Drivers
+module("ds3231.py", base_path="../Task #1 - CSV/RTC")
+module("sdcard.py", base_path="../Task #2 - CSV 2 and SD Card")
+
+# 405 libraries imported by Gates.py
+for name in (
+    "event_ring", "csv_writer", "direction", "gpio_sample", "sdcopy", "blockcache",
+    "sdsync", "eventlog", "spsc", "buttons", "adc_scanner", "adc_capture", "dma_ring",
+    "pio_capture", "timebase", "config_cache", "bootprof",
+):
+    module(name + ".py")
@@ -0,0 +1,200 @@
+"""
+Beam-edge timestamps from a PIO state machine (RP2040).
+
+One state machine samples a contiguous range of GPIOs (all the beam pins)
+once per tick and keeps a tick counter.  When the pins differ from the last
+reported state it waits `glitch_ticks` ticks and samples again: if they are
+back to the old state the change was a glitch and nothing is reported,
+otherwise it pushes two words, the new pin state and the counter.  Every
+path through the program takes a whole number of 8-cycle ticks and counts
+them, so the counter is exact however often the pins change.  A DMA channel
+copies the words into a ring (dma_ring.FifoRing) and poll() decodes them,
+so bursts of edges never wait for the CPU: the ring holds `size` / 2
+changes between two polls.
+
+The program runs at 8 cycles per tick, tick_us microseconds per tick, and
+samples again right after reporting, so two edges closer than
+glitch_ticks + 3 ticks are reported as one.  Falling edges of the pins
+given to the constructor go to on_fall(index, ticks_us), index being the
+pin's position in `pins`; other pins inside the range are ignored.
+
+Needs rp2.StateMachine and rp2.DMA; the constructor raises OSError when the
+firmware has neither (callers fall back to Pin.irq).
+
+Example usage:
+
+    capture = PioCapture([2, 3, 4, 5], lambda i, t: print(i, t))
+    capture.start()
+    while True:
+        capture.poll()
+        time.sleep_ms(20)
+"""
+
+import time
+
+try:
+    import rp2
+    from dma_ring import FifoRing, DMA
+except ImportError:
+    rp2 = None
+    DMA = None
+
+_PIO_BASE = (0x50200000, 0x50300000)
+_RXF0 = 0x20
+_DREQ_PIO_RX0 = (4, 12)
+_CYCLES_PER_TICK = 8
+_MAX_GLITCH_TICKS = 3  # what still fits in the 32 instruction memory
+_TICKS_MAX = (1 << 30) - 1  # ticks_us period on the port
+_TICKS_HALF = 1 << 29  # ticks_add() takes deltas below this
+
+
+def _program(width, glitch_ticks):
+    # width and glitch_ticks are closure variables: asm_pio swaps out the
+    # module globals while it assembles
+    @rp2.asm_pio(in_shiftdir=rp2.PIO.SHIFT_LEFT, fifo_join=rp2.PIO.JOIN_RX)
+    def beam_edges():
+        # y = last reported pins, osr = tick counter (counts down), x = scratch
+        mov(y, null)
+        mov(osr, invert(null))
+        wrap_target()
+        label("sample")
+        mov(isr, null)                      # 1
+        in_(pins, width)                    # 2  sample
+        mov(x, isr)                         # 3
+        jmp(x_not_y, "changed")             # 4
+        mov(x, osr)                 [1]     # 5-6
+        jmp(x_dec, "store")                 # 7
+        label("store")
+        mov(osr, x)                         # 8
+        wrap()
+
+        # end of this tick, then glitch_ticks ticks of 8 cycles, one decrement each
+        label("changed")
+        mov(x, osr)                         # 5
+        jmp(x_dec, "wait0")                 # 6
+        label("wait0")
+        for i in range(glitch_ticks):
+            jmp(x_dec, f"wait{i + 1}") [7]
+            label(f"wait{i + 1}")
+        mov(osr, x)                 [1]     # 7-8
+
+        # sample again: back to the old state = glitch
+        mov(isr, null)                      # 1
+        in_(pins, width)                    # 2
+        mov(x, isr)                         # 3
+        jmp(x_not_y, "edge")                # 4
+        mov(x, osr)                         # 5
+        jmp(x_dec, "glitch")                # 6
+        label("glitch")
+        mov(osr, x)                         # 7
+        jmp("sample")                       # 8
+
+        # report the new state and the counter, then count this tick and the next
+        label("edge")
+        mov(y, x)                           # 5
+        push(noblock)                       # 6
+        mov(isr, osr)                       # 7
+        push(noblock)                       # 8
+        mov(x, osr)                         # 1
+        jmp(x_dec, "edge1")                 # 2
+        label("edge1")
+        jmp(x_dec, "edge2")                 # 3
+        label("edge2")
+        mov(osr, x)                 [3]     # 4-7
+        jmp("sample")                       # 8
+
+    return beam_edges
+
+
+class PioCapture:
+    def __init__(self, pins, on_fall, sm_id=0, tick_us=1, glitch_ticks=2, size=256):
+        """pins         : GPIO numbers, all within 32 consecutive GPIOs
+        sm_id        : state machine 0-7 (4-7 = PIO1)
+        glitch_ticks : 0-3, changes shorter than this many ticks are ignored
+        size         : ring length in words (power of 2), two per change"""
+        if rp2 is None or DMA is None:
+            raise OSError("PIO capture needs rp2.StateMachine and rp2.DMA")
+        if not 0 <= glitch_ticks <= _MAX_GLITCH_TICKS:
+            raise ValueError(f"glitch_ticks must be 0-{_MAX_GLITCH_TICKS}")
+        self.base = min(pins)
+        width = max(pins) - self.base + 1
+        if width > 32:
+            raise ValueError("beam pins span more than 32 GPIOs")
+        self.bits = [pin - self.base for pin in pins]
+        self.watched = 0
+        for bit in self.bits:
+            self.watched |= 1 << bit
+        self.on_fall = on_fall
+        self.tick_us = tick_us
+        self.glitch_ticks = glitch_ticks
+        # the pushed counter is 1 + glitch_ticks ticks after the first sample of the edge
+        self._lag = 1 + glitch_ticks
+
+        from machine import Pin
+        self._sm = rp2.StateMachine(sm_id, _program(width, glitch_ticks),
+                                    freq=_CYCLES_PER_TICK * 1000000 // tick_us, in_base=Pin(self.base))
+        block, sm = divmod(sm_id, 4)
+        self.ring = FifoRing(_PIO_BASE[block] + _RXF0 + 4 * sm, _DREQ_PIO_RX0[block] + sm, size, "L")
+        self.t0 = 0
+        self.done = 0
+        self.state = -1  # last pin state, -1 until the first word (the pins at start)
+        self.edges = 0
+        self.overruns = 0
+
+    def start(self):
+        self.ring.start()
+        self.t0 = time.ticks_us()
+        self._sm.restart()
+        self._sm.active(1)
+        self.done = 0
+        self.state = -1
+
+    def stop(self):
+        self._sm.active(0)
+        self.ring.stop()
+
+    def ticks_us(self, counter):
+        # ticks since start = ~counter, ticks_us wraps at 2^30 so 2^32 ticks do too
+        n = (0xFFFFFFFF - counter - self._lag) & _TICKS_MAX
+        delta = n * self.tick_us & _TICKS_MAX
+        if delta >= _TICKS_HALF:
+            delta -= _TICKS_MAX + 1  # same ticks, in the range ticks_add() accepts
+        return time.ticks_add(self.t0, delta)
+
+    def poll(self):
+        """Decode the changes pushed since the last call, returns how many falling edges"""
+        ring = self.ring
+        end = ring.written()
+        start = self.done
+        if end - start > ring.size:
+            self.overruns += (end - start - ring.size) // 2
+            start = end - ring.size
+            start += start & 1  # changes are word pairs from an even index
+            self.state = -1
+        buf = ring.buf
+        offset = ring.offset
+        mask = ring.mask
+        found = 0
+        while end - start >= 2:
+            pins = buf[offset + (start & mask)]
+            counter = buf[offset + ((start + 1) & mask)]
+            start += 2
+            fell = self.state & ~pins & self.watched if self.state >= 0 else 0
+            self.state = pins
+            if fell:
+                ticks = self.ticks_us(counter)
+                for index, bit in enumerate(self.bits):
+                    if fell >> bit & 1:
+                        found += 1
+                        self.on_fall(index, ticks)
+        self.edges += found
+        self.done = start
+        if ring.remaining() < ring.size:
+            # about 2^29 changes in: start over (the state is re-read)
+            self.stop()
+            self.start()
+        return found
+
+    def close(self):
+        self.stop()
+        self.ring.close()
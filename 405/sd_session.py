@@ -0,0 +1,164 @@
+"""
+SD card kept mounted from insertion to removal, driven by the card-detect pin.
+
+Initialising a card (CMD0, CMD8, the ACMD41 polling loop, CSD, clock
+negotiation) takes 100 ms or more.  Instead of paying that when download is
+pressed, the detect IRQ records the insertion and, once the pin has been
+steady for settle_ms, poll() initialises and mounts the card in the
+background.  The mount is a generator, mount_job(), that poll() steps once
+per call, waiting out the driver's 50 ms ACMD41 polls between calls instead
+of sleeping through them; `mounting` is the job while it runs.  It stays
+mounted between downloads; removing it unmounts it on the next poll(), and
+a job still running when the detect pin shows the card gone is dropped.
+The IRQ only records the edge, all the SPI and filesystem work happens in
+poll() (or mount(), which runs the job to the end for a download that
+comes before the mount finished).
+
+One sdcard.SDCard is created by new_card() on the first insertion, without
+initialising it (init=False), and kept.  A re-inserted card has been
+powered off, so its init handshake can't be skipped, but the driver's
+init_steps() reuses the buffers and, for a card seen before (same CID), the
+SPI clock negotiated for it then.  The driver's `present` is pointed at the
+detect pin, so a transfer to a pulled card fails without retries.
+wrap(card) can put something in front of the card (e.g. a
+blockcache.BlockCache).
+
+With `notify` set to an asyncio ThreadSafeFlag the IRQ sets it on every
+edge, so a task can sleep until the card is inserted or removed.
+
+Example usage:
+
+    session = SdSession(Pin(14, Pin.IN), lambda: sdcard.SDCard(spi, cs, init=False))
+    while True:
+        session.poll()                  # mounts /sd after insertion
+        if pressed and session.mounted:
+            ...                         # write to /sd right away
+"""
+
+import os
+import time
+
+
+class SdSession:
+    def __init__(self, det_pin, new_card, mount_point="/sd", settle_ms=250, wrap=None):
+        """det_pin : card-detect input, high while a card is in
+        new_card: returns an uninitialised sdcard.SDCard (called once, on the first mount)"""
+        self.det_pin = det_pin
+        self.new_card = new_card
+        self.mount_point = mount_point
+        self.settle_ms = settle_ms
+        self.wrap = wrap
+        self.card = None
+        self.mounted = False
+        self.failed = False  # the last mount failed (poll() only retries after re-insertion)
+        self.mounts = 0
+        self.mount_ms = 0  # time the last mount took
+        self.mounting = None  # mount_job() while poll() steps it
+        self._resume = 0  # ticks_ms of its next step
+        self.notify = None
+        # a card already in at boot is mounted by the first poll()
+        self.pending = det_pin.value() == 1
+        self._edge = time.ticks_add(time.ticks_ms(), -settle_ms)
+        det_pin.irq(trigger=det_pin.IRQ_RISING | det_pin.IRQ_FALLING, handler=self._detect)
+
+    def _detect(self, pin):
+        self._edge = time.ticks_ms()
+        self.pending = True
+        if self.notify is not None:
+            self.notify.set()
+
+    def present(self):
+        return self.det_pin.value() == 1
+
+    def wait_ms(self):
+        """ms until poll() has the next mount step to do"""
+        return max(0, time.ticks_diff(self._resume, time.ticks_ms()))
+
+    def poll(self):
+        """Mount or unmount once the detect pin has settled, a step of a
+        running mount otherwise; returns `mounted`"""
+        if self.mounting is not None:
+            if not self.present():
+                self._stop()  # pulled mid-mount, the pending edge unmounts
+            elif not self.wait_ms():
+                self._step()
+                return self.mounted
+            else:
+                return self.mounted
+        if self.pending and time.ticks_diff(time.ticks_ms(), self._edge) >= self.settle_ms:
+            if self.present():
+                self.mounting = self.mount_job()  # clears pending
+                self._step()
+            else:
+                self.pending = False
+                self.unmount()
+        return self.mounted
+
+    def _step(self):
+        try:
+            wait = next(self.mounting)
+        except StopIteration:
+            self.mounting = None
+            return
+        self._resume = time.ticks_add(time.ticks_ms(), wait or 0)
+
+    def _stop(self):
+        self.mounting.close()
+        self.mounting = None
+        self.failed = True
+
+    def mount(self):
+        """Initialise and mount the card now, False if there's none or it failed"""
+        if self.mounting is not None:
+            self._stop()  # start over, from init
+        for wait in self.mount_job():
+            if wait:
+                time.sleep_ms(wait)
+        return self.mounted
+
+    def mount_job(self):
+        """mount() as a generator, yielding the ms to wait before the next step"""
+        if not self.present():
+            self.unmount()  # pulled, the IRQ's edge just hasn't settled yet
+            return
+        if self.mounted:
+            if not self.pending:
+                return
+            # an edge since the mount: the card was swapped between polls, so
+            # the FAT object and the driver's card state belong to the old one
+            self.unmount()
+        self.pending = False
+        start = time.ticks_ms()
+        try:
+            if self.card is None:
+                self.card = self.new_card()
+                self.card.present = self.present
+            yield from self.card.init_steps(None)
+            yield 0
+            dev = self.wrap(self.card) if self.wrap else self.card
+            try:
+                os.umount(self.mount_point)  # left over from a card pulled mid-download
+            except OSError:
+                pass
+            os.mount(os.VfsFat(dev), self.mount_point)
+        except OSError as e:
+            self.failed = True
+            print("SD card failed to mount:", e)
+            return
+        self.failed = False
+        self.mounted = True
+        self.mounts += 1
+        self.mount_ms = time.ticks_diff(time.ticks_ms(), start)
+        card = self.card
+        print(f"SD card mounted in {self.mount_ms} ms, SPI at {card.baudrate // 1000} kHz "
+              f"(card max {card.card_baudrate // 1000} kHz)")
+
+    def unmount(self):
+        if not self.mounted:
+            return
+        self.mounted = False
+        try:
+            os.umount(self.mount_point)
+        except OSError:
+            pass
+        print("SD card removed")
@@ -0,0 +1,285 @@
+"""
+Incremental offload of the flash Data folder to the SD card.
+
+Two manifests, one line "name,size,crc32" per file, record what has been
+transferred:
+
+  * on flash (sync_manifest.csv) : bytes of each source file already sent
+    and the CRC32 of that prefix
+  * on the card (<dst>/sync_manifest.csv) : size and CRC32 of the file the
+    card holds, written once at the end of a job and only for files still
+    on flash or sent in that job
+
+A file is only sent from where the last sync stopped, so an offload takes
+time in proportion to the new data.  Event logs (.bin) are converted to CSV
+on the way, a block at a time; other files are copied as they are.  Every
+transfer is read back from the card (past the sector cache, if one is
+given) and its CRC compared before the manifests are updated, and a source
+file is deleted from flash only after that, never while a test still has it
+open.  Before a file is continued, the part already sent is read from flash
+again and checked against the flash manifest's CRC; a file rewritten since
+starts over.  If the card is pulled
+midway, or a different card is inserted, the card's manifest no longer
+matches its files and the affected files start over; nothing is deleted
+that hasn't been verified.
+
+The work is a generator, job(), that yields after every chunk (one copy
+buffer, 32 CSV rows, one read-back buffer), so the main loop can step it a
+few milliseconds at a time and keep serving the beams and buttons; `progress`
+says how far it got.  run() steps it to the end in one go.
+
+Example usage:
+
+    sync = SdSync("/Data", "/sd/Data", FileCopier(cluster_size("/sd")))
+    stats = sync.run(keep=["/Data/2025-10-06_A_19-15-00.bin"])
+    for name, error in sync.failed:
+        print(name, error)
+
+    job = sync.job(keep)            # or stepped from a loop
+    for _ in job:
+        if time_slice_used_up():
+            break                   # next(job) later continues
+"""
+
+import os
+import time
+from binascii import crc32
+
+import eventlog
+
+MANIFEST = "sync_manifest.csv"
+
+
+def load_manifest(path):
+    """{name: (size, crc)}, empty if the file is missing; damaged lines are ignored"""
+    entries = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    name, size, crc = line.rstrip("\n").rsplit(",", 2)
+                    entries[name] = (int(size), int(crc, 16))
+                except ValueError:
+                    pass
+    except OSError:
+        pass
+    return entries
+
+
+def save_manifest(path, entries):
+    with open(path, "w") as f:
+        for name, (size, crc) in entries.items():
+            f.write(f"{name},{size},{crc:08x}\n")
+
+
+def file_size(path):
+    try:
+        return os.stat(path)[6]
+    except OSError:
+        return -1
+
+
+class _CrcWriter:
+    # counts and checksums what goes into a file, so it can be verified
+    def __init__(self, f, crc):
+        self.f = f
+        self.crc = crc
+        self.bytes = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.f.write(data)
+        self.crc = crc32(data, self.crc)
+        self.bytes += len(data)
+
+
+class SdSync:
+    def __init__(self, src_dir, dst_dir, copier, flash_manifest="/" + MANIFEST, digits=3, chunk=0, cache=None):
+        """copier : sdcopy.FileCopier, its buffer is used for copying and read-back
+        chunk  : bytes per step (0 = the whole copier buffer)
+        cache  : blockcache.BlockCache in front of the card, read through while verifying"""
+        self.cache = cache
+        self.src_dir = src_dir
+        self.dst_dir = dst_dir
+        self.copier = copier
+        self.flash_manifest = flash_manifest
+        self.card_manifest = f"{dst_dir}/{MANIFEST}"
+        self.digits = digits
+        self.failed = []  # (name, error) of the last run
+        size = len(copier.buf)
+        self.chunk = min(chunk, size) if chunk else size
+        self.stats = {}
+        self.progress = {"file": None, "files_done": 0, "files_total": 0, "bytes": 0}
+
+    def _crc_range(self, path, start, nbytes, crc=0):
+        mv = self.copier.mv
+        step = self.chunk
+        with open(path, "rb") as f:
+            f.seek(start)
+            while nbytes > 0:
+                n = f.readinto(mv[: min(nbytes, step)])
+                if not n:
+                    break
+                crc = crc32(mv[:n], crc)
+                nbytes -= n
+                yield
+        return crc
+
+    def _verify(self, path, start, nbytes, crc):
+        # read back from the card, not from the sectors the writes left in the cache
+        cache = self.cache
+        if cache is not None:
+            cache.read_through = True
+        try:
+            return (yield from self._crc_range(path, start, nbytes, crc))
+        finally:
+            if cache is not None:
+                cache.read_through = False
+
+    def _copy(self, src, out, start, crc):
+        mv = self.copier.mv
+        block = mv[: self.chunk]
+        end = start
+        with open(src, "rb") as f:
+            f.seek(start)
+            while True:
+                n = f.readinto(block)
+                if not n:
+                    break
+                chunk = block if n == self.chunk else mv[:n]
+                out.write(chunk)
+                crc = crc32(chunk, crc)
+                end += n
+                self.progress["bytes"] += n
+                yield
+        return end, crc
+
+    def _convert(self, src, out, start, crc):
+        with open(src, "rb") as f:
+            log = eventlog.LogReader(f)
+            log.seek(start)
+            for text in eventlog.csv_chunks(log, self.digits, header=not start):
+                out.write(text)
+                self.progress["bytes"] += len(text)
+                yield
+            end = log.end
+        # the source CRC covers the raw log bytes, read back from flash
+        crc = yield from self._crc_range(src, start, end - start, crc)
+        return end, crc
+
+    def _files(self, rel=""):
+        path = f"{self.src_dir}/{rel}" if rel else self.src_dir
+        for item in os.listdir(path):
+            item_rel = f"{rel}/{item}" if rel else item
+            if os.stat(f"{self.src_dir}/{item_rel}")[0] & 0x4000:
+                yield from self._files(item_rel)
+            elif item != MANIFEST:
+                yield item_rel
+
+    def _make_dirs(self, rel):
+        path = self.dst_dir
+        for part in rel.split("/")[:-1]:
+            path = f"{path}/{part}"
+            try:
+                os.mkdir(path)
+            except OSError:
+                pass
+
+    def sync_file(self, rel, flash, card, seen=None):
+        """Generator sending what's new in one file; returns bytes written to the card
+
+        seen : set the file's name on the card is added to"""
+        src = f"{self.src_dir}/{rel}"
+        size = file_size(src)
+        convert = False
+        if rel.endswith(".bin"):
+            try:
+                with open(src, "rb") as f:
+                    eventlog.LogReader(f)
+                convert = True
+            except ValueError:
+                pass
+        dst_rel = rel[:-4] + ".csv" if convert else rel
+        dst = f"{self.dst_dir}/{dst_rel}"
+        if seen is not None:
+            seen.add(dst_rel)
+
+        start, src_crc = flash.get(rel, (0, 0))
+        held = card.get(dst_rel)
+        if start > size or held is None or held[0] != file_size(dst):
+            # source replaced, or the card doesn't hold what was sent: start over
+            start, src_crc = 0, 0
+        if start and (yield from self._crc_range(src, 0, start)) != src_crc:
+            start, src_crc = 0, 0  # rewritten on flash since it was sent
+        if start and start == size:
+            return 0
+        dst_start, dst_crc = held if start else (0, 0)
+
+        self._make_dirs(dst_rel)
+        with open(dst, "ab" if start else "wb") as f:
+            out = _CrcWriter(f, dst_crc)
+            if convert:
+                end, src_crc = yield from self._convert(src, out, start, src_crc)
+            else:
+                end, src_crc = yield from self._copy(src, out, start, src_crc)
+
+        if (yield from self._verify(dst, dst_start, out.bytes, dst_crc)) != out.crc:
+            card.pop(dst_rel, None)
+            raise OSError("verify failed")
+
+        card[dst_rel] = (dst_start + out.bytes, out.crc)
+        flash[rel] = (end, src_crc)
+        save_manifest(self.flash_manifest, flash)
+        return out.bytes
+
+    def run(self, keep=()):
+        """Sync every file under src_dir, deleting the verified ones not in keep.
+
+        returns : {"files", "bytes", "unchanged", "deleted", "failed", "ms"}"""
+        for _ in self.job(keep):
+            pass
+        return self.stats
+
+    def job(self, keep=()):
+        """run() as a generator, yielding after every chunk; stats are in self.stats when it ends"""
+        start = time.ticks_ms()
+        flash = load_manifest(self.flash_manifest)
+        card = load_manifest(self.card_manifest)
+        stats = self.stats = {"files": 0, "bytes": 0, "unchanged": 0, "deleted": 0, "failed": 0}
+        self.failed = []
+        files = list(self._files())
+        seen = set()
+        progress = self.progress
+        progress.update(file=None, files_done=0, files_total=len(files), bytes=0)
+        try:
+            for rel in files:
+                src = f"{self.src_dir}/{rel}"
+                progress["file"] = rel
+                try:
+                    nbytes = yield from self.sync_file(rel, flash, card, seen)
+                except OSError as e:
+                    self.failed.append((rel, e))
+                    stats["failed"] += 1
+                    progress["files_done"] += 1
+                    continue
+                if nbytes:
+                    stats["files"] += 1
+                    stats["bytes"] += nbytes
+                else:
+                    stats["unchanged"] += 1
+                if src not in keep:
+                    os.remove(src)
+                    flash.pop(rel, None)
+                    save_manifest(self.flash_manifest, flash)
+                    stats["deleted"] += 1
+                progress["files_done"] += 1
+                yield
+        finally:
+            # one write per job; a stale card manifest only makes a file start over
+            try:
+                save_manifest(self.card_manifest, {name: card[name] for name in card if name in seen})
+            except OSError:
+                pass  # card gone, the next job finds out
+        progress["file"] = None
+        stats["ms"] = time.ticks_diff(time.ticks_ms(), start)
@@ -0,0 +1,166 @@
+"""
+asyncio / uasyncio for the simulated device: the subset Gates.py uses.
+
+Tasks are plain coroutines stepped on the simulator clock.  When no task is
+ready the loop lets time pass until the next sleeper is due, returning early
+if an IRQ sets a ThreadSafeFlag or Event somebody waits on, so wakeups and
+latencies match an event driven runtime.
+"""
+
+import heapq
+from collections import deque
+
+from simcore import core
+
+_IDLE_US = 1000000  # longest single wait with nothing scheduled
+
+_ready = deque()
+_sleeping = []
+_seq = 0
+
+
+class CancelledError(BaseException):
+    pass
+
+
+class _Suspend:
+    def __init__(self, kind, arg):
+        self.kind = kind
+        self.arg = arg
+
+    def __await__(self):
+        yield self
+
+
+class Task:
+    def __init__(self, coro):
+        self.coro = coro
+        self.done = False
+        self.result = None
+        self.error = None
+        self._joiners = []
+
+    def __await__(self):
+        if not self.done:
+            yield _Suspend("join", self)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def cancel(self):
+        if not self.done:
+            self.coro.close()
+            self._finish(None, CancelledError())
+
+    def _finish(self, result, error):
+        self.done = True
+        self.result = result
+        self.error = error
+        for task in self._joiners:
+            _ready.append(task)
+        self._joiners = []
+
+
+class ThreadSafeFlag:
+    def __init__(self):
+        self._flag = False
+        self._waiter = None
+
+    def set(self):
+        self._flag = True
+        if self._waiter is not None:
+            _ready.append(self._waiter)
+            self._waiter = None
+
+    def clear(self):
+        self._flag = False
+
+    async def wait(self):
+        if not self._flag:
+            await _Suspend("flag", self)
+        self._flag = False
+
+
+class Event:
+    def __init__(self):
+        self._flag = False
+        self._waiters = []
+
+    def is_set(self):
+        return self._flag
+
+    def set(self):
+        self._flag = True
+        _ready.extend(self._waiters)
+        self._waiters = []
+
+    def clear(self):
+        self._flag = False
+
+    async def wait(self):
+        if not self._flag:
+            await _Suspend("event", self)
+        return True
+
+
+def create_task(coro):
+    task = Task(coro)
+    _ready.append(task)
+    return task
+
+
+def sleep_ms(ms):
+    return _Suspend("sleep", max(0, int(ms * 1000)))
+
+
+def sleep(seconds):
+    return _Suspend("sleep", max(0, int(seconds * 1000000)))
+
+
+async def gather(*aws):
+    tasks = [aw if isinstance(aw, Task) else create_task(aw) for aw in aws]
+    return [await task for task in tasks]
+
+
+def _step(task):
+    global _seq
+    try:
+        request = task.coro.send(None)
+    except StopIteration as e:
+        task._finish(e.value, None)
+        return
+    except CancelledError as e:
+        task._finish(None, e)
+        return
+    kind = request.kind
+    if kind == "sleep":
+        _seq += 1
+        heapq.heappush(_sleeping, (core.clock.now_us() + request.arg, _seq, task))
+    elif kind == "flag":
+        request.arg._waiter = task
+    elif kind == "event":
+        request.arg._waiters.append(task)
+    elif kind == "join":
+        request.arg._joiners.append(task)
+
+
+def run(coro):
+    global _seq
+    _ready.clear()
+    _sleeping.clear()
+    _seq = 0
+    main = create_task(coro)
+    clock = core.clock
+    while not main.done:
+        while _ready:
+            _step(_ready.popleft())
+        now = clock.now_us()
+        while _sleeping and _sleeping[0][0] <= now:
+            _ready.append(heapq.heappop(_sleeping)[2])
+        if _ready or main.done:
+            continue
+        due = _sleeping[0][0] if _sleeping else now + _IDLE_US
+        clock.advance(max(0, due - now), stop=lambda: bool(_ready))
+    if main.error is not None:
+        raise main.error
+    return main.result
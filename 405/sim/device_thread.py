@@ -0,0 +1,59 @@
+"""
+_thread for the simulated RP2040: one extra thread, run on core 1.
+
+Threads only hand over to each other when they sleep (see simcore.Cores), so
+a lock held by the other core is waited for by sleeping 1 us at a time.
+"""
+
+from simcore import core
+
+
+class LockType:
+    def __init__(self):
+        self._locked = False
+
+    def acquire(self, waitflag=1, timeout=-1):
+        if self._locked:
+            if not waitflag:
+                return False
+            while self._locked:
+                core.cores.sleep(1)
+        self._locked = True
+        return True
+
+    def release(self):
+        if not self._locked:
+            raise RuntimeError("release unlocked lock")
+        self._locked = False
+
+    def locked(self):
+        return self._locked
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def allocate_lock():
+    return LockType()
+
+
+def start_new_thread(function, args, kwargs=None):
+    kwargs = kwargs or {}
+    core.cores.start(lambda *a: function(*a, **kwargs), args)
+    return 1
+
+
+def get_ident():
+    return core.cores.current() + 1
+
+
+def stack_size(size=None):
+    return 0
+
+
+def exit():
+    raise SystemExit
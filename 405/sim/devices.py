@@ -0,0 +1,315 @@
+"""
+Register/protocol models of the chips on the gate controller.
+
+DS3231Model answers the I2C register reads and writes that ds3231.py makes,
+with the time running on the simulator clock and the 1 Hz SQW output driven
+onto a pin.  SDCardModel speaks the SPI-mode SD protocol that sdcard.py uses
+(CMD0/8/9/10/12/13/16/17/18/24/25/55/58, ACMD41, data tokens and busy
+signalling) on top of a sparse block store.
+"""
+
+import datetime
+from collections import deque
+
+from simcore import core
+
+_EPOCH = datetime.datetime(2000, 1, 1)
+
+
+def _bcd(value):
+    return (value // 10) << 4 | (value % 10)
+
+
+def _dec(bcd):
+    return (bcd >> 4) * 10 + (bcd & 0x0F)
+
+
+def crc16(data):
+    """CRC-16/XMODEM, the CRC SD cards put after each data block"""
+    crc = 0
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = (crc << 1) ^ 0x1021 if crc & 0x8000 else crc << 1
+            crc &= 0xFFFF
+    return crc
+
+
+class DS3231Model:
+    CONTROL = 0x0E
+    STATUS = 0x0F
+
+    def __init__(self, start=None, sqw_pin=None, ppm=0):
+        if start is None:
+            start = datetime.datetime.now()
+        self.regs = bytearray(19)
+        self.regs[self.CONTROL] = 0x1C  # power-on default: INTCN=1, RS=8 kHz
+        self.regs[self.STATUS] = 0x08  # EN32kHz, OSF clear (clock was set)
+        self.regs[0x11] = 25  # 25.00 degrees C
+        self.sqw_pin = sqw_pin
+        self.rate = 1 + ppm / 1000000  # RTC seconds per simulated second
+        self.reads = 0
+        self.writes = 0
+        self._sqw_generation = 0
+        # the seconds chain keeps the sub-second phase of `start`
+        self._set_seconds(int((start - _EPOCH).total_seconds()), start.microsecond)
+
+    def _set_seconds(self, seconds, phase_us=0):
+        self._base_s = seconds
+        self._base_us = core.clock.now_us() - phase_us
+
+    def seconds(self):
+        return self._base_s + int((core.clock.now_us() - self._base_us) * self.rate) // 1000000
+
+    def _edge_time(self, n):
+        """Simulator time at which the n-th second after the base starts"""
+        return self._base_us + int(-(-n * 1000000 // self.rate))
+
+    def _refresh(self):
+        dt = _EPOCH + datetime.timedelta(seconds=self.seconds())
+        regs = self.regs
+        regs[0] = _bcd(dt.second)
+        regs[1] = _bcd(dt.minute)
+        regs[2] = _bcd(dt.hour)
+        regs[3] = _bcd(dt.isoweekday())
+        regs[4] = _bcd(dt.day)
+        regs[5] = _bcd(dt.month)
+        regs[6] = _bcd(dt.year - 2000)
+
+    def read(self, reg, buf):
+        self.reads += 1
+        self._refresh()
+        for i in range(len(buf)):
+            buf[i] = self.regs[(reg + i) % len(self.regs)]
+
+    def write(self, reg, data):
+        self.writes += 1
+        self._refresh()
+        for i, byte in enumerate(data):
+            self.regs[(reg + i) % len(self.regs)] = byte
+        if reg <= 6:
+            # writing the time restarts the countdown chain at a full second
+            r = self.regs
+            dt = datetime.datetime(2000 + _dec(r[6]), _dec(r[5] & 0x1F), _dec(r[4]),
+                                   _dec(r[2] & 0x3F), _dec(r[1]), _dec(r[0]))
+            self._set_seconds(int((dt - _EPOCH).total_seconds()))
+        if reg <= self.CONTROL < reg + len(data) or reg <= 6:
+            self._restart_sqw()
+
+    def _restart_sqw(self):
+        self._sqw_generation += 1
+        if self.sqw_pin is None:
+            return
+        control = self.regs[self.CONTROL]
+        if control & 0x04 or control & 0x18:
+            core.release(self.sqw_pin)  # INTCN set or not 1 Hz: nothing to simulate
+            return
+        n = self.seconds() - self._base_s + 1
+        core.clock.call_at(self._edge_time(n), self._sqw_edge, self._sqw_generation, n)
+
+    def _sqw_edge(self, generation, n):
+        if generation != self._sqw_generation:
+            return
+        # falling edge when the seconds register increments, high again half a second later
+        core.drive(self.sqw_pin, 0)
+        core.clock.call_at(self._edge_time(n) + 500000, self._sqw_high, generation)
+        core.clock.call_at(self._edge_time(n + 1), self._sqw_edge, generation, n + 1)
+
+    def _sqw_high(self, generation):
+        if generation == self._sqw_generation:
+            core.drive(self.sqw_pin, 1)
+
+
+class SDCardModel:
+    """SDHC card in SPI mode.
+
+    Bytes are exchanged one at a time: the card answers with the next byte of
+    its output queue (0xFF when idle) and then consumes the byte it was sent.
+    Data block payloads are corrupted when the bus runs faster than
+    max_baudrate, the way long wires to a card socket fail, so a driver
+    checking the CRC can notice."""
+
+    BLOCK = 512
+    _PAYLOAD = 0x100  # marks data block payload bytes in the output queue
+
+    def __init__(self, sectors=1 << 24, present=True, max_baudrate=25000000, serial=0x5EED0001,
+                 tran_speed=0x32, write_busy_us=300, read_access_us=100):
+        self.sectors = sectors
+        self.present = present
+        self.max_baudrate = max_baudrate
+        self.tran_speed = tran_speed  # CSD TRAN_SPEED, 0x32 = 25 MHz, 0x5A = 50 MHz
+        self.write_busy_us = write_busy_us  # programming time after each block
+        self.read_access_us = read_access_us  # time before a block's data token
+        self.blocks = {}
+        self.cid = b"\x03SDSIM01\x10" + serial.to_bytes(4, "big") + b"\x01\x9a\x01"
+        self.stats = {"commands": 0, "blocks_read": 0, "blocks_written": 0, "single_reads": 0,
+                      "multi_reads": 0, "single_writes": 0, "multi_writes": 0, "corrupted": 0}
+        self.power_cycle()
+
+    def power_cycle(self):
+        self.out = deque()
+        self.cmd = bytearray()
+        self.state = "cmd"
+        self.ready = False
+        self.app_cmd = False
+        self.init_polls = 3  # ACMD41 calls before the card leaves the idle state
+        self.sector = 0
+        self.data = bytearray()
+        self.busy_until = 0
+        self.data_at = 0
+
+    def insert(self):
+        self.present = True
+        self.power_cycle()
+
+    def remove(self):
+        self.present = False
+
+    # --- SPI byte exchange ---------------------------------------------
+
+    def exchange(self, byte, baudrate):
+        if not self.present:
+            return 0xFF
+        now = core.clock.now_us()
+        if not self.out:
+            if now < self.busy_until:
+                result = 0x00
+                self._consume(byte)
+                return result
+            if self.state == "read_multi":
+                self._queue_block(self.sector)
+                self.sector += 1
+        result = self.out.popleft() if self.out else 0xFF
+        if result == 0xFE and now < self.data_at:
+            self.out.appendleft(result)  # block not ready yet
+            result = 0xFF
+        elif result & self._PAYLOAD:
+            result &= 0xFF
+            if baudrate > self.max_baudrate:
+                self.stats["corrupted"] += 1
+                result ^= 0x10
+        self._consume(byte)
+        return result
+
+    def _consume(self, byte):
+        state = self.state
+        if state in ("write_single", "write_multi"):
+            if byte in (0xFE, 0xFC):
+                self.data = bytearray()
+                self.state = state + "_data"
+            elif byte == 0xFD and state == "write_multi":
+                self.out.append(0xFF)
+                self.busy_until = core.clock.now_us() + self.write_busy_us
+                self.state = "cmd"
+            return
+        if state.endswith("_data"):
+            self.data.append(byte)
+            if len(self.data) == self.BLOCK + 2:
+                self._store(self.sector, bytes(self.data[: self.BLOCK]))
+                self.sector += 1
+                self.out.append(0xE5)  # data accepted
+                self.busy_until = core.clock.now_us() + self.write_busy_us
+                self.state = "write_multi" if state == "write_multi_data" else "cmd"
+            return
+        # command frame: 01xxxxxx, 4 argument bytes, CRC
+        if self.cmd or (byte & 0xC0) == 0x40:
+            self.cmd.append(byte)
+            if len(self.cmd) == 6:
+                cmd = bytes(self.cmd)
+                self.cmd = bytearray()
+                self._command(cmd[0] & 0x3F, int.from_bytes(cmd[1:5], "big"))
+
+    def _r1(self, value, *extra):
+        self.out.clear()
+        self.out.extend((0xFF, value) + extra)
+
+    def _command(self, index, arg):
+        self.stats["commands"] += 1
+        app = self.app_cmd
+        self.app_cmd = False
+        self.state = "cmd"
+        idle = 0x00 if self.ready else 0x01
+        if index == 0:
+            self.power_cycle()
+            self._r1(0x01)
+        elif index == 8:
+            self._r1(idle, 0x00, 0x00, 0x01, arg & 0xFF)
+        elif index == 55:
+            self.app_cmd = True
+            self._r1(idle)
+        elif index == 41 and app:
+            self.init_polls -= 1
+            if self.init_polls <= 0:
+                self.ready = True
+            self._r1(0x00 if self.ready else 0x01)
+        elif index == 58:
+            ocr0 = 0xC0 if self.ready else 0x00  # powered up, CCS (block addressing)
+            self._r1(idle, ocr0, 0xFF, 0x80, 0x00)
+        elif index == 9:
+            self._r1(0x00)
+            self._queue_data(self._csd())
+        elif index == 10:
+            self._r1(0x00)
+            self._queue_data(self.cid)
+        elif index == 13:
+            self._r1(0x00, 0x00)
+        elif index == 16:
+            self._r1(0x00 if arg == self.BLOCK else 0x40)
+        elif index == 17:
+            self.stats["single_reads"] += 1
+            self._r1(0x00)
+            self._queue_block(arg)
+        elif index == 18:
+            self.stats["multi_reads"] += 1
+            self._r1(0x00)
+            self._queue_block(arg)
+            self.sector = arg + 1
+            self.state = "read_multi"
+        elif index == 12:
+            self.out.clear()
+            self.out.extend((0xFF, 0x00))  # stuff byte, R1
+        elif index == 24:
+            self.stats["single_writes"] += 1
+            self._r1(0x00)
+            self.sector = arg
+            self.state = "write_single"
+        elif index == 25:
+            self.stats["multi_writes"] += 1
+            self._r1(0x00)
+            self.sector = arg
+            self.state = "write_multi"
+        else:
+            self._r1(idle | 0x04)  # illegal command
+
+    def _queue_data(self, payload):
+        crc = crc16(payload)
+        self.data_at = core.clock.now_us() + self.read_access_us
+        self.out.extend((0xFF, 0xFE))
+        self.out.extend(b | self._PAYLOAD for b in payload)
+        self.out.extend((crc >> 8 | self._PAYLOAD, crc & 0xFF | self._PAYLOAD))
+
+    def _queue_block(self, sector):
+        self.stats["blocks_read"] += 1
+        self._queue_data(self.blocks.get(sector, bytes(self.BLOCK)))
+
+    def _store(self, sector, data):
+        self.stats["blocks_written"] += 1
+        self.blocks[sector] = data
+
+    def _csd(self):
+        c_size = self.sectors // 1024 - 1
+        csd = bytearray(16)
+        csd[0] = 0x40  # CSD version 2.0
+        csd[1] = 0x0E
+        csd[3] = self.tran_speed
+        csd[4] = 0x5B
+        csd[5] = 0x59
+        csd[7] = (c_size >> 16) & 0x3F
+        csd[8] = (c_size >> 8) & 0xFF
+        csd[9] = c_size & 0xFF
+        csd[10] = 0x7F
+        csd[11] = 0x80
+        csd[12] = 0x0A
+        csd[13] = 0x40
+        csd[15] = 0x01
+        return bytes(csd)
@@ -0,0 +1,271 @@
+"""
+Stand-in for the MicroPython `machine` module on the host.
+
+Only what the firmware in this repo uses is implemented.  Pins, buses and
+their attached device models all live on simcore.core, so the simulator can
+drive inputs and inspect outputs while the firmware runs.
+"""
+
+from simcore import core
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_LEVEL_LOW = 1
+    IRQ_LEVEL_HIGH = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, pin_id, mode=-1, pull=-1, value=None):
+        self.id = pin_id
+        self._state = core.pin(pin_id)
+        self.init(mode, pull, value=value)
+
+    def init(self, mode=-1, pull=-1, value=None):
+        state = self._state
+        if mode == Pin.OUT:
+            state.mode = "out"
+        elif mode in (Pin.IN, Pin.OPEN_DRAIN):
+            state.mode = "in"
+        if pull == Pin.PULL_UP:
+            state.pull = "up"
+        elif pull == Pin.PULL_DOWN:
+            state.pull = "down"
+        if value is not None:
+            self.value(value)
+
+    def value(self, value=None):
+        state = self._state
+        if value is None:
+            return state.level()
+        value = 1 if value else 0
+        if state.mode == "out" and value != state.out_value:
+            state.history.append((core.clock.now_us(), value))
+        state.out_value = value
+
+    __call__ = value
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    high = on
+    low = off
+
+    def toggle(self):
+        self.value(not self._state.out_value)
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING, hard=False):
+        state = self._state
+        state.handler = handler
+        state.trigger = trigger if handler else 0
+        state.pin_obj = self
+
+    def __repr__(self):
+        return f"Pin({self.id})"
+
+
+class I2C:
+    """I2C bus; devices are register models in core.i2c_devices[bus][addr]"""
+
+    buses = {}
+
+    def __init__(self, bus_id, scl=None, sda=None, freq=400000):
+        self.id = bus_id
+        self.freq = freq
+        I2C.buses[bus_id] = self
+        self.devices = core.i2c_devices.setdefault(bus_id, {})
+
+    def _device(self, addr):
+        device = self.devices.get(addr)
+        if device is None:
+            raise OSError(19)  # ENODEV, like an unanswered address
+        return device
+
+    def _cost(self, nbytes):
+        # address + register + data bytes, 9 clocks each
+        core.clock.advance((nbytes + 2) * 9 * 1000000 // self.freq)
+
+    def scan(self):
+        return sorted(self.devices)
+
+    def readfrom_mem(self, addr, reg, nbytes):
+        buf = bytearray(nbytes)
+        self.readfrom_mem_into(addr, reg, buf)
+        return bytes(buf)
+
+    def readfrom_mem_into(self, addr, reg, buf):
+        device = self._device(addr)
+        self._cost(len(buf))
+        device.read(reg, buf)
+
+    def writeto_mem(self, addr, reg, buf):
+        device = self._device(addr)
+        self._cost(len(buf))
+        device.write(reg, bytes(buf))
+
+
+class SPI:
+    """SPI bus; each model in core.spi_devices[bus] answers while its CS pin is low"""
+
+    MSB = 0
+    LSB = 1
+
+    def __init__(self, bus_id, baudrate=1000000, polarity=0, phase=0, sck=None, mosi=None, miso=None, **kwargs):
+        self.id = bus_id
+        self.baudrate = baudrate
+        self.devices = core.spi_devices.setdefault(bus_id, [])
+        self.bytes_transferred = 0
+        self._bits = 0
+
+    def init(self, baudrate=None, polarity=0, phase=0, **kwargs):
+        if baudrate is not None:
+            self.baudrate = baudrate
+
+    def deinit(self):
+        pass
+
+    def _exchange(self, out):
+        self.bytes_transferred += 1
+        for cs_pin, device in self.devices:
+            if core.pin(cs_pin).level() == 0:
+                return device.exchange(out, self.baudrate)
+        return 0xFF
+
+    def _cost(self, nbytes):
+        # carry the fraction so single byte transfers above 8 MHz still take time
+        bits = self._bits + nbytes * 8 * 1000000
+        self._bits = bits % self.baudrate
+        core.clock.advance(bits // self.baudrate)
+
+    def write(self, buf):
+        for b in bytes(buf):
+            self._exchange(b)
+        self._cost(len(buf))
+
+    def read(self, nbytes, write=0x00):
+        buf = bytearray(nbytes)
+        self.readinto(buf, write)
+        return bytes(buf)
+
+    def readinto(self, buf, write=0x00):
+        for i in range(len(buf)):
+            buf[i] = self._exchange(write)
+        self._cost(len(buf))
+
+    def write_readinto(self, write_buf, read_buf):
+        out = bytes(write_buf)
+        for i in range(len(read_buf)):
+            read_buf[i] = self._exchange(out[i])
+        self._cost(len(read_buf))
+
+
+class ADC:
+    """read_u16() returns the pin's `analog` value, set by the simulated world
+    (full scale or 0 from the digital level when it was never set)"""
+
+    CORE_TEMP = 4
+
+    def __init__(self, pin):
+        pin_id = pin.id if isinstance(pin, Pin) else pin
+        if 0 <= pin_id <= 3:
+            pin_id += 26  # channel number
+        self._state = core.pin(pin_id)
+
+    def read_u16(self):
+        core.clock.advance(2)  # one conversion
+        state = self._state
+        if state.analog is not None:
+            return state.analog
+        return 65535 if state.level() else 0
+
+
+class Timer:
+    """Software timer on the simulator clock, the callback runs like an IRQ"""
+
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, timer_id=-1, **kwargs):
+        self._generation = 0
+        if kwargs:
+            self.init(**kwargs)
+
+    def init(self, mode=PERIODIC, period=-1, callback=None, freq=-1, tick_hz=1000):
+        self.deinit()
+        if freq > 0:
+            period_us = 1000000 // freq
+        else:
+            period_us = period * 1000000 // tick_hz
+        self._mode = mode
+        self._period_us = max(1, period_us)
+        self._callback = callback
+        core.clock.call_later(self._period_us, self._fire, self._generation)
+
+    def _fire(self, generation):
+        if generation != self._generation:
+            return  # re-armed or stopped since
+        if self._mode == Timer.PERIODIC:
+            core.clock.call_later(self._period_us, self._fire, generation)
+        else:
+            self._generation += 1
+        if self._callback is not None:
+            core.irq(self._callback, self)
+
+    def deinit(self):
+        self._generation += 1
+
+
+class _Mem32:
+    """machine.mem32, only the RP2040 SIO GPIO_IN register is modelled"""
+
+    GPIO_IN = 0xD0000004
+
+    def __getitem__(self, addr):
+        if addr != self.GPIO_IN:
+            raise ValueError(f"mem32[{addr:#x}] not simulated")
+        inputs = 0
+        for pin_id, state in core.pins.items():
+            if isinstance(pin_id, int) and pin_id < 30 and state.level():
+                inputs |= 1 << pin_id
+        return inputs
+
+    def __setitem__(self, addr, value):
+        raise ValueError(f"mem32[{addr:#x}] not simulated")
+
+
+mem32 = _Mem32()
+
+
+def freq(hz=None):
+    if hz is None:
+        return 125000000
+
+
+def unique_id():
+    return b"\xe6\x61\x41\x04\x03\x33\x2a\x2c"
+
+
+def idle():
+    core.cores.sleep(1)
+
+
+def disable_irq():
+    core.clock.in_irq += 1
+    return 1
+
+
+def enable_irq(state=1):
+    core.clock.in_irq -= 1
+
+
+def reset():
+    from simcore import SimulationEnd
+
+    raise SimulationEnd()
@@ -0,0 +1,40 @@
+"""
+Stand-in for the MicroPython `micropython` module on the host.
+"""
+
+from simcore import core
+
+
+def const(value):
+    return value
+
+
+def native(fn):
+    return fn
+
+
+viper = native
+
+
+def schedule(fn, arg):
+    core.schedule(fn, arg)
+
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+
+def heap_lock():
+    return 0
+
+
+def heap_unlock():
+    return 0
+
+
+def mem_info(verbose=None):
+    print("mem: simulated, no heap statistics")
+
+
+def opt_level(level=None):
+    return 0
@@ -0,0 +1,77 @@
+"""
+Runs 405/bench.py against the simulated hardware and saves the JSON report.
+
+    python 405/sim/run_bench.py --tag v1.4
+    python 405/sim/run_bench.py --tag v1.5 --compare bench_v1.4.json
+
+By default time is virtual, which makes the loss and misclassification
+figures exactly repeatable but the ISR and write timings meaningless.  Use
+--realtime for timings (of this PC, not of a Pico).
+"""
+
+import argparse
+import json
+import shutil
+
+from simulate import Simulator, DEFAULT_CONFIG
+
+
+def compare(old, new):
+    print(f"{'pattern':10s} max rate {old['tag']} -> {new['tag']}")
+    for name, rate in new["max_rate"].items():
+        before = old["max_rate"].get(name)
+        flag = "  REGRESSION" if before is not None and rate < before else ""
+        print(f"{name:10s} {before} -> {rate}/s{flag}")
+    old_runs = {(r["pattern"], r["rate"]): r for r in old["results"]}
+    for r in new["results"]:
+        o = old_runs.get((r["pattern"], r["rate"]))
+        if o is None:
+            continue
+        for key in ("dropped", "misclassified", "overflows"):
+            if r[key] != o[key]:
+                print(f"  {r['pattern']} {r['rate']}/s {key}: {o[key]} -> {r[key]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Beam-break storm benchmark on simulated hardware")
+    parser.add_argument("--tag", default="dev", help="firmware version label stored in the report")
+    parser.add_argument("--out", help="report path (default: bench_TAG.json)")
+    parser.add_argument("--config", default=DEFAULT_CONFIG)
+    parser.add_argument("--patterns", default="crowd,both_sets,bounce")
+    parser.add_argument("--rates", help="crossings per second (default: sweep until overflow or saturation)")
+    parser.add_argument("--duration", type=float, default=3, help="seconds per run")
+    parser.add_argument("--realtime", action="store_true", help="time ISRs and writes with the host clock")
+    parser.add_argument("--compare", help="earlier report to compare against")
+    args = parser.parse_args()
+
+    sim = Simulator(args.config, realtime=args.realtime, quiet=True)
+    bench = sim.import_device("bench")
+    report = bench.run(
+        tag=args.tag,
+        patterns=args.patterns.split(","),
+        rates=[int(r) for r in args.rates.split(",")] if args.rates else None,
+        duration_ms=int(args.duration * 1000),
+    )
+    report["platform"] = "sim"
+    report["clock"] = "realtime" if args.realtime else "virtual"
+    for r in report["results"]:
+        print(f"{r['pattern']:9s} {r['rate']:4d}/s crossings {r['crossings']:4d} overlaps {r['overlaps']:4d} "
+              f"dropped {r['dropped']:4d} "
+              f"misclassified {r['misclassified']:4d} overflows {r['overflows']:3d} "
+              f"isr p99 {r['isr_us']['p99']}us write max {r['write_us']['max']}us")
+    print(f"max lossless rate: {report['max_rate']}")
+    if report["sweep_stopped"]:
+        print(f"sweep stopped: {report['sweep_stopped']}")
+    out = args.out or f"bench_{args.tag}.json"
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"report: {out}")
+    shutil.rmtree(sim.root)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
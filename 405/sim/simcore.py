@@ -0,0 +1,304 @@
+"""
+Shared state of the host simulator: virtual clock, event queue and pins.
+
+Every stand-in module (machine, micropython, the device time module) talks to
+the single `core` instance below.  Time only moves when the device code
+sleeps, reads a ticks counter or uses a bus, so a run is deterministic and
+much faster than real time.  With realtime=True the clock follows the host's
+perf_counter() instead.
+"""
+
+import heapq
+import sys
+import threading
+import time as _host_time
+
+TICKS_PERIOD = 1 << 30
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALF = TICKS_PERIOD // 2
+
+TICK_READ_US = 1  # cost of reading a ticks counter, keeps busy-wait loops moving
+
+
+class SimulationEnd(BaseException):
+    """Raised into the device code when the run is over.
+
+    BaseException so that `except Exception` in the firmware doesn't eat it."""
+
+
+class Clock:
+    def __init__(self, realtime=False, start_us=0):
+        self.realtime = realtime
+        self._t0 = _host_time.perf_counter()
+        self._start = start_us
+        self._now = start_us
+        self._queue = []
+        self._seq = 0
+        self.end_us = None
+        self.in_irq = 0
+        self._dispatching = False
+
+    def now_us(self):
+        if self.realtime:
+            return self._start + int((_host_time.perf_counter() - self._t0) * 1000000)
+        return self._now
+
+    def call_at(self, t_us, fn, *args):
+        self._seq += 1
+        heapq.heappush(self._queue, (t_us, self._seq, fn, args))
+
+    def call_later(self, delay_us, fn, *args):
+        self.call_at(self.now_us() + delay_us, fn, *args)
+
+    def advance(self, us, stop=None):
+        """Let `us` microseconds pass, firing every event that falls due.
+        Returns early, at the time of the event, once stop() is true."""
+        target = self.now_us() + us
+        if self._dispatching:
+            # time spent inside an IRQ handler or event: events that fall due
+            # meanwhile fire once it returns, interrupts don't nest
+            if not self.realtime and target > self._now:
+                self._now = target
+            return
+        while self._queue and self._queue[0][0] <= max(target, self.now_us()):
+            t, _, fn, args = heapq.heappop(self._queue)
+            if self.realtime:
+                wait = (t - self.now_us()) / 1000000
+                if wait > 0:
+                    _host_time.sleep(wait)
+            elif t > self._now:
+                self._now = t
+            self._check_end()
+            self._dispatching = True
+            try:
+                fn(*args)
+            finally:
+                self._dispatching = False
+            core.run_scheduled()
+            if stop is not None and stop():
+                self._check_end()
+                return
+        if self.realtime:
+            wait = (target - self.now_us()) / 1000000
+            if wait > 0:
+                _host_time.sleep(wait)
+        elif target > self._now:
+            self._now = target
+        self._check_end()
+
+    def _check_end(self):
+        if self.end_us is not None and self.now_us() >= self.end_us and not self.in_irq:
+            raise SimulationEnd()
+
+
+class PinState:
+    """One physical GPIO: what drives it and who listens to it"""
+
+    def __init__(self, pin_id):
+        self.id = pin_id
+        self.mode = None
+        self.pull = None
+        self.out_value = 0
+        self.external = None  # level forced by the simulated world, None = not driven
+        self.analog = None  # ADC reading (0-65535) set by the simulated world
+        self.handler = None
+        self.trigger = 0
+        self.history = []  # (time_us, level) of output changes, for inspection
+
+    def level(self):
+        if self.mode == "out":
+            return self.out_value
+        if self.external is not None:
+            return self.external
+        if self.pull == "up":
+            return 1
+        return 0
+
+
+class Cores:
+    """The RP2040's second core, for _thread.start_new_thread.
+
+    Each core runs in its own host thread but only one runs at a time: a core
+    keeps going until it sleeps, then the core due to wake first continues
+    and the clock moves on to its wake time.  Busy loops and bus transfers
+    don't hand over, so time one core spends in them isn't given to the
+    other; IRQs still fire when they fall due, whichever core is running."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._wake = {}  # core -> wake time (us), only while core 1 runs
+        self._idents = {}  # host thread -> core
+        self._running = 0
+        self._ended = False
+
+    def current(self):
+        return self._idents.get(threading.get_ident(), 0)
+
+    def start(self, fn, args):
+        if self._wake:
+            raise OSError(16, "core1 in use")
+        now = core.clock.now_us()
+        self._wake = {0: now, 1: now}
+        threading.Thread(target=self._run, args=(fn, args), daemon=True).start()
+
+    def _run(self, fn, args):
+        self._idents[threading.get_ident()] = 1
+        try:
+            self._wait_turn(1)
+            fn(*args)
+        except SimulationEnd:
+            pass
+        except BaseException as e:
+            print(f"Unhandled exception in thread started by {fn}", file=sys.stderr)
+            sys.excepthook(type(e), e, e.__traceback__)
+        finally:
+            with self._cond:
+                self._wake = {}
+                self._running = 0
+                self._cond.notify_all()
+
+    def _wait_turn(self, me):
+        with self._cond:
+            self._cond.wait_for(lambda: self._running == me or self._ended)
+        if self._ended:
+            raise SimulationEnd()
+
+    def _end(self):
+        with self._cond:
+            self._ended = True
+            self._cond.notify_all()
+
+    def sleep(self, us):
+        clock = core.clock
+        if not self._wake:
+            clock.advance(us)
+            return
+        me = self.current()
+        self._wake[me] = clock.now_us() + us
+        try:
+            while True:
+                wake = self._wake
+                if not wake:  # core 1 finished while this core waited
+                    break
+                nxt = min(wake, key=lambda c: (wake[c], c))
+                if nxt == me:
+                    break
+                clock.advance(max(0, wake[nxt] - clock.now_us()))
+                with self._cond:
+                    self._running = nxt
+                    self._cond.notify_all()
+                self._wait_turn(me)
+            due = self._wake.get(me, 0) if self._wake else 0
+            clock.advance(max(0, due - clock.now_us()))
+        except SimulationEnd:
+            self._end()
+            raise
+
+
+class Core:
+    def __init__(self):
+        self.clock = Clock()
+        self.cores = Cores()
+        self.pins = {}
+        self.scheduled = []
+        self.schedule_depth = 8
+        self.irq_count = 0
+        self._in_scheduled = False
+        self.i2c_devices = {}  # bus id -> {address: register model}
+        self.spi_devices = {}  # bus id -> [(cs pin, device model)]
+
+    def reset(self, realtime=False, start_us=0):
+        self.__init__()
+        self.clock = Clock(realtime, start_us)
+
+    def pin(self, pin_id):
+        state = self.pins.get(pin_id)
+        if state is None:
+            state = self.pins[pin_id] = PinState(pin_id)
+        return state
+
+    def drive(self, pin_id, level):
+        """Drive an input from outside (beam, button, card detect, ...)"""
+        state = self.pin(pin_id)
+        before = state.level()
+        state.external = level
+        self._edge(state, before)
+
+    def release(self, pin_id):
+        state = self.pin(pin_id)
+        before = state.level()
+        state.external = None
+        self._edge(state, before)
+
+    def _edge(self, state, before):
+        after = state.level()
+        if after == before or state.handler is None:
+            return
+        # machine.Pin.IRQ_FALLING = 4, IRQ_RISING = 8 (rp2 values)
+        if (after == 0 and state.trigger & 4) or (after == 1 and state.trigger & 8):
+            self.irq(state.handler, state.pin_obj)
+
+    def irq(self, handler, arg):
+        self.irq_count += 1
+        self.clock.in_irq += 1
+        try:
+            handler(arg)
+        finally:
+            self.clock.in_irq -= 1
+        self.run_scheduled()
+
+    def schedule(self, fn, arg):
+        if len(self.scheduled) >= self.schedule_depth:
+            raise RuntimeError("schedule queue full")
+        self.scheduled.append((fn, arg))
+
+    def run_scheduled(self):
+        if self.clock.in_irq or self.clock._dispatching or self._in_scheduled:
+            return
+        self._in_scheduled = True
+        try:
+            while self.scheduled:
+                fn, arg = self.scheduled.pop(0)
+                fn(arg)
+        finally:
+            self._in_scheduled = False
+
+
+core = Core()
+
+
+def ticks_us():
+    core.clock.advance(TICK_READ_US)
+    return core.clock.now_us() & TICKS_MAX
+
+
+def ticks_ms():
+    core.clock.advance(TICK_READ_US)
+    return (core.clock.now_us() // 1000) & TICKS_MAX
+
+
+def ticks_cpu():
+    return ticks_us()
+
+
+def ticks_diff(a, b):
+    return ((a - b + TICKS_HALF) & TICKS_MAX) - TICKS_HALF
+
+
+def ticks_add(ticks, delta):
+    # the port rejects deltas ticks_diff() couldn't give back
+    if not -TICKS_HALF <= delta < TICKS_HALF:
+        raise OverflowError("ticks interval overflow")
+    return (ticks + delta) & TICKS_MAX
+
+
+def sleep_us(us):
+    core.cores.sleep(max(0, int(us)))
+
+
+def sleep_ms(ms):
+    core.cores.sleep(max(0, int(ms * 1000)))
+
+
+def sleep(seconds):
+    core.cores.sleep(max(0, int(seconds * 1000000)))
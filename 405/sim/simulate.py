@@ -0,0 +1,731 @@
+"""
+Runs the gate controller firmware on CPython against simulated hardware.
+
+The unmodified device scripts (405/Gates.py by default) are executed with
+stand-ins for the MicroPython modules:
+
+  * machine / micropython  -> machine.py / micropython.py in this folder
+  * time / utime           -> ticks_*, sleep_* on the simulator clock
+  * os / uos, open()       -> a sandbox folder with "flash" and "sd" halves,
+                              "/sd" is only reachable while mounted
+  * _thread                -> device_thread.py, core 1 (see simcore.Cores)
+  * asyncio / uasyncio     -> device_asyncio.py, tasks on the simulator clock
+  * gc                     -> stub
+
+The DS3231 (I2C 0, 0x68) and the SD card (SPI 1, CS from the config) are
+register/protocol models from devices.py, so ds3231.py and sdcard.py run
+unchanged.  Beam breaks, buttons and card insert/remove are injected from a
+trace file or a recorded binary event log.
+
+Time is virtual: it only moves while the firmware sleeps, reads a ticks
+counter, uses a bus or writes a file, and IRQ handlers run at those points.
+Bus transfers, SD busy times and flash writes cost simulated time, Python
+execution does not.  --realtime follows the host clock instead.
+
+Trace file, one event per line ("#" starts a comment):
+
+    # t_ms, target, [hold_ms]
+    500,  button:A                 press test button A (starts the test)
+    1000, A:Left_Left              break a beam of set A for 20 ms
+    1100, A:Left_Right, 30
+    1500, cross:B:Right:Left       full crossing (two beams 100 ms apart)
+    4000, card:in                  insert the SD card (card:out removes it)
+    4500, button:download
+    6000, pin:26=0                 drive any GPIO (pin:26 pulses it low)
+
+Examples:
+
+    python 405/sim/simulate.py --trace 405/sim/example_trace.txt
+    python 405/sim/simulate.py --from-log Data/2025-10-06_A_19-15-00.bin
+"""
+
+import argparse
+import builtins
+import datetime
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time as _host_time
+import types
+import zlib
+
+import simcore
+from simcore import core, SimulationEnd
+from devices import DS3231Model, SDCardModel
+
+SIM_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(os.path.dirname(SIM_DIR))
+FIRMWARE_DIR = os.path.dirname(SIM_DIR)
+
+# Folders the device modules are found in (flat on the real device)
+DEVICE_PATH = [
+    FIRMWARE_DIR,
+    os.path.join(REPO_DIR, "Task #1 - CSV", "RTC"),
+    os.path.join(REPO_DIR, "Task #1 - CSV"),
+    os.path.join(REPO_DIR, "Task #2 - CSV 2 and SD Card"),
+    os.path.join(REPO_DIR, "Task #3 - Connectivity"),
+]
+
+DEFAULT_SCRIPT = os.path.join(FIRMWARE_DIR, "Gates.py")
+DEFAULT_CONFIG = os.path.join(FIRMWARE_DIR, "backup config.py")
+
+# Flash filesystem cost model (littlefs on the Pico's QSPI flash)
+FLASH_WRITE_CALL_US = 200
+FLASH_WRITE_BYTE_US = 8
+FLASH_READ_BYTE_US = 1
+
+# Simulated FAT layout: allocation table, directory sectors, then file data
+FAT_TABLE_SECTOR = 32
+FAT_DIR_SECTOR = 4096
+FAT_DIR_SECTORS = 256
+FAT_DATA_SECTOR = 8192
+
+
+# =========================================================
+# --- Device time module ---
+# =========================================================
+def make_time_module(epoch_s):
+    mod = types.ModuleType("time")
+    mod.ticks_us = simcore.ticks_us
+    mod.ticks_ms = simcore.ticks_ms
+    mod.ticks_cpu = simcore.ticks_cpu
+    mod.ticks_diff = simcore.ticks_diff
+    mod.ticks_add = simcore.ticks_add
+    mod.sleep = simcore.sleep
+    mod.sleep_ms = simcore.sleep_ms
+    mod.sleep_us = simcore.sleep_us
+
+    def time():
+        return epoch_s + core.clock.now_us() // 1000000
+
+    def time_ns():
+        return (epoch_s * 1000000 + core.clock.now_us()) * 1000
+
+    def localtime(secs=None):
+        t = _host_time.gmtime(time() if secs is None else secs)
+        return (t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec, t.tm_wday, t.tm_yday)
+
+    mod.time = time
+    mod.time_ns = time_ns
+    mod.localtime = localtime
+    mod.gmtime = localtime
+    return mod
+
+
+class DeviceSys(types.ModuleType):
+    """sys as seen on the Pico, everything but the platform comes from the host"""
+
+    platform = "rp2"
+
+    def __init__(self):
+        super().__init__("sys")
+
+    def __getattr__(self, name):
+        return getattr(sys, name)
+
+
+def make_gc_module():
+    mod = types.ModuleType("gc")
+    mod.collect = lambda: None
+    mod.enable = lambda: None
+    mod.disable = lambda: None
+    mod.mem_free = lambda: 150000
+    mod.mem_alloc = lambda: 40000
+    mod.threshold = lambda amount=None: -1
+    return mod
+
+
+class DeviceBytearray(bytearray):
+    """bytearray that stores ints modulo 256 like MicroPython's (CPython raises)"""
+
+    def __setitem__(self, index, value):
+        if isinstance(value, int):
+            value &= 0xFF
+        super().__setitem__(index, value)
+
+
+# =========================================================
+# --- Device filesystem ---
+# =========================================================
+class VfsFat:
+    """FAT volume on a block device.
+
+    File contents live in the sandbox's sd folder; the block device only sees
+    the sector traffic a FAT driver would generate, which goes through the
+    real sdcard.py driver and costs simulated SPI time."""
+
+    def __init__(self, dev):
+        self.dev = dev
+        self.host_dir = None
+        self._block = bytearray(512)
+        self._sector = FAT_DATA_SECTOR
+        self.cluster_sectors = None  # known once mounted
+        self.blocks_read = 0
+        self.blocks_written = 0
+
+    def _transfer(self, nblocks, write):
+        buf = self._block if nblocks == 1 else bytearray(512 * nblocks)
+        if write:
+            self.dev.writeblocks(self._sector, buf)
+            self.blocks_written += nblocks
+        else:
+            self.dev.readblocks(self._sector, buf)
+            self.blocks_read += nblocks
+        self._sector += nblocks
+
+    def _sector_io(self, sector, write):
+        if write:
+            self.dev.writeblocks(sector, self._block)
+            self.blocks_written += 1
+        else:
+            self.dev.readblocks(sector, self._block)
+            self.blocks_read += 1
+
+    def dir_io(self, host_path, write=False):
+        """Directory sector holding host_path's entry: read it, and write it back to change it"""
+        parent = os.path.relpath(os.path.dirname(host_path), self.host_dir)
+        sector = FAT_DIR_SECTOR + zlib.crc32(parent.encode()) % FAT_DIR_SECTORS
+        self._sector_io(sector, False)
+        if write:
+            self._sector_io(sector, True)
+
+    def fat_io(self):
+        """Read-modify-write of the FAT sector covering the clusters being allocated"""
+        cluster = (self._sector - FAT_DATA_SECTOR) // self.cluster_sectors
+        sector = FAT_TABLE_SECTOR + cluster // 128  # 128 FAT32 entries per sector
+        self._sector_io(sector, False)
+        self._sector_io(sector, True)
+
+    def io(self, nblocks, write, multi=False):
+        """Sector traffic of a file access.  Like FatFs, whole sectors of a
+        large read/write go to the device directly, several at a time up to
+        the end of the cluster; anything else goes one sector at a time
+        through the sector buffer."""
+        while nblocks > 0:
+            n = 1
+            if multi:
+                n = min(nblocks, self.cluster_sectors - self._sector % self.cluster_sectors)
+            self._transfer(n, write)
+            nblocks -= n
+
+
+class DeviceFile:
+    """Host file seen through the device filesystem, costs simulated time"""
+
+    def __init__(self, f, vfs):
+        self._f = f
+        self._vfs = vfs
+        self._pending = 0
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        for line in self._f:
+            self._cost(len(line), False)
+            yield line
+
+    def _cost(self, nbytes, write):
+        if self._vfs is None:
+            if write:
+                core.clock.advance(FLASH_WRITE_CALL_US + nbytes * FLASH_WRITE_BYTE_US)
+            else:
+                core.clock.advance(nbytes * FLASH_READ_BYTE_US)
+            return
+        partial = self._pending
+        blocks, self._pending = divmod(partial + nbytes, 512)
+        if blocks and partial:
+            self._vfs.io(1, write)  # finishes the sector in the sector buffer
+            blocks -= 1
+        self._vfs.io(blocks, write, multi=nbytes >= 1024)
+
+    def write(self, data):
+        n = self._f.write(data)
+        self._cost(len(data), True)
+        return n
+
+    def read(self, *args):
+        data = self._f.read(*args)
+        self._cost(len(data), False)
+        return data
+
+    def readline(self, *args):
+        data = self._f.readline(*args)
+        self._cost(len(data), False)
+        return data
+
+    def readinto(self, buf):
+        n = self._f.readinto(buf)
+        self._cost(n or 0, False)
+        return n
+
+    def flush(self):
+        self._f.flush()
+        if self._vfs is not None and self._pending and self._f.writable():
+            self._vfs.io(1, True)  # partial sector goes out on flush
+            self._pending = 0
+
+    def close(self):
+        if self._f.closed:
+            return
+        self.flush()
+        if self._vfs is not None and self._f.writable():
+            self._vfs.dir_io(self._f.name, write=True)  # size in the directory entry
+            self._vfs.fat_io()  # cluster chain
+            self._vfs.dev.ioctl(3, 0)  # f_sync ends with CTRL_SYNC
+        self._f.close()
+
+
+class DeviceFS(types.ModuleType):
+    """The `os` module the firmware sees"""
+
+    def __init__(self, flash_dir, sd_dir):
+        super().__init__("os")
+        self.flash_dir = flash_dir
+        self.sd_dir = sd_dir
+        self.cwd = "/"
+        self.mounts = {}  # device path -> VfsFat
+        self.VfsFat = VfsFat
+        self.sep = "/"
+
+    def _resolve(self, path):
+        if not path.startswith("/"):
+            path = self.cwd.rstrip("/") + "/" + path
+        parts = []
+        for part in path.split("/"):
+            if part in ("", "."):
+                continue
+            if part == "..":
+                if parts:
+                    parts.pop()
+            else:
+                parts.append(part)
+        path = "/" + "/".join(parts)
+        for mount_point, vfs in self.mounts.items():
+            if path == mount_point or path.startswith(mount_point + "/"):
+                return vfs, os.path.join(vfs.host_dir, path[len(mount_point):].lstrip("/"))
+        return None, os.path.join(self.flash_dir, path.lstrip("/"))
+
+    def open(self, path, mode="r", *args, **kwargs):
+        vfs, host = self._resolve(path)
+        if vfs is not None:
+            vfs.dir_io(host)  # directory lookup
+        return DeviceFile(builtins.open(host, mode, *args, **kwargs), vfs)
+
+    def listdir(self, path=""):
+        vfs, host = self._resolve(path or self.cwd)
+        names = sorted(os.listdir(host))
+        if path in ("", "/") and self.cwd == "/":
+            names += [m.lstrip("/") for m in self.mounts if m.count("/") == 1]
+        if vfs is not None:
+            vfs.dir_io(os.path.join(host, "."))
+        return names
+
+    def ilistdir(self, path=""):
+        for name in self.listdir(path):
+            full = f"{path.rstrip('/')}/{name}" if path else name
+            mode = self.stat(full)[0]
+            yield (name, mode, 0, self.stat(full)[6])
+
+    def mkdir(self, path):
+        vfs, host = self._resolve(path)
+        os.mkdir(host)
+        if vfs is not None:
+            vfs.dir_io(host, write=True)
+            vfs.fat_io()
+            vfs.io(1, True)  # the new directory's first sector
+
+    def rmdir(self, path):
+        vfs, host = self._resolve(path)
+        os.rmdir(host)
+        if vfs is not None:
+            vfs.dir_io(host, write=True)
+            vfs.fat_io()
+
+    def remove(self, path):
+        vfs, host = self._resolve(path)
+        os.remove(host)
+        if vfs is not None:
+            vfs.dir_io(host, write=True)
+            vfs.fat_io()
+
+    def rename(self, old, new):
+        vfs, host_old = self._resolve(old)
+        _, host_new = self._resolve(new)
+        os.rename(host_old, host_new)
+        if vfs is not None:
+            vfs.dir_io(host_old, write=True)
+            vfs.dir_io(host_new, write=True)
+
+    def stat(self, path):
+        vfs, host = self._resolve(path)
+        st = os.stat(host)
+        if vfs is not None:
+            vfs.dir_io(host)
+        mode = 0x4000 if os.path.isdir(host) else 0x8000
+        mtime = int(st.st_mtime)
+        return (mode, 0, 0, 0, 0, 0, st.st_size, mtime, mtime, mtime)
+
+    def statvfs(self, path):
+        vfs, host = self._resolve(path)
+        if vfs is not None:
+            bsize = vfs.cluster_sectors * 512
+            sectors = vfs.dev.ioctl(4, 0)
+            used = sum(os.path.getsize(os.path.join(d, f)) for d, _, fs in os.walk(vfs.host_dir) for f in fs)
+            blocks = sectors * 512 // bsize
+            free = blocks - -(-used // bsize)
+            return (bsize, bsize, blocks, free, free, 0, 0, 0, 0, 255)
+        used = sum(os.path.getsize(os.path.join(d, f)) for d, _, fs in os.walk(self.flash_dir) for f in fs)
+        blocks = 352  # 1.4 MB littlefs partition in 4 KB blocks
+        free = max(0, blocks - -(-used // 4096))
+        return (4096, 4096, blocks, free, free, 0, 0, 0, 0, 255)
+
+    @staticmethod
+    def _cluster_bytes(sectors):
+        return 32768 if sectors >= 1 << 21 else 4096  # SDHC formatter default / small card
+
+    def getcwd(self):
+        return self.cwd
+
+    def chdir(self, path):
+        vfs, host = self._resolve(path)
+        if not os.path.isdir(host):
+            raise OSError(2, "ENOENT")
+        self.cwd = path if path.startswith("/") else self.cwd.rstrip("/") + "/" + path
+
+    def mount(self, vfs, mount_point):
+        mount_point = "/" + mount_point.strip("/")
+        if mount_point in self.mounts:
+            raise OSError(1, "EPERM")
+        vfs.dev.ioctl(1, 0)  # disk_initialize
+        vfs.dev.readblocks(0, vfs._block)  # boot sector
+        vfs.host_dir = self.sd_dir
+        vfs.cluster_sectors = self._cluster_bytes(vfs.dev.ioctl(4, 0)) // 512
+        self.mounts[mount_point] = vfs
+
+    def umount(self, mount_point):
+        mount_point = "/" + mount_point.strip("/")
+        vfs = self.mounts.pop(mount_point, None)
+        if vfs is None:
+            raise OSError(22, "EINVAL")
+        vfs.dev.ioctl(3, 0)
+
+    def sync(self):
+        pass
+
+    def uname(self):
+        return ("rp2", "rp2", "1.23.0", "v1.23.0 (simulated)", "Raspberry Pi Pico with RP2040")
+
+    def urandom(self, n):
+        return os.urandom(n)
+
+
+# =========================================================
+# --- Device module loader ---
+# =========================================================
+class DeviceRuntime:
+    """Imports and runs device code with the simulated modules"""
+
+    def __init__(self, fs, time_module, quiet=False):
+        import device_asyncio
+        import device_thread
+        import machine
+        import micropython
+
+        self.fs = fs
+        self.quiet = quiet
+        self.modules = {}
+        self.overrides = {
+            "machine": machine,
+            "_thread": device_thread,
+            "asyncio": device_asyncio,
+            "uasyncio": device_asyncio,
+            "micropython": micropython,
+            "time": time_module,
+            "utime": time_module,
+            "os": fs,
+            "uos": fs,
+            "gc": make_gc_module(),
+            "sys": DeviceSys(),
+            "json": json,
+            "ujson": json,
+        }
+        self.builtins = dict(vars(builtins))
+        self.builtins["__import__"] = self._import
+        self.builtins["open"] = fs.open
+        self.builtins["print"] = self._print
+        self.builtins["bytearray"] = DeviceBytearray
+
+    def _print(self, *args, **kwargs):
+        if not self.quiet:
+            builtins.print(f"[{core.clock.now_us() / 1000000:10.3f}]", *args, **kwargs)
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        module = self.overrides.get(name) or self.modules.get(name)
+        if module is not None:
+            return module
+        # modules the firmware wrote to flash first, like "" at the head of sys.path
+        for folder in [self.fs.flash_dir] + DEVICE_PATH:
+            path = os.path.join(folder, name + ".py")
+            if os.path.isfile(path):
+                return self.load(name, path)
+        return builtins.__import__(name, globals, locals, fromlist, level)
+
+    def load(self, name, path):
+        module = types.ModuleType(name)
+        module.__file__ = path
+        module.__dict__["__builtins__"] = self.builtins
+        self.modules[name] = module
+        with builtins.open(path) as f:
+            code = compile(f.read(), path, "exec")
+        exec(code, module.__dict__)
+        return module
+
+    def run(self, path):
+        """Run a device script as __main__, returns its globals"""
+        namespace = {"__name__": "__main__", "__file__": path, "__builtins__": self.builtins}
+        with builtins.open(path) as f:
+            code = compile(f.read(), path, "exec")
+        try:
+            exec(code, namespace)
+        except SimulationEnd:
+            pass
+        return namespace
+
+
+# =========================================================
+# --- Simulator ---
+# =========================================================
+class Simulator:
+    def __init__(self, config_path=DEFAULT_CONFIG, root=None, realtime=False, start=None,
+                 card_present=False, quiet=False, rtc_ppm=0, sd_max_baudrate=25000000):
+        core.reset(realtime=realtime)
+        with builtins.open(config_path) as f:
+            self.config = json.load(f)
+        self.root = root or tempfile.mkdtemp(prefix="gates-sim-")
+        self.flash_dir = os.path.join(self.root, "flash")
+        self.sd_dir = os.path.join(self.root, "sd")
+        os.makedirs(self.flash_dir, exist_ok=True)
+        os.makedirs(self.sd_dir, exist_ok=True)
+        with builtins.open(os.path.join(self.flash_dir, "config.json"), "w") as f:
+            json.dump(self.config, f, indent=4)
+
+        start = start or datetime.datetime.now()
+        self.fs = DeviceFS(self.flash_dir, self.sd_dir)
+        epoch_s = int((start - datetime.datetime(1970, 1, 1)).total_seconds())
+        self.runtime = DeviceRuntime(self.fs, make_time_module(epoch_s), quiet=quiet)
+
+        cfg = self.config
+        self.rtc = DS3231Model(start, sqw_pin=cfg.get("rtc_sqw_pin"), ppm=rtc_ppm)
+        core.i2c_devices[0] = {0x68: self.rtc}
+        self.card = SDCardModel(present=card_present, max_baudrate=sd_max_baudrate)
+        core.spi_devices[1] = [(cfg["spi"]["cs"], self.card)]
+
+        # beam modules plugged in and unbroken, card detect follows the card
+        self.beam_pins = {"A": cfg["beam_pins_A"], "B": cfg["beam_pins_B"]}
+        for pins in self.beam_pins.values():
+            for pin in pins.values():
+                core.drive(pin, 1)
+        core.drive(cfg["sd_detect_pin"], 1 if card_present else 0)
+        self.buttons = {
+            "A": cfg["test_button_pin_A"],
+            "B": cfg["test_button_pin_B"],
+            "download": cfg["download_button_pin"],
+        }
+
+        self.breaks = {"A": 0, "B": 0}
+        self.crossings = []  # (t_ms, set, pair, direction) injected
+        self.last_event_ms = 0
+        self.namespace = None
+
+    # --- scheduling world events ---------------------------------
+
+    def at(self, t_ms, fn, *args):
+        core.clock.call_at(int(t_ms * 1000), fn, *args)
+        self.last_event_ms = max(self.last_event_ms, t_ms)
+
+    def pulse(self, t_ms, pin, hold_ms, level=0):
+        self.at(t_ms, core.drive, pin, level)
+        self.at(t_ms + hold_ms, core.drive, pin, 1 - level)
+
+    def break_beam(self, t_ms, set_label, gate, hold_ms=20):
+        self.breaks[set_label] += 1
+        self.pulse(t_ms, self.beam_pins[set_label][gate], hold_ms)
+
+    def crossing(self, t_ms, set_label, pair, direction, gap_ms=100, hold_ms=20):
+        """Someone walking through a pair; t_ms is when the second beam breaks.
+
+        pair 0/1 = Left/Right Pair, direction 0/1 = Left/Right (as in eventlog)"""
+        side = ("Left", "Right")[pair]
+        first, second = ("Right", "Left") if direction == 0 else ("Left", "Right")
+        self.break_beam(t_ms - gap_ms, set_label, f"{side}_{first}", hold_ms)
+        self.break_beam(t_ms, set_label, f"{side}_{second}", hold_ms)
+        self.crossings.append((t_ms, set_label, pair, direction))
+
+    def press(self, t_ms, button, hold_ms=100):
+        self.pulse(t_ms, self.buttons[button], hold_ms)
+
+    def card_in(self, t_ms):
+        self.at(t_ms, self.card.insert)
+        self.at(t_ms, core.drive, self.config["sd_detect_pin"], 1)
+
+    def card_out(self, t_ms):
+        self.at(t_ms, self.card.remove)
+        self.at(t_ms, core.drive, self.config["sd_detect_pin"], 0)
+
+    def load_trace(self, path):
+        with builtins.open(path) as f:
+            for number, line in enumerate(f, 1):
+                line = line.split("#", 1)[0].strip()
+                if not line:
+                    continue
+                fields = [x.strip() for x in line.split(",")]
+                try:
+                    self._trace_event(float(fields[0]), fields[1], [float(x) for x in fields[2:]])
+                except (IndexError, KeyError, ValueError) as e:
+                    raise ValueError(f"{path}:{number}: bad trace line {line!r} ({e})")
+
+    def _trace_event(self, t_ms, target, extra):
+        kind, _, arg = target.partition(":")
+        if kind in ("A", "B"):
+            self.break_beam(t_ms, kind, arg, *extra[:1])
+        elif kind == "cross":
+            set_label, pair, direction = arg.split(":")
+            self.crossing(t_ms, set_label, ("Left", "Right").index(pair), ("Left", "Right").index(direction), *extra[:1])
+        elif kind == "button":
+            self.press(t_ms, arg, *extra[:1])
+        elif kind == "card":
+            if arg == "in":
+                self.card_in(t_ms)
+            elif arg == "out":
+                self.card_out(t_ms)
+            else:
+                raise ValueError("card:in or card:out")
+        elif kind == "pin":
+            pin, _, level = arg.partition("=")
+            if level:
+                self.at(t_ms, core.drive, int(pin), int(level))
+            else:
+                self.pulse(t_ms, int(pin), *(extra[:1] or [20]))
+        else:
+            raise KeyError(kind)
+
+    def load_log(self, path, lead_ms=1000, gap_ms=100):
+        """Replay a recorded binary event log: start the test, re-create every
+        crossing at its recorded spacing, stop the test"""
+        sys.path.insert(0, FIRMWARE_DIR)
+        import eventlog
+
+        with builtins.open(path, "rb") as f:
+            log = eventlog.LogReader(f)
+            events = list(log)
+        set_label = log.set_label
+        self.press(lead_ms / 2, set_label)
+        if events:
+            first_s, first_us = events[0][0], events[0][1]
+            for seconds, us, pair, direction, _, _ in events:
+                offset_ms = ((seconds - first_s) * 1000000 + us - first_us) / 1000
+                self.crossing(lead_ms + gap_ms + offset_ms, set_label, pair, direction, gap_ms)
+        self.press(self.last_event_ms + lead_ms, set_label)
+        return len(events)
+
+    # --- running ------------------------------------------------
+
+    def import_device(self, name):
+        """Import a device module (e.g. "bench") to call into it directly"""
+        return self.runtime._import(name)
+
+    def run(self, script=DEFAULT_SCRIPT, duration_ms=None):
+        if duration_ms is None:
+            duration_ms = self.last_event_ms + 2000
+        core.clock.end_us = int(duration_ms * 1000)
+        started = _host_time.perf_counter()
+        self.namespace = self.runtime.run(script)
+        self.wall_s = _host_time.perf_counter() - started
+        self._finish()
+        return self.namespace
+
+    def _finish(self):
+        # close logs a running test still holds open, like pressing stop
+        core.clock.end_us = None
+        ns = self.namespace
+        try:
+            for set_label in ("A", "B"):
+                if ns.get(f"test_running_{set_label}") and "stop_test" in ns:
+                    ns["stop_test"](set_label)
+        except SimulationEnd:
+            pass
+
+    def logged_events(self):
+        """Events found in the produced logs: {path: rows}"""
+        import eventlog
+
+        found = {}
+        for base in (self.flash_dir, self.sd_dir):
+            for folder, _, files in os.walk(base):
+                for name in sorted(files):
+                    path = os.path.join(folder, name)
+                    if name.endswith(".bin"):
+                        with builtins.open(path, "rb") as f:
+                            try:
+                                found[path] = sum(1 for _ in eventlog.LogReader(f))
+                            except ValueError:
+                                pass
+                    elif name.endswith(".csv") and name != "sync_manifest.csv":
+                        with builtins.open(path) as f:
+                            found[path] = max(0, sum(1 for _ in f) - 2)
+        return found
+
+    def summary(self):
+        if FIRMWARE_DIR not in sys.path:
+            sys.path.insert(0, FIRMWARE_DIR)
+        lines = [
+            f"simulated {core.clock.now_us() / 1000000:.3f} s in {self.wall_s:.2f} s wall clock",
+            f"sandbox: {self.root}",
+            f"IRQs: {core.irq_count}, beam breaks injected: A {self.breaks['A']}, B {self.breaks['B']}, crossings: {len(self.crossings)}",
+            f"RTC: {self.rtc.reads} register reads, {self.rtc.writes} writes",
+            f"SD card: {self.card.stats}",
+        ]
+        for path, rows in self.logged_events().items():
+            lines.append(f"  {os.path.relpath(path, self.root)}: {rows} events")
+        return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the gate firmware against simulated hardware")
+    parser.add_argument("--trace", help="trace file of beam breaks, button presses and card events")
+    parser.add_argument("--from-log", help="replay the crossings of a recorded .bin event log")
+    parser.add_argument("--duration", type=float, help="seconds to simulate (default: trace length + 2 s)")
+    parser.add_argument("--config", default=DEFAULT_CONFIG, help="JSON config (default: 405/backup config.py)")
+    parser.add_argument("--script", default=DEFAULT_SCRIPT, help="device script to run (default: 405/Gates.py)")
+    parser.add_argument("--root", help="sandbox folder (default: new temp folder)")
+    parser.add_argument("--card", action="store_true", help="SD card inserted at power-up")
+    parser.add_argument("--sd-max-baudrate", type=int, default=25000000,
+                        help="fastest SPI clock the simulated card wiring carries (default: 25 MHz)")
+    parser.add_argument("--realtime", action="store_true", help="follow the host clock instead of virtual time")
+    parser.add_argument("--quiet", action="store_true", help="don't show device output")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary sandbox")
+    args = parser.parse_args(argv)
+
+    sim = Simulator(args.config, root=args.root, realtime=args.realtime, card_present=args.card, quiet=args.quiet,
+                    sd_max_baudrate=args.sd_max_baudrate)
+    if args.trace:
+        sim.load_trace(args.trace)
+    if args.from_log:
+        sim.load_log(args.from_log)
+    sim.run(args.script, args.duration * 1000 if args.duration else None)
+    print(sim.summary())
+    if not args.root and not args.keep:
+        shutil.rmtree(sim.root)
+
+
+if __name__ == "__main__":
+    main()
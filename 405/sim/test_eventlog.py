@@ -0,0 +1,52 @@
+"""
+Checks of eventlog.py on the simulated device.
+
+    python -m pytest 405/sim
+"""
+
+import builtins
+import os
+import shutil
+
+from simulate import Simulator
+
+
+def write_and_read(events, records=40):
+    sim = Simulator(quiet=True)
+    try:
+        eventlog = sim.import_device("eventlog")
+        log = eventlog.EventLog("test.bin", "A", events[0][0], records=records)
+        for seconds, us in events:
+            log.write_event(seconds, us, 1, 0, 2)
+        log.close()
+        with builtins.open(os.path.join(sim.flash_dir, "test.bin"), "rb") as f:
+            reader = eventlog.LogReader(f)
+            found = [(seconds, us) for seconds, us, pair, direction, gate, _ in reader]
+        return found, reader.bad_blocks, log.flushes
+    finally:
+        shutil.rmtree(sim.root)
+
+
+def test_round_trip():
+    events = [(1000, 0), (1000, 999999), (1001, 5), (1040, 123456)]
+    found, bad, flushes = write_and_read(events)
+    assert found == events
+    assert bad == 0
+    assert flushes == 1
+
+
+def test_backwards_stamp_starts_a_new_block():
+    # clock stepped back by a resync, then a capture drained out of order
+    events = [(1000, 500000), (1000, 900000), (999, 999000), (1000, 400000), (1000, 950000)]
+    found, bad, flushes = write_and_read(events)
+    assert found == events
+    assert bad == 0
+    assert flushes == 2
+
+
+def test_gap_past_u32_offset_starts_a_new_block():
+    events = [(1000, 0), (1000 + 4294, 967295), (1000 + 4294, 967296), (9000, 1)]
+    found, bad, flushes = write_and_read(events)
+    assert found == events
+    assert bad == 0
+    assert flushes == 2
@@ -0,0 +1,94 @@
+"""
+Preallocated queue of classified crossings between the two RP2040 cores.
+
+In the dual-core runtime core 0 captures and classifies beam breaks, core 1
+logs them.  Core 0 is the only producer and core 1 the only consumer; each
+record is a set id, the timestamp (seconds, us) and the eventlog flags byte
+(pair, direction, gate).  The arrays are allocated once and a lock guards
+the few lines that touch them, so a record is never seen half written.
+The lock is only held for those few lines, so neither core waits on the
+other's file or SD work.  push() returns False when the queue is full, the
+record is dropped and counted in `overflows`.
+
+Example usage:
+
+    queue = SpscQueue(64)
+    queue.push(set_id, seconds, us, flags)     # core 0
+    while queue.pop():                         # core 1
+        print(queue.set_id, queue.seconds, queue.us, queue.flags)
+"""
+
+from array import array
+
+try:
+    from _thread import allocate_lock
+except ImportError:
+    allocate_lock = None
+
+
+class _NoLock:
+    # single-threaded ports
+    def acquire(self, *args):
+        return True
+
+    def release(self):
+        pass
+
+
+class SpscQueue:
+    def __init__(self, size=64):
+        self.size = size
+        self._sets = array("B", bytes(size))
+        self._seconds = array("L", [0] * size)
+        self._us = array("L", [0] * size)
+        self._flags = array("B", bytes(size))
+        self._lock = allocate_lock() if allocate_lock else _NoLock()
+        self.head = 0
+        self.tail = 0
+        self.overflows = 0
+
+        # last popped record, read by the consumer after pop()
+        self.set_id = 0
+        self.seconds = 0
+        self.us = 0
+        self.flags = 0
+
+    def push(self, set_id, seconds, us, flags):
+        lock = self._lock
+        lock.acquire()
+        head = self.head
+        nxt = head + 1
+        if nxt == self.size:
+            nxt = 0
+        if nxt == self.tail:
+            self.overflows += 1
+            lock.release()
+            return False
+        self._sets[head] = set_id
+        self._seconds[head] = seconds
+        self._us[head] = us
+        self._flags[head] = flags
+        self.head = nxt
+        lock.release()
+        return True
+
+    def pop(self):
+        lock = self._lock
+        lock.acquire()
+        tail = self.tail
+        if tail == self.head:
+            lock.release()
+            return False
+        self.set_id = self._sets[tail]
+        self.seconds = self._seconds[tail]
+        self.us = self._us[tail]
+        self.flags = self._flags[tail]
+        tail += 1
+        if tail == self.size:
+            tail = 0
+        self.tail = tail
+        lock.release()
+        return True
+
+    def __len__(self):
+        return (self.head - self.tail) % self.size
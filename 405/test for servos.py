@@ -4,6 +4,8 @@ import ujson
 
 # -------------------------------
 # Load configuration from JSON
+# (read directly: config_cache checks the keys Gates.py needs, which a
+# servo-only config.json doesn't have)
 # -------------------------------
 CONFIG_FILE = "config.json"
 default_delay = 5
@@ -12,7 +14,8 @@ try:
     with open(CONFIG_FILE, "r") as f:
         config = ujson.load(f)
         delay_time = config.get("delay_time", default_delay)
-except:
+except Exception as e:
+    print("Config not loaded, using the default delay:", e)
     delay_time = default_delay
 
 # -------------------------------
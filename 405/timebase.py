@@ -0,0 +1,247 @@
+"""
+High resolution wall clock anchored to the DS3231.
+
+The RTC is read once to get the wall clock second and the matching
+time.ticks_us() value is stored as the anchor.  After that a timestamp for any
+ticks_us() value is integer math only, so the beam IRQs and the log writers
+never touch the I2C bus.  poll() (called from the main loop) keeps the anchor
+lined up with the RTC second boundary:
+
+  * until the first boundary is seen it reads the seconds register once per
+    call (coarse, error <= main loop period),
+  * ticks_diff() of ticks_us() values only reaches ~8.9 minutes, so after
+    a longer gap between poll() calls (_STALE_MS) the anchor is taken from
+    the RTC again and aligned from scratch,
+  * after that it re-syncs every sync_ms by reading the seconds register once
+    per call from just before the expected boundary until it changes.  The
+    boundary then lies between the last two reads; the anchor is only moved
+    as far as needed to put it inside that bracket, so the error stays
+    within the interval between poll() calls.  Nothing spins, so the beams
+    keep being polled in the single-core runtime.  For microsecond alignment
+    wire the SQW pin (see below).
+
+If the source is a ds3231.SQWClock the edge times captured by its 1 Hz IRQ
+are used instead, which needs no I2C traffic at all: poll() re-anchors on
+every new edge.  If no edge arrives for _EDGE_TIMEOUT_US (SQW not wired,
+pull-up missing) it falls back to reading the DS3231 behind the SQWClock.
+
+Timestamps are (seconds since 2000-01-01, microseconds) tuples.
+
+Example usage:
+
+    clock = TimeBase(rtc)
+    ticks = time.ticks_us()        # e.g. taken inside an IRQ
+    clock.poll()                   # from the main loop
+    print(format_time(*clock.stamp(ticks)))   # 12:34:56.789
+"""
+
+import time
+
+_SYNC_WINDOW_US = 30000  # start reading this long before the expected boundary
+_ADVANCE_US = 60000000  # move the anchor forward so ticks_diff() stays in range
+_STALE_MS = 400000  # poll() gap after which ticks_us differences can't be trusted
+_MAX_SYNC_MS = 480000  # ticks_diff() to the next sync must stay below 2^29 us
+_EDGE_TIMEOUT_US = 3000000  # SQW edges missing this long, stop waiting for them
+
+
+def days_from_civil(year, month, day):
+    """Days since 2000-01-01"""
+    if month <= 2:
+        year -= 1
+        month += 12
+    return 365 * year + year // 4 - year // 100 + year // 400 + (153 * (month - 3) + 2) // 5 + day - 730426
+
+
+def civil_from_days(days):
+    """(year, month, day) for a day count since 2000-01-01"""
+    days += 730425  # shift the epoch to 0000-03-01
+    era = days // 146097
+    doe = days - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    day = doy - (153 * mp + 2) // 5 + 1
+    month = mp + 3 if mp < 10 else mp - 9
+    year = yoe + era * 400 + (1 if month <= 2 else 0)
+    return year, month, day
+
+
+def to_seconds(dt):
+    """Seconds since 2000-01-01 for an rtc.datetime() tuple"""
+    return days_from_civil(dt[0], dt[1], dt[2]) * 86400 + dt[4] * 3600 + dt[5] * 60 + dt[6]
+
+
+def to_datetime(seconds):
+    """rtc.datetime() style tuple for seconds since 2000-01-01"""
+    days, rem = divmod(seconds, 86400)
+    year, month, day = civil_from_days(days)
+    weekday = (days + 5) % 7 + 1  # 2000-01-01 was a Saturday, Monday = 1
+    return (year, month, day, weekday, rem // 3600, rem // 60 % 60, rem % 60, 0)
+
+
+def format_time(seconds, us, digits=3):
+    """HH:MM:SS.mmm (digits=3) or HH:MM:SS.uuuuuu (digits=6)"""
+    rem = seconds % 86400
+    if digits == 6:
+        return f"{rem // 3600:02d}:{rem // 60 % 60:02d}:{rem % 60:02d}.{us:06d}"
+    return f"{rem // 3600:02d}:{rem // 60 % 60:02d}:{rem % 60:02d}.{us // 1000:03d}"
+
+
+def format_datetime(seconds, us, digits=3):
+    """YYYY-MM-DD HH:MM:SS.mmm"""
+    year, month, day = civil_from_days(seconds // 86400)
+    return f"{year:04d}-{month:02d}-{day:02d} {format_time(seconds, us, digits)}"
+
+
+class TimeBase:
+    def __init__(self, rtc, sync_ms=60000):
+        self.rtc = rtc
+        self.sync_ms = min(sync_ms, _MAX_SYNC_MS)
+        self._anchor = (0, 0)  # (seconds, ticks_us), replaced as a whole so stamp() never sees half an update
+        self.aligned = False
+        self.syncs = 0
+        self.last_error_us = 0  # correction applied by the last precise sync
+        self._last_second = -1
+        self._next_sync = 0
+        self._sync_second = -1  # seconds register at the start of a sync, -1 outside one
+        self._sync_start = 0
+        self._sync_before = 0  # ticks_us of the last read that still saw _sync_second
+        self._edge_source = hasattr(rtc, "anchor")  # ds3231.SQWClock
+        self._edges = 0  # SQWClock edge count at the last re-anchor
+        self._poll_ms = time.ticks_ms()  # ticks_ms of the last poll(), wraps after days not minutes
+        self.anchor()
+        self._edge_wait = self._anchor[1]  # ticks_us since when an edge is awaited
+
+    def anchor(self, dt=None, ticks=None):
+        """Anchor to the RTC without waiting for a second boundary"""
+        if dt is None:
+            dt = self.rtc.datetime()
+            ticks = time.ticks_us()
+        self._anchor = (to_seconds(dt), ticks)
+        self.aligned = False
+        self._last_second = dt[6]
+
+    def idle_ms(self, fine_ms=20):
+        """How long the caller can leave poll() alone: fine_ms while looking
+        for the first boundary or inside a sync window, else until the next
+        sync window opens"""
+        if not self.aligned or self._sync_second >= 0:
+            return fine_ms
+        now = time.ticks_us()
+        wait_us = time.ticks_diff(self._next_sync, now)
+        if wait_us <= 0 and not self._edge_source:
+            wait_us = 1000000 - _SYNC_WINDOW_US - self.stamp(now)[1]
+        if wait_us <= 0:
+            return fine_ms
+        return min(wait_us, _ADVANCE_US) // 1000
+
+    def stamp(self, ticks):
+        anchor_s, anchor_ticks = self._anchor
+        elapsed = time.ticks_diff(ticks, anchor_ticks)
+        return anchor_s + elapsed // 1000000, elapsed % 1000000
+
+    def now(self):
+        return self.stamp(time.ticks_us())
+
+    def datetime(self):
+        return to_datetime(self.stamp(time.ticks_us())[0])
+
+    def poll(self):
+        now = time.ticks_us()
+        now_ms = time.ticks_ms()
+        if time.ticks_diff(now_ms, self._poll_ms) >= _STALE_MS:
+            # left alone long enough for ticks_us differences to the anchor
+            # and the next sync to have wrapped: start again from the RTC
+            self._sync_second = -1
+            self._edge_wait = now
+            self.anchor()
+        self._poll_ms = now_ms
+        if self._edge_source:
+            self._poll_edges(now)
+            return
+        if not self.aligned:
+            second = self.rtc.second()
+            if second != self._last_second:
+                # first boundary seen since anchoring, good to one loop period
+                self._set_anchor(now, self.rtc.datetime())
+                self._next_sync = time.ticks_add(now, self.sync_ms * 1000)
+                self.aligned = True
+            return
+        if self._sync_second >= 0 or (time.ticks_diff(now, self._next_sync) >= 0 and
+                                      self.stamp(now)[1] >= 1000000 - _SYNC_WINDOW_US):
+            self._sync(now)
+            return
+        anchor_s, anchor_ticks = self._anchor
+        elapsed = time.ticks_diff(now, anchor_ticks)
+        if elapsed >= _ADVANCE_US:
+            secs = elapsed // 1000000
+            self._anchor = (anchor_s + secs, time.ticks_add(anchor_ticks, secs * 1000000))
+
+    def _poll_edges(self, now):
+        rtc = self.rtc
+        edges = rtc.edges
+        if edges == self._edges:
+            if time.ticks_diff(now, self._edge_wait) >= _EDGE_TIMEOUT_US:
+                # no SQW edges: time from the DS3231 registers from now on
+                self.rtc = rtc.rtc
+                self._edge_source = False
+                self.anchor()
+            return
+        sync = not self.aligned or time.ticks_diff(now, self._next_sync) >= 0
+        if sync:
+            rtc.datetime()  # lets the SQWClock resync against the registers when due
+        dt, edge = rtc.anchor()
+        self._edges = edges
+        self._edge_wait = now
+        if sync:
+            expected_s, expected_us = self.stamp(edge)
+        self._set_anchor(edge, dt)  # every edge, so ticks_diff() from the anchor never wraps
+        if sync:
+            if self.aligned:
+                self.last_error_us = (expected_s - self._anchor[0]) * 1000000 + expected_us
+                self.syncs += 1
+            self.aligned = True
+            self._next_sync = time.ticks_add(now, self.sync_ms * 1000)
+
+    def _sync(self, now):
+        # one step of a precise sync, one register read per poll()
+        second = self.rtc.second()
+        if self._sync_second < 0:
+            self._sync_second = second
+            self._sync_start = now
+            self._sync_before = now
+            return
+        if second == self._sync_second:
+            self._sync_before = now
+            if time.ticks_diff(now, self._sync_start) > 3 * _SYNC_WINDOW_US:
+                # boundary not where we expected it, fall back to coarse alignment
+                self._sync_second = -1
+                self.aligned = False
+                self._last_second = second
+            return
+        self._sync_second = -1
+        before = self._sync_before
+        if time.ticks_diff(now, before) > 3 * _SYNC_WINDOW_US:
+            # polled too rarely to bracket the boundary, align coarsely again
+            self.aligned = False
+            self._last_second = second
+            return
+        # boundary the anchor predicts, nearest to now, moved into (before, now]
+        expected_us = self.stamp(now)[1]
+        if expected_us < 500000:
+            edge = time.ticks_add(now, -expected_us)
+        else:
+            edge = time.ticks_add(now, 1000000 - expected_us)
+        if time.ticks_diff(edge, before) <= 0:
+            edge = time.ticks_add(before, 1)
+        elif time.ticks_diff(edge, now) > 0:
+            edge = now
+        expected_s, expected_us = self.stamp(edge)
+        self._set_anchor(edge, self.rtc.datetime())
+        self.last_error_us = (expected_s - self._anchor[0]) * 1000000 + expected_us
+        self.syncs += 1
+        self._next_sync = time.ticks_add(edge, self.sync_ms * 1000)
+
+    def _set_anchor(self, ticks, dt):
+        self._anchor = (to_seconds(dt), ticks)
+        self._last_second = dt[6]
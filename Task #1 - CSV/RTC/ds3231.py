@@ -29,6 +29,7 @@
 # THE SOFTWARE.
 
 from micropython import const
+import time
 
 DATETIME_REG    = const(0) # 7 bytes
 SECONDS_REG     = const(0)
@@ -62,6 +63,20 @@ def bcdtodec(bcd):
 	"""Convert binary coded decimal to decimal"""
 	return ((bcd >> 4) * 10) + (bcd & 0x0F)
 
+# BCD -> decimal lookup table, indexed by the raw register byte
+_BCD = bytes([bcdtodec(i) for i in range(256)])
+
+def decode_datetime(buf):
+	"""Datetime tuple from the time registers (0x00 - 0x06) at the start of buf"""
+	b = _BCD
+	if buf[2] & 0x40: # 12 hour mode
+		hour = b[buf[2] & 0x1f]
+		if buf[2] & 0x20: # PM
+			hour += 12
+	else:
+		hour = b[buf[2] & 0x3f]
+	return (b[buf[6]] + 2000, b[buf[5] & 0x7f], b[buf[4]], b[buf[3]], hour, b[buf[1]], b[buf[0]], 0)
+
 class DS3231:
 	""" DS3231 RTC driver.
 
@@ -86,15 +101,17 @@ class DS3231:
 	def __init__(self, i2c, addr=0x68):
 		self.i2c = i2c
 		self.addr = addr
-		self._timebuf = bytearray(7) # Pre-allocate a buffer for the time data
 		self._buf = bytearray(1) # Pre-allocate a single bytearray for re-use
 		self._al1_buf = bytearray(4)
 		self._al2buf = bytearray(3)
+		self._timestatus = bytearray(STATUS_REG + 1) # Pre-allocate a buffer for time + alarms + control + status
+		self._timebuf = memoryview(self._timestatus)[:7] # The time registers, for setting the clock
 	
 	def second(self, second=None):
 		"""Get or set seconds"""
 		if second is None:
-			return bcdtodec(self.i2c.readfrom_mem(self.addr, SECONDS_REG, 1)[0])
+			self.i2c.readfrom_mem_into(self.addr, SECONDS_REG, self._buf)
+			return _BCD[self._buf[0]]
 		if second < 0: second = TOTAL_SECONDS
 		elif second >= TOTAL_SECONDS: second = 0
 		self.i2c.writeto_mem(self.addr, SECONDS_REG, bytearray([dectobcd(second)]))
@@ -103,7 +120,8 @@ class DS3231:
 	def minute(self, minute=None):
 		"""Get or set minutes"""
 		if minute is None:
-			return bcdtodec(self.i2c.readfrom_mem(self.addr, MINUTES_REG, 1)[0])
+			self.i2c.readfrom_mem_into(self.addr, MINUTES_REG, self._buf)
+			return _BCD[self._buf[0]]
 		if minute < 0: minute = TOTAL_MINUTES
 		elif minute >= TOTAL_MINUTES: minute = 0
 		self.i2c.writeto_mem(self.addr, MINUTES_REG, bytearray([dectobcd(minute)]))
@@ -112,7 +130,8 @@ class DS3231:
 	def hour(self, hour=None):
 		"""Get or set hours"""
 		if hour is None:
-			return bcdtodec(self.i2c.readfrom_mem(self.addr, HOURS_REG, 1)[0])
+			self.i2c.readfrom_mem_into(self.addr, HOURS_REG, self._buf)
+			return _BCD[self._buf[0]]
 		if hour < 0: hour = TOTAL_HOURS
 		elif hour >= TOTAL_HOURS: hour = 0
 		self.i2c.writeto_mem(self.addr, HOURS_REG, bytearray([dectobcd(hour)]))
@@ -121,7 +140,8 @@ class DS3231:
 	def weekday(self, weekday=None):
 		"""Get or set weekday"""
 		if weekday is None:
-			return bcdtodec(self.i2c.readfrom_mem(self.addr, WEEKDAY_REG, 1)[0])
+			self.i2c.readfrom_mem_into(self.addr, WEEKDAY_REG, self._buf)
+			return _BCD[self._buf[0]]
 		if weekday < 1: weekday = TOTAL_WEEKDAYS
 		elif weekday > TOTAL_WEEKDAYS: weekday = 1
 		self.i2c.writeto_mem(self.addr, WEEKDAY_REG, bytearray([dectobcd(weekday)]))
@@ -130,7 +150,8 @@ class DS3231:
 	def day(self, day=None):
 		"""Get or set day"""
 		if day is None:
-			return bcdtodec(self.i2c.readfrom_mem(self.addr, DAY_REG, 1)[0])
+			self.i2c.readfrom_mem_into(self.addr, DAY_REG, self._buf)
+			return _BCD[self._buf[0]]
 		if day < 1: day = TOTAL_DAYS
 		elif day > TOTAL_DAYS: day = 1
 		self.i2c.writeto_mem(self.addr, DAY_REG, bytearray([dectobcd(day)]))
@@ -139,7 +160,8 @@ class DS3231:
 	def month(self, month=None):
 		"""Get or set month"""
 		if month is None:
-			return bcdtodec(self.i2c.readfrom_mem(self.addr, MONTH_REG, 1)[0] & 0x7f)
+			self.i2c.readfrom_mem_into(self.addr, MONTH_REG, self._buf)
+			return _BCD[self._buf[0] & 0x7f]
 		if month < 1: month = TOTAL_MONTHS
 		elif month > TOTAL_MONTHS: month = 1
 		self.i2c.writeto_mem(self.addr, MONTH_REG, bytearray([dectobcd(month)]))
@@ -148,7 +170,8 @@ class DS3231:
 	def year(self, year=None):
 		"""Get or set year"""
 		if year is None:
-			return bcdtodec(self.i2c.readfrom_mem(self.addr, YEAR_REG, 1)[0]) + 2000
+			self.i2c.readfrom_mem_into(self.addr, YEAR_REG, self._buf)
+			return _BCD[self._buf[0]] + 2000
 		if year < 2000: year = 2099
 		elif year > 2099: year = 2000
 		self.i2c.writeto_mem(self.addr, YEAR_REG, bytearray([dectobcd(year - 2000)]))
@@ -160,7 +183,7 @@ class DS3231:
 		Always sets or returns in 24h format, converts to 24h if clock is set to 12h format
 		datetime : tuple, (0-year, 1-month, 2-day, 3-hour, 4-minutes[, 5-seconds[, 6-weekday]])"""
 		if datetime is None:
-			self.i2c.readfrom_mem_into(self.addr, DATETIME_REG, self._timebuf)
+			# One burst read of 0x00 - 0x0F: the time registers plus the status register for OSF
 			# 0x00 - Seconds    BCD
 			# 0x01 - Minutes    BCD
 			# 0x02 - Hour       0 12/24 AM/PM/20s BCD
@@ -168,27 +191,12 @@ class DS3231:
 			# 0x04 - Day 1-31   00 BCD
 			# 0x05 - Month 1-12 Century 00 BCD
 			# 0x06 - Year 0-99  BCD (2000-2099)
-			seconds = bcdtodec(self._timebuf[0])
-			minutes = bcdtodec(self._timebuf[1])
-
-			if (self._timebuf[2] & 0x40) >> 6: # Check for 12 hour mode bit
-				hour = bcdtodec(self._timebuf[2] & 0x9f) # Mask out bit 6(12/24) and 5(AM/PM)
-				if (self._timebuf[2] & 0x20) >> 5: # bit 5(AM/PM)
-					# PM
-					hour += 12
-			else:
-				# 24h mode
-				hour = bcdtodec(self._timebuf[2] & 0xbf) # Mask bit 6 (12/24 format)
+			self.i2c.readfrom_mem_into(self.addr, DATETIME_REG, self._timestatus)
 
-			weekday = bcdtodec(self._timebuf[3]) # Can be set arbitrarily by user (1,7)
-			day = bcdtodec(self._timebuf[4])
-			month = bcdtodec(self._timebuf[5] & 0x7f) # Mask out the century bit
-			year = bcdtodec(self._timebuf[6]) + 2000
-
-			if self.OSF():
+			if self._timestatus[STATUS_REG] & 0x80:
 				print("WARNING: Oscillator stop flag set. Time may not be accurate.")
 
-			return (year, month, day, weekday, hour, minutes, seconds, 0) # Conforms to the ESP8266 RTC (v1.13)
+			return decode_datetime(self._timestatus) # Conforms to the ESP8266 RTC (v1.13)
 
 		# Set the clock
 		try:
@@ -223,7 +231,7 @@ class DS3231:
 		if freq is None:
 			return self.i2c.readfrom_mem(self.addr, CONTROL_REG, 1)[0]
 
-		if not freq:
+		if freq is False:
 			# Set INTCN (bit 2) to 1 and both ALIE (bits 1 & 0) to 0
 			self.i2c.readfrom_mem_into(self.addr, CONTROL_REG, self._buf)
 			self.i2c.writeto_mem(self.addr, CONTROL_REG, bytearray([(self._buf[0] & 0xf8) | 0x04]))
@@ -365,3 +373,88 @@ class DS3231:
 	def _is_busy(self):
 		"""Returns True when device is busy doing TCXO management"""
 		return bool(self.i2c.readfrom_mem(self.addr, STATUS_REG, 1)[0] & (1 << 2))
+
+_DAYS_IN_MONTH = b"\x1f\x1c\x1f\x1e\x1f\x1e\x1f\x1f\x1e\x1f\x1e\x1f"
+
+class SQWClock:
+	""" Cached datetime driven by the DS3231 1 Hz square wave.
+
+	The SQW/INT output (open drain, needs a pull-up) triggers an IRQ on every falling
+	edge, which is when the DS3231 increments its seconds register. The IRQ advances a
+	cached datetime, so datetime() costs no I2C traffic. Every resync_min minutes the
+	registers are read again (just after an edge) to check the cache for drift.
+
+	Drop-in for DS3231.datetime() reads:
+		clock = SQWClock(rtc, Pin(26, Pin.IN, Pin.PULL_UP))
+		clock.datetime()"""
+
+	def __init__(self, rtc, pin, resync_min=10):
+		self.rtc = rtc
+		self.pin = pin
+		self.resync_s = resync_min * 60
+		self._dt = list(rtc.datetime())
+		self.edges = 0 # number of SQW edges seen
+		self.edge_ticks = None # ticks_us of the last edge, None until the first one
+		self.resyncs = 0
+		self.corrections = 0 # resyncs where the cache had drifted
+		self.last_drift = 0 # RTC minus cache in seconds at the last correction
+		self._resync_edge = 0
+		rtc.square_wave(DS3231.FREQ_1)
+		pin.irq(trigger=pin.IRQ_FALLING, handler=self._tick)
+
+	def _tick(self, pin):
+		# IRQ: advance the cached time by one second, no allocation
+		self.edge_ticks = time.ticks_us()
+		dt = self._dt
+		dt[6] += 1
+		if dt[6] == TOTAL_SECONDS:
+			dt[6] = 0
+			dt[5] += 1
+			if dt[5] == TOTAL_MINUTES:
+				dt[5] = 0
+				dt[4] += 1
+				if dt[4] == TOTAL_HOURS:
+					dt[4] = 0
+					dt[3] = dt[3] % TOTAL_WEEKDAYS + 1
+					dt[2] += 1
+					if dt[2] > self._days_in_month(dt[0], dt[1]):
+						dt[2] = 1
+						dt[1] += 1
+						if dt[1] > TOTAL_MONTHS:
+							dt[1] = 1
+							dt[0] += 1
+		self.edges += 1
+
+	@staticmethod
+	def _days_in_month(year, month):
+		if month == 2 and year % 4 == 0:
+			return 29 # 2000-2099: every 4th year is a leap year
+		return _DAYS_IN_MONTH[month - 1]
+
+	def anchor(self):
+		"""Returns (datetime, ticks_us of the edge that started that second),
+		ticks is None until the first edge was seen"""
+		while True:
+			edges = self.edges
+			dt = tuple(self._dt)
+			ticks = self.edge_ticks
+			if edges == self.edges: # no edge while copying
+				return dt, ticks
+
+	def datetime(self):
+		"""Cached datetime, same tuple format as DS3231.datetime()"""
+		if self.edges > self._resync_edge and self.edges - self._resync_edge >= self.resync_s and time.ticks_diff(time.ticks_us(), self.edge_ticks) < 500000:
+			self.resync()
+		return self.anchor()[0]
+
+	def resync(self):
+		"""Read the registers and correct the cache if it drifted"""
+		rtc_dt = self.rtc.datetime()
+		cached = self.anchor()[0]
+		self.resyncs += 1
+		self._resync_edge = self.edges
+		if rtc_dt[:7] != cached[:7]:
+			self.corrections += 1
+			self.last_drift = (rtc_dt[4] * 3600 + rtc_dt[5] * 60 + rtc_dt[6]) - (cached[4] * 3600 + cached[5] * 60 + cached[6])
+			self._dt[:] = rtc_dt
+		return rtc_dt
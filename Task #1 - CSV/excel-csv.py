@@ -3,6 +3,9 @@ from machine import Pin
 import utime
 import os
 import ds3231  #For Real Time Clock (RTC)
+from csv_writer import CSVWriter  #Keeps the CSV open and writes rows in batches
+import timebase  #Millisecond timestamps from the RTC without reading it every press
+from buttons import Buttons  #Button presses from IRQs, debounced by a timer
 
 #Setup LED's
 ledred = Pin(0, Pin.OUT) #Red
@@ -13,6 +16,7 @@ ledgreen.off()
 #Buttons used to simulate light gate triggers on either side
 left = machine.Pin(15, machine.Pin.IN, machine.Pin.PULL_UP)  #GPIO 15
 right = machine.Pin(14, machine.Pin.IN, machine.Pin.PULL_UP)  #GPIO 14
+buttons = Buttons({"left": left, "right": right}, debounce_ms=50)  #Queues each press, nothing waits for a release
 
 #Initialize I2C on Pico (GP16 = SDA and GP17 = SCL)to read RTC
 i2c = machine.I2C(0, scl=machine.Pin(17), sda=machine.Pin(16), freq=400000)
@@ -20,10 +24,12 @@ i2c = machine.I2C(0, scl=machine.Pin(17), sda=machine.Pin(16), freq=400000)
 #Create DS3231 object (RTC)
 rtc = ds3231.DS3231(i2c)
 
-#Function for converting RTC data to string
-def format_time(datetime_tuple):
-    year, month, day, _, hour, minute, second, _ = datetime_tuple
-    return f"{year:04d}-{month:02d}-{day:02d} {hour:02d}:{minute:02d}:{second:02d}"
+#Clock anchored to the RTC, timestamps come from ticks_us (no I2C per press)
+clock = timebase.TimeBase(rtc)
+
+#Function for converting a clock timestamp (seconds, microseconds) to string
+def format_time(stamp):
+    return timebase.format_datetime(stamp[0], stamp[1])
 
 #Read the time from the RTC
 start_time = rtc.datetime()
@@ -45,6 +51,7 @@ if "Data" not in os.listdir():
 #Initialize flags for file creation
 rtc_file_created = False
 no_rtc_file_created = False
+writer = None  #CSV writer, created with the file
 
 #Loop Code
 while True:
@@ -55,68 +62,52 @@ while True:
     #Initialize flags that check if a button has been pressed
     left_pressed = False
     right_pressed = False
+
+    #Presses queued by the button IRQs since the last loop
+    button = buttons.get()
+    while button != -1:
+        if button == "left":
+            left_pressed = True
+        else:
+            right_pressed = True
+        button = buttons.get()
     
     if start_time[0] > 2024:  #RTC available
  
         ledgreen.on()  #LED for testing
+        clock.poll()  #Keep the clock lined up with the RTC
         
-        if left.value() == 0:  #Left button pressed
-            utime.sleep_ms(50)
-            if left.value() == 0:  #Still pressed
-                left_string = format_time(rtc.datetime())
-                left_pressed = True
-                
-                while left.value() == 0:
-                    utime.sleep_ms(100)
-
-        if right.value() == 0:  #Right button pressed
-            utime.sleep_ms(50)
-            if right.value() == 0: 
-                right_string = format_time(rtc.datetime())
-                right_pressed = True
-                
-                while right.value() == 0:
-                    utime.sleep_ms(100)
+        if left_pressed:  #Left button pressed
+            left_string = format_time(clock.now())
+
+        if right_pressed:  #Right button pressed
+            right_string = format_time(clock.now())
 
         #Write to csv file if a button was pressed
         if left_pressed or right_pressed:
             #Create the csv file if not already created
             if not rtc_file_created: #File name based off the time at startup
                 file_name = f"Data/{start_time[0]}-{start_time[1]:02}-{start_time[2]:02}_{start_time[4]:02}-{start_time[5]:02}-{start_time[6]:02}.csv"
-                with open(file_name, 'w') as file:
-                    file.write("#, Left, Right\n")
+                writer = CSVWriter(file_name, header="#, Left, Right\n")
                 rtc_file_created = True
                 row = 1
                 
-            with open(file_name, 'a') as file:
-                file.write(f"{row}, {left_string}, {right_string}\n")
-                row += 1
+            writer.write_row(f"{row}, {left_string}, {right_string}\n")
+            row += 1
     
     else:  #No RTC available for some reason
         
         ledred.on()  #Red LED
 
-        if left.value() == 0:  #Left button pressed
-            utime.sleep_ms(50)  #Debounce protection
-            if left.value() == 0:  #Still pressed
-                time_since_L = utime.time() - startup #Count time since startup
-                left_time = convert_seconds(time_since_L) #Conver to readable time
-                left_string = f"{left_time[0]:02}:{left_time[1]:02}:{left_time[2]:02}"
-                left_pressed = True
-                
-                while left.value() == 0: #Debounce Protection
-                    utime.sleep_ms(100)
-
-        if right.value() == 0:  #Right button pressed
-            utime.sleep_ms(50)
-            if right.value() == 0: 
-                time_since_R = utime.time() - startup
-                right_time = convert_seconds(time_since_R)
-                right_string = f"{right_time[0]:02}:{right_time[1]:02}:{right_time[2]:02}"
-                right_pressed = True
-                
-                while right.value() == 0:
-                    utime.sleep_ms(100)
+        if left_pressed:  #Left button pressed
+            time_since_L = utime.time() - startup #Count time since startup
+            left_time = convert_seconds(time_since_L) #Conver to readable time
+            left_string = f"{left_time[0]:02}:{left_time[1]:02}:{left_time[2]:02}"
+
+        if right_pressed:  #Right button pressed
+            time_since_R = utime.time() - startup
+            right_time = convert_seconds(time_since_R)
+            right_string = f"{right_time[0]:02}:{right_time[1]:02}:{right_time[2]:02}"
         
         #Write to csv only if a button was pressed
         if left_pressed or right_pressed:
@@ -134,12 +125,14 @@ while True:
                 no_rtc_filename = f"Data/No_Time_{next_number}.csv"
 
                 #Create and write the file header if new
-                with open(no_rtc_filename, 'w') as file:
-                    file.write(""""Warning! An Error has occurred, No RTC Time Detected! Time value is based off time since startup"\n#, Left, Right\n""")
+                writer = CSVWriter(no_rtc_filename, header=""""Warning! An Error has occurred, No RTC Time Detected! Time value is based off time since startup"\n#, Left, Right\n""")
                 
                 no_rtc_file_created = True  #Set flag to prevent recreation
                 row = 1
                 
-            with open(no_rtc_filename, 'a') as file:
-                file.write(f"{row}, {left_string}, {right_string}\n")
-                row += 1
\ No newline at end of file
+            writer.write_row(f"{row}, {left_string}, {right_string}\n")
+            row += 1
+
+    #Write buffered rows to flash once they are old enough
+    if writer:
+        writer.poll()
\ No newline at end of file
@@ -3,6 +3,9 @@ from machine import Pin
 import utime
 import os
 import ds3231  #For Real Time Clock (RTC)
+from csv_writer import CSVWriter  #Keeps the CSV open and writes rows in batches
+import timebase  #Millisecond timestamps from the RTC without reading it every press
+from buttons import Buttons  #Button presses from IRQs, debounced by a timer
 
 #Setup LED's
 ledgreen = Pin(0, Pin.OUT) #Red
@@ -23,16 +26,22 @@ left_out = machine.Pin(13, machine.Pin.IN, machine.Pin.PULL_UP) #Button for exit
 right_in = machine.Pin(11, machine.Pin.IN, machine.Pin.PULL_UP) #Button for entering right side
 right_out = machine.Pin(10, machine.Pin.IN, machine.Pin.PULL_UP) #Button for exiting right side
 
+#Queues each press, nothing waits for a button to be released
+buttons = Buttons({"start": start_test, "end": end_test, "left_in": left_in, "left_out": left_out,
+                   "right_in": right_in, "right_out": right_out}, debounce_ms=50)
+
 #Initialize I2C on Pico (GP16 = SDA and GP17 = SCL)to read RTC
 i2c = machine.I2C(0, scl=machine.Pin(17), sda=machine.Pin(16), freq=400000)
 
 #Create DS3231 object (RTC)
 rtc = ds3231.DS3231(i2c)
 
-#Function for converting RTC data to string
-def format_time(datetime_tuple):
-    year, month, day, _, hour, minute, second, _ = datetime_tuple
-    return f"{year:04d}-{month:02d}-{day:02d} {hour:02d}:{minute:02d}:{second:02d}"
+#Clock anchored to the RTC, timestamps come from ticks_us (no I2C per press)
+clock = timebase.TimeBase(rtc)
+
+#Function for converting a clock timestamp (seconds, microseconds) to string
+def format_time(stamp):
+    return timebase.format_datetime(stamp[0], stamp[1])
 
 #Convert reference time to hours, minutes, and seconds
 def convert_seconds(time_since):
@@ -43,10 +52,9 @@ def convert_seconds(time_since):
 
 #Determine the elapsed time spent on a side
 def calculate_elapsed_time(start, end):
-    t1 = start[4] * 3600 + start[5] * 60 + start[6]
-    t2 = end[4] * 3600 + end[5] * 60 + end[6]
-    elapsed_seconds = convert_seconds(t2 - t1)
-    return f"{elapsed_seconds[0]:02}:{elapsed_seconds[1]:02}:{elapsed_seconds[2]:02}"
+    elapsed_us = (end[0] - start[0]) * 1000000 + end[1] - start[1]
+    elapsed_seconds = convert_seconds(elapsed_us // 1000000)
+    return f"{elapsed_seconds[0]:02}:{elapsed_seconds[1]:02}:{elapsed_seconds[2]:02}.{elapsed_us % 1000000 // 1000:03}"
 
 #Ensure the Data folder exists
 if "Data" not in os.listdir():
@@ -54,6 +62,7 @@ if "Data" not in os.listdir():
 
 #Initialize flags for file creation
 rtc_file_created = False
+writer = None  #CSV writer for the current test
 
 left_entry_time = None
 right_entry_time = None
@@ -63,6 +72,14 @@ started = False
 #Testing to see if rtc is accurate
 test_rtc = rtc.datetime()
 
+#Presses drained from the button queue and their ticks_us, lists reused by every loop pass
+pressed = []
+pressed_at = []
+
+#Clock timestamp of a drained press, from when it was pressed rather than when it was read
+def press_time(button):
+    return clock.stamp(pressed_at[pressed.index(button)])
+
 #Main Loop
 while True:
     if test_rtc[0] > 2024: #RTC available
@@ -74,14 +91,14 @@ while True:
     
     #Wait for start button to be pressed
     if not started:
-        if start_test.value() == 0: #Start pressed
-            utime.sleep_ms(50)
-            if start_test.value() == 0: #Still pressed
-                started = True #Set flag
-                start_time = rtc.datetime() #Read the time from the RTC
-                rtc_file_created = False #Reset flag, ensure new csv can be created
-                ledyellow.off() #LED's
-                ledblue.on()
+        if test_rtc[0] > 2024:
+            clock.poll()  #Keep the clock lined up while idle too, so a test starts with it aligned
+        if buttons.get() == "start": #Start pressed, other presses are ignored until then
+            started = True #Set flag
+            start_time = rtc.datetime() #Read the time from the RTC
+            rtc_file_created = False #Reset flag, ensure new csv can be created
+            ledyellow.off() #LED's
+            ledblue.on()
     
     while started:
         #Set up default strings for CSV
@@ -91,52 +108,48 @@ while True:
         right_out_string = ""
         left_time_string = ""
         right_time_string = ""
+
+        #Presses queued by the button IRQs since the last loop
+        pressed.clear()
+        pressed_at.clear()
+        button = buttons.get()
+        while button != -1:
+            pressed.append(button)
+            pressed_at.append(buttons.ticks)
+            button = buttons.get()
         
         #Wait for end button to be pressed
-        if end_test.value() == 0: #End pressed
-            utime.sleep_ms(50)
-            if end_test.value() == 0: #Still pressed
-                started = False #Set Flag
-                ledyellow.on() #LED's
-                ledblue.off()
-                break
+        if "end" in pressed: #End pressed
+            started = False #Set Flag
+            if writer: #Flush and close the CSV for this test
+                writer.close()
+                writer = None
+            ledyellow.on() #LED's
+            ledblue.off()
+            break
     
         if start_time[0] > 2024:  #RTC available        
-            if left_in.value() == 0:  #Left button pressed
-                utime.sleep_ms(50)
-                if left_in.value() == 0:  #Still pressed
-                    left_entry_time = rtc.datetime() #Record entry time
-                    while left_in.value() == 0:
-                        utime.sleep_ms(100)
-
-            if left_out.value() == 0 and left_entry_time: #Exit button pressed, and enter button previously pressed
-                utime.sleep_ms(50)
-                if left_out.value() == 0: 
-                    left_exit_time = rtc.datetime() #Record exit time
-                    left_time_string = calculate_elapsed_time(left_entry_time, left_exit_time) #Calculate time spent
-                    left_in_string = format_time(left_entry_time)  #Format RTC for display
-                    left_out_string = format_time(left_exit_time)  #Format RTC for display
-                    left_entry_time = None #Reset entry time                   
-                    while left_out.value() == 0:
-                        utime.sleep_ms(100)
+            clock.poll()  #Keep the clock lined up with the RTC
+
+            if "left_in" in pressed:  #Left button pressed
+                left_entry_time = press_time("left_in") #Record entry time
+
+            if "left_out" in pressed and left_entry_time: #Exit button pressed, and enter button previously pressed
+                left_exit_time = press_time("left_out") #Record exit time
+                left_time_string = calculate_elapsed_time(left_entry_time, left_exit_time) #Calculate time spent
+                left_in_string = format_time(left_entry_time)  #Format RTC for display
+                left_out_string = format_time(left_exit_time)  #Format RTC for display
+                left_entry_time = None #Reset entry time
                         
-            if right_in.value() == 0:  #Right button pressed
-                utime.sleep_ms(50)
-                if right_in.value() == 0:  #Still pressed
-                    right_entry_time = rtc.datetime() #Record entry time
-                    while right_in.value() == 0:
-                        utime.sleep_ms(100)
-
-            if right_out.value() == 0 and right_entry_time: #Exit button pressed, and enter button previously pressed
-                utime.sleep_ms(50)
-                if right_out.value() == 0: 
-                    right_exit_time = rtc.datetime() #Record exit time
-                    right_time_string = calculate_elapsed_time(right_entry_time, right_exit_time) #Calculate time spent
-                    right_in_string = format_time(right_entry_time)  #Format RTC for display
-                    right_out_string = format_time(right_exit_time)  #Format RTC for display
-                    right_entry_time = None #Reset entry time                    
-                    while right_out.value() == 0:
-                        utime.sleep_ms(100)
+            if "right_in" in pressed:  #Right button pressed
+                right_entry_time = press_time("right_in") #Record entry time
+
+            if "right_out" in pressed and right_entry_time: #Exit button pressed, and enter button previously pressed
+                right_exit_time = press_time("right_out") #Record exit time
+                right_time_string = calculate_elapsed_time(right_entry_time, right_exit_time) #Calculate time spent
+                right_in_string = format_time(right_entry_time)  #Format RTC for display
+                right_out_string = format_time(right_exit_time)  #Format RTC for display
+                right_entry_time = None #Reset entry time
 
             #Write to CSV if any data recorded
             if left_in_string or right_in_string:
@@ -144,12 +157,14 @@ while True:
                     file_name = f"Data/{start_time[0]}-{start_time[1]:02}-{start_time[2]:02}_{start_time[4]:02}-{start_time[5]:02}-{start_time[6]:02}.csv" #Name it after the time test started at
                     #Initialize row for CSV
                     row = 1
-                    with open(file_name, 'w') as file: #Write to the new CSV
-                        file.write("#, Entered Left, Exited Left, Time Left, Entered Right, Exited Right, Time Right\n") #Create the column titles
+                    writer = CSVWriter(file_name, header="#, Entered Left, Exited Left, Time Left, Entered Right, Exited Right, Time Right\n") #Create the CSV with the column titles
                     rtc_file_created = True #Set Flag
 
-                with open(file_name, 'a') as file: #Add onto CSV file
-                    file.write(f"{row}, {left_in_string}, {left_out_string}, {left_time_string}, {right_in_string}, {right_out_string}, {right_time_string}\n") #Write all relevant data to CSV
-                    row += 1 #Increment row of CSV
+                writer.write_row(f"{row}, {left_in_string}, {left_out_string}, {left_time_string}, {right_in_string}, {right_out_string}, {right_time_string}\n") #Buffer all relevant data for the CSV
+                row += 1 #Increment row of CSV
+
+            #Write buffered rows to flash once they are old enough
+            if writer:
+                writer.poll()
         else:
             break
\ No newline at end of file
@@ -3,9 +3,12 @@ from machine import Pin
 import sdcard
 import os
 import utime
+from sdcopy import FileCopier, cluster_size, kb_per_s
+from buttons import Buttons  #Button presses from IRQs, debounced by a timer
 
 download = machine.Pin(9, machine.Pin.IN, machine.Pin.PULL_UP) #Button to download Data from pico to SD
 delete_pi = machine.Pin(15, machine.Pin.IN, machine.Pin.PULL_UP) #Button to clear pico Data folder
+buttons = Buttons({"download": download, "delete": delete_pi}, debounce_ms=50) #Queues each press, nothing waits for a release
 
 #Set LED's up
 ledgreen = Pin(16, Pin.OUT)
@@ -33,6 +36,9 @@ destination = "/sd/Data"
 #SD Mounted Flag starts False
 sd_present = False
 
+#Copy buffer, one cluster of the SD card, made on the first copy and reused
+copier = None
+
 #Function to try to mount the SD card
 def mount_sd():
     global sd_present
@@ -59,16 +65,10 @@ def copy_files(source, destination): #Takes source path, and destination path
         if os.stat(source_path)[0] & 0x4000:  #Item is a folder
             copy_files(source_path, destination_path)  #Copy subfolder
         else: #Item is a file
-            #Open source in binary read mode and destination as binary write mode
-            with open(source_path, 'rb') as fsource, open(destination_path, 'wb') as fdestination:
-                while True: #Loops until entire file copied
-                    ledblue.on() #Blinks Blue LED
-                    buf = fsource.read(1024)  #Copies in chunks of 1024 Bytes (1KB)
-                    utime.sleep_ms(100)
-                    ledblue.off()
-                    if not buf: #End of file
-                        break #Exit Loop
-                    fdestination.write(buf) #Writes to SD file
+            ledblue.on() #Blue LED on while the file copies
+            nbytes, us = copier.copy(source_path, destination_path) #Whole clusters at a time
+            ledblue.off()
+            print("{}: {} bytes, {} KB/s".format(item, nbytes, kb_per_s(nbytes, us)))
 
 #Function to delete all files inside the 'Data' folder on pico
 def delete_pico_Data(folder):
@@ -96,48 +96,43 @@ while True:
     if not sd_present:
         mount_sd()
 
+    #Presses queued by the button IRQs
+    button = buttons.get()
+
     #Delete files from pico/Data
-    if delete_pi.value() == 0:
-        utime.sleep_ms(50)  #Debounce protection
-        if delete_pi.value() == 0:  #Button still pressed
-            delete_pico_Data(source) #Delete 'Data' function
-            #Flash blue LED for successful delete
-            for i in range(5):
-                ledblue.on()
-                utime.sleep_ms(100)
-                ledblue.off()
-                utime.sleep_ms(100)
-
-            #Debounce wait for button release
-            while delete_pi.value() == 0:
-                utime.sleep_ms(100)
+    if button == "delete":
+        delete_pico_Data(source) #Delete 'Data' function
+        #Flash blue LED for successful delete
+        for i in range(5):
+            ledblue.on()
+            utime.sleep_ms(100)
+            ledblue.off()
+            utime.sleep_ms(100)
 
     #Copy files to SD
-    if download.value() == 0:
-        utime.sleep_ms(50)  #Debounce protection
-        if download.value() == 0:  #Button still pressed
-            if sd_present:
-                try:
-                    if os.stat(source)[0] & 0x4000:  #Ensure 'Data' is a directory
-                        copy_files(source, destination) #Copy files from pico to SD
-                except OSError: #Folder not found, skip
-                    pass
-
-                #Safely unmount SD card after transfer
-                os.umount("/sd")
-
-                ledgreen.off() #Indicate with  LED
-                ledred.on()
-                
-                #Flash yellow to show SD needs to be removed
-                while det_pin.value() == 1:
-                    ledyellow.on()
-                    utime.sleep_ms(500)
-                    ledyellow.off()
-                    utime.sleep_ms(500)
-
-                sd_present = False  #Reset flag to allow remounting
-
-            #Debounce wait for button release
-            while download.value() == 0:
-                utime.sleep_ms(100)
\ No newline at end of file
+    if button == "download":
+        if sd_present:
+            if copier is None: #Buffer sized to the card's cluster
+                copier = FileCopier(cluster_size("/sd"))
+            try:
+                if os.stat(source)[0] & 0x4000:  #Ensure 'Data' is a directory
+                    copy_files(source, destination) #Copy files from pico to SD
+            except OSError: #Folder not found, skip
+                pass
+
+            #Safely unmount SD card after transfer
+            os.umount("/sd")
+
+            ledgreen.off() #Indicate with  LED
+            ledred.on()
+            
+            #Flash yellow to show SD needs to be removed
+            while det_pin.value() == 1:
+                ledyellow.on()
+                utime.sleep_ms(500)
+                ledyellow.off()
+                utime.sleep_ms(500)
+
+            sd_present = False  #Reset flag to allow remounting
+
+            buttons.clear() #Forget presses made while waiting for the card
\ No newline at end of file
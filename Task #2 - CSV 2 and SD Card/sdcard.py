@@ -4,6 +4,26 @@ MicroPython driver for SD cards using SPI bus.
 Requires an SPI bus and a CS pin.  Provides readblocks and writeblocks
 methods so the device can be mounted as a filesystem.
 
+The card is initialised at 400 kHz.  Unless a fixed baudrate is given, the
+clock is then raised to the fastest rate the card (CSD TRAN_SPEED) and the
+wiring sustain: block 0 is read with its CRC checked at decreasing rates
+until a read matches the one taken at 400 kHz.  That ladder is only walked
+during init.  If a transfer later fails (timeout, rejected write, CRC error
+with check_crc on) the clock is lowered one step and the transfer retried
+once; a second failure is raised, and the lower clock stays until the card
+is initialised again.  With `present` set (a callable reading the card
+detect pin) a transfer to a card that has been pulled isn't retried at all.
+The rate in use is in `baudrate`.
+
+init_steps() is the init as a generator, yielding the milliseconds to wait
+before the next step (the 50 ms ACMD41 polls) or 0, so a main loop can
+initialise a card without stalling; init_card() runs it with sleeps.
+
+The card's CID (manufacturer, product name, serial) is read during init into
+`cid`.  Calling init_card() again after the card was re-inserted reuses the
+driver and its buffers, and a card seen before gets the clock negotiated
+for it last time (`rates`, keyed by CID) without probing again.
+
 Example usage on pyboard:
 
     import pyb, sdcard, os
@@ -21,6 +41,7 @@ Example usage on ESP8266:
 """
 
 from micropython import const
+from array import array
 import time
 
 
@@ -37,21 +58,79 @@ _TOKEN_CMD25 = const(0xFC)
 _TOKEN_STOP_TRAN = const(0xFD)
 _TOKEN_DATA = const(0xFE)
 
+_TOKEN_SPINS = const(64)  # data token polls before sleeping between polls
+_POLL_BYTES = const(8)  # bytes clocked per busy poll
+_BUSY_TIMEOUT_MS = const(500)
+
+_INIT_BAUDRATE = const(400000)
+
+# CSD TRAN_SPEED: bits 2-0 rate unit, bits 6-3 time value (x10)
+_TRAN_UNITS = (100000, 1000000, 10000000, 100000000)
+_TRAN_VALUES = (0, 10, 12, 13, 15, 20, 25, 30, 35, 40, 45, 50, 55, 60, 70, 80)
+
+
+def tran_speed(value):
+    """Maximum clock in Hz encoded in a CSD TRAN_SPEED byte"""
+    unit = value & 0x07
+    if unit > 3:
+        return 25000000
+    return _TRAN_UNITS[unit] * _TRAN_VALUES[(value >> 3) & 0x0F] // 10
+
+
+def _crc_table():
+    table = array("H", bytes(512))
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021 if crc & 0x8000 else crc << 1) & 0xFFFF
+        table[i] = crc
+    return table
+
+
+_CRC_TABLE = _crc_table()
+
+
+def crc16(buf):
+    """CRC-16/XMODEM, the checksum sent after each data block"""
+    crc = 0
+    table = _CRC_TABLE
+    for b in buf:
+        crc = ((crc << 8) & 0xFFFF) ^ table[(crc >> 8) ^ b]
+    return crc
+
 
 class SDCard:
-    def __init__(self, spi, cs, baudrate=1320000):
+    def __init__(self, spi, cs, baudrate=None, max_baudrate=25000000, init=True):
+        """init : initialise the card now (False leaves it to init_card()/init_steps())"""
         self.spi = spi
         self.cs = cs
+        self.baudrate = _INIT_BAUDRATE
+        self.max_baudrate = max_baudrate
+        self.card_baudrate = 0  # from TRAN_SPEED
+        self.check_crc = False  # verify the CRC of every block read
+        self.fallbacks = 0  # times the clock was lowered after a failed transfer
+        self.present = None  # callable, False once the card is pulled: no retries then
+        self.cid = None
+        self.rates = {}  # CID -> clock negotiated for that card
 
         self.cmdbuf = bytearray(6)
         self.dummybuf = bytearray(512)
         self.tokenbuf = bytearray(1)
+        self.respbuf = bytearray(4)
+        self.crcbuf = bytearray(2)
+        self.pollbuf = bytearray(_POLL_BYTES)
         for i in range(512):
             self.dummybuf[i] = 0xFF
         self.dummybuf_memoryview = memoryview(self.dummybuf)
+        # 0xFF clock bytes, dummy CRC and the 16 byte CSD/CID reads, sliced
+        # once so transfers don't allocate
+        self.ff1 = self.dummybuf_memoryview[:1]
+        self.ff2 = self.dummybuf_memoryview[:2]
+        self.ff16 = self.dummybuf_memoryview[:16]
 
         # initialise the card
-        self.init_card(baudrate)
+        if init:
+            self.init_card(baudrate)
 
     def init_spi(self, baudrate):
         try:
@@ -64,15 +143,19 @@ class SDCard:
             self.spi.init(master, baudrate=baudrate, phase=0, polarity=0)
 
     def init_card(self, baudrate):
+        for wait in self.init_steps(baudrate):
+            if wait:
+                time.sleep_ms(wait)
+
+    def init_steps(self, baudrate):
         # init CS pin
         self.cs.init(self.cs.OUT, value=1)
 
         # init SPI bus; use low data rate for initialisation
-        self.init_spi(100000)
+        self.init_spi(_INIT_BAUDRATE)
 
         # clock card at least 100 cycles with cs high
-        for i in range(16):
-            self.spi.write(b"\xff")
+        self.spi.write(self.ff16)
 
         # CMD0: init card; should return _R1_IDLE_STATE (allow 5 attempts)
         for _ in range(5):
@@ -84,9 +167,9 @@ class SDCard:
         # CMD8: determine card version
         r = self.cmd(8, 0x01AA, 0x87, 4)
         if r == _R1_IDLE_STATE:
-            self.init_card_v2()
+            yield from self.init_card_v2()
         elif r == (_R1_IDLE_STATE | _R1_ILLEGAL_COMMAND):
-            self.init_card_v1()
+            yield from self.init_card_v1()
         else:
             raise OSError("couldn't determine SD card version")
 
@@ -112,12 +195,72 @@ class SDCard:
         if self.cmd(16, 512, 0) != 0:
             raise OSError("can't set 512 block size")
 
+        # CMD10: response R2 like CMD9, the 16-byte CID
+        if self.cmd(10, 0, 0, 0, False) != 0:
+            raise OSError("no response from SD card")
+        cid = bytearray(16)
+        self.readinto(cid)
+        self.cid = bytes(cid)
+
         # set to high data rate now that it's initialised
+        self.card_baudrate = tran_speed(csd[3])
+        yield 0
+        if baudrate is None:
+            rate = self.rates.get(self.cid)
+            if rate is None:
+                self.rates[self.cid] = yield from self.negotiate_baudrate()
+            else:
+                self.set_baudrate(rate)  # same card as before
+        else:
+            self.set_baudrate(baudrate)
+
+    def set_baudrate(self, baudrate):
         self.init_spi(baudrate)
+        self.baudrate = baudrate
+
+    def negotiate_baudrate(self):
+        """Raise the clock as far as a CRC checked read of block 0 stays intact
+
+        a generator like init_steps(), yielding between rates; returns the rate"""
+        reference = bytearray(512)
+        test = bytearray(512)
+        check_crc = self.check_crc
+        self.check_crc = True
+        try:
+            self.set_baudrate(_INIT_BAUDRATE)
+            self._readblocks(0, reference)
+            rate = min(self.card_baudrate, self.max_baudrate)
+            while rate > _INIT_BAUDRATE:
+                self.set_baudrate(rate)
+                try:
+                    self._readblocks(0, test)
+                    if test == reference:
+                        return rate
+                except OSError:
+                    pass
+                rate = rate * 2 // 3
+                yield 0
+            self.set_baudrate(_INIT_BAUDRATE)
+            return _INIT_BAUDRATE
+        finally:
+            self.check_crc = check_crc
+
+    def _fall_back(self):
+        # lower the clock a step after a failed transfer, False if already at
+        # the floor or the card is gone
+        if self.baudrate <= _INIT_BAUDRATE:
+            return False
+        if self.present is not None and not self.present():
+            return False
+        self.set_baudrate(max(_INIT_BAUDRATE, self.baudrate * 2 // 3))
+        self.fallbacks += 1
+        # rates keeps the negotiated clock: a failure from pulling the card
+        # mid-transfer must not pin the card to a low rate on every insertion
+        return True
 
     def init_card_v1(self):
         for i in range(_CMD_TIMEOUT):
-            time.sleep_ms(50)
+            yield 50
             self.cmd(55, 0, 0)
             if self.cmd(41, 0, 0) == 0:
                 # SDSC card, uses byte addressing in read/write/erase commands
@@ -128,12 +271,12 @@ class SDCard:
 
     def init_card_v2(self):
         for i in range(_CMD_TIMEOUT):
-            time.sleep_ms(50)
+            yield 50
             self.cmd(58, 0, 0, 4)
             self.cmd(55, 0, 0)
             if self.cmd(41, 0x40000000, 0) == 0:
-                self.cmd(58, 0, 0, -4)  # 4-byte response, negative means keep the first byte
-                ocr = self.tokenbuf[0]  # get first byte of response, which is OCR
+                self.cmd(58, 0, 0, 4)
+                ocr = self.respbuf[0]  # get first byte of response, which is OCR
                 if not ocr & 0x40:
                     # SDSC card, uses byte addressing in read/write/erase commands
                     self.cdv = 512
@@ -165,86 +308,124 @@ class SDCard:
             self.spi.readinto(self.tokenbuf, 0xFF)
             response = self.tokenbuf[0]
             if not (response & 0x80):
-                # this could be a big-endian integer that we are getting here
-                # if final<0 then store the first byte to tokenbuf and discard the rest
-                if final < 0:
-                    self.spi.readinto(self.tokenbuf, 0xFF)
-                    final = -1 - final
-                for j in range(final):
-                    self.spi.write(b"\xff")
+                # R3/R7 carry 4 more bytes (OCR or echo), kept in respbuf
+                if final:
+                    self.spi.readinto(self.respbuf, 0xFF)
                 if release:
                     self.cs(1)
-                    self.spi.write(b"\xff")
+                    self.spi.write(self.ff1)
                 return response
 
         # timeout
         self.cs(1)
-        self.spi.write(b"\xff")
+        self.spi.write(self.ff1)
         return -1
 
     def readinto(self, buf):
         self.cs(0)
 
-        # read until start byte (0xff)
-        for i in range(_CMD_TIMEOUT):
-            self.spi.readinto(self.tokenbuf, 0xFF)
-            if self.tokenbuf[0] == _TOKEN_DATA:
+        # read until start byte (0xfe), spinning before backing off to 1 ms polls
+        token = self.tokenbuf
+        for i in range(_TOKEN_SPINS + _CMD_TIMEOUT):
+            self.spi.readinto(token, 0xFF)
+            if token[0] == _TOKEN_DATA:
                 break
-            time.sleep_ms(1)
+            if i >= _TOKEN_SPINS:
+                time.sleep_ms(1)
         else:
             self.cs(1)
             raise OSError("timeout waiting for response")
 
         # read data
-        mv = self.dummybuf_memoryview
-        if len(buf) != len(mv):
-            mv = mv[: len(buf)]
-        self.spi.write_readinto(mv, buf)
+        n = len(buf)
+        if n == 512:
+            self.spi.write_readinto(self.dummybuf, buf)
+        elif n == 16:
+            self.spi.write_readinto(self.ff16, buf)
+        else:
+            self.spi.write_readinto(self.dummybuf_memoryview[:n], buf)
 
         # read checksum
-        self.spi.write(b"\xff")
-        self.spi.write(b"\xff")
+        self.spi.readinto(self.crcbuf, 0xFF)
 
         self.cs(1)
-        self.spi.write(b"\xff")
+        self.spi.write(self.ff1)
+
+        if self.check_crc and crc16(buf) != (self.crcbuf[0] << 8 | self.crcbuf[1]):
+            raise OSError(5)  # EIO
+
+    def wait_ready(self):
+        # the card holds MISO low while busy; poll a burst of bytes at a time
+        poll = self.pollbuf
+        start = time.ticks_ms()
+        while True:
+            self.spi.readinto(poll, 0xFF)
+            if poll[_POLL_BYTES - 1]:
+                return
+            if time.ticks_diff(time.ticks_ms(), start) > _BUSY_TIMEOUT_MS:
+                self.cs(1)
+                raise OSError("timeout waiting for write")
 
     def write(self, token, buf):
         self.cs(0)
 
         # send: start of block, data, checksum
-        self.spi.read(1, token)
+        self.tokenbuf[0] = token
+        self.spi.write(self.tokenbuf)
         self.spi.write(buf)
-        self.spi.write(b"\xff")
-        self.spi.write(b"\xff")
+        self.spi.write(self.ff2)
 
         # check the response
-        if (self.spi.read(1, 0xFF)[0] & 0x1F) != 0x05:
+        self.spi.readinto(self.tokenbuf, 0xFF)
+        if (self.tokenbuf[0] & 0x1F) != 0x05:
             self.cs(1)
-            self.spi.write(b"\xff")
-            return
+            self.spi.write(self.ff1)
+            raise OSError(5)  # EIO, block rejected
 
         # wait for write to finish
-        while self.spi.read(1, 0xFF)[0] == 0:
-            pass
+        self.wait_ready()
 
         self.cs(1)
-        self.spi.write(b"\xff")
+        self.spi.write(self.ff1)
 
     def write_token(self, token):
         self.cs(0)
-        self.spi.read(1, token)
-        self.spi.write(b"\xff")
+        self.tokenbuf[0] = token
+        self.spi.write(self.tokenbuf)
+        self.spi.write(self.ff1)
         # wait for write to finish
-        while self.spi.read(1, 0xFF)[0] == 0x00:
-            pass
+        self.wait_ready()
 
         self.cs(1)
-        self.spi.write(b"\xff")
+        self.spi.write(self.ff1)
 
     def readblocks(self, block_num, buf):
+        try:
+            return self._readblocks(block_num, buf)
+        except OSError:
+            if not self._fall_back():
+                raise
+        return self._readblocks(block_num, buf)  # once, a step slower
+
+    def writeblocks(self, block_num, buf):
+        try:
+            return self._writeblocks(block_num, buf)
+        except OSError:
+            if not self._fall_back():
+                raise
+        return self._writeblocks(block_num, buf)  # once, a step slower
+
+    @staticmethod
+    def _block_views(buf, nblocks):
+        # one 512 byte view per block, made before the transfer starts so
+        # nothing allocates (or collects) while the card is selected
+        mv = memoryview(buf)
+        return [mv[i * 512 : i * 512 + 512] for i in range(nblocks)]
+
+    def _readblocks(self, block_num, buf):
         # workaround for shared bus, required for (at least) some Kingston
         # devices, ensure MOSI is high before starting transaction
-        self.spi.write(b"\xff")
+        self.spi.write(self.ff1)
 
         nblocks = len(buf) // 512
         assert nblocks and not len(buf) % 512, "Buffer length is invalid"
@@ -257,25 +438,26 @@ class SDCard:
             # receive the data and release card
             self.readinto(buf)
         else:
+            blocks = self._block_views(buf, nblocks)
             # CMD18: set read address for multiple blocks
             if self.cmd(18, block_num * self.cdv, 0, release=False) != 0:
                 # release the card
                 self.cs(1)
                 raise OSError(5)  # EIO
-            offset = 0
-            mv = memoryview(buf)
-            while nblocks:
-                # receive the data and release card
-                self.readinto(mv[offset : offset + 512])
-                offset += 512
-                nblocks -= 1
-            if self.cmd(12, 0, 0xFF, skip1=True):
+            try:
+                for block in blocks:
+                    # receive the data and release card
+                    self.readinto(block)
+            finally:
+                # stop the transfer even when a block failed
+                stopped = self.cmd(12, 0, 0xFF, skip1=True)
+            if stopped:
                 raise OSError(5)  # EIO
 
-    def writeblocks(self, block_num, buf):
+    def _writeblocks(self, block_num, buf):
         # workaround for shared bus, required for (at least) some Kingston
         # devices, ensure MOSI is high before starting transaction
-        self.spi.write(b"\xff")
+        self.spi.write(self.ff1)
 
         nblocks, err = divmod(len(buf), 512)
         assert nblocks and not err, "Buffer length is invalid"
@@ -287,17 +469,16 @@ class SDCard:
             # send the data
             self.write(_TOKEN_DATA, buf)
         else:
+            blocks = self._block_views(buf, nblocks)
             # CMD25: set write address for first block
             if self.cmd(25, block_num * self.cdv, 0) != 0:
                 raise OSError(5)  # EIO
             # send the data
-            offset = 0
-            mv = memoryview(buf)
-            while nblocks:
-                self.write(_TOKEN_CMD25, mv[offset : offset + 512])
-                offset += 512
-                nblocks -= 1
-            self.write_token(_TOKEN_STOP_TRAN)
+            try:
+                for block in blocks:
+                    self.write(_TOKEN_CMD25, block)
+            finally:
+                self.write_token(_TOKEN_STOP_TRAN)
 
     def ioctl(self, op, arg):
         if op == 4:  # get number of blocks
@@ -1,8 +1,9 @@
 from machine import ADC, Pin
 import utime
+from adc_scanner import AdcScanner  #Samples the LDR's on a timer and reports connect/disconnect
 
 #Setup LDR's on A/D pins
-ldr_1 = ADC(27) 
+ldr_1 = ADC(27)
 ldr_2 = ADC(26)
 
 #Setup LEd's
@@ -11,33 +12,30 @@ ledgreen.off()
 ledblue = Pin(2, Pin.OUT)
 ledblue.off()
 
-#Define Threshold that voltage (0-65536)
-threshold = 35000  #Voltage threshold that corresponds to LDR value when LED on
-on_time = 1000  #Must be plugged in for 1 second (1000ms) before gate considered connected (avoids misreads)
+#LED shown for each LDR
+leds = {"ldr_1": ledgreen, "ldr_2": ledblue}
 
-#Track how long the input has been above threshold
-timer_1 = 0
-timer_2 = 0
+#Sample both LDR's 100 times a second, averaging the last 8 readings (0-65535)
+#Thresholds are measured from the ambient light at startup, so start with the modules unplugged
+#A module must be seen for 1 second (1000ms) before it is considered connected (avoids misreads)
+#Once connected it must drop 3000 below the threshold before it is disconnected (hysteresis)
+scanner = AdcScanner({"ldr_1": ldr_1, "ldr_2": ldr_2}, rate_hz=100, window=8, margin=12000, hysteresis=3000, on_ms=1000)
+scanner.start()
+
+for i, name in enumerate(scanner.names):
+    print(f"{name}: ambient {scanner.level(name)}, connected above {scanner.on[i]}")
 
 #Main Loop
 while True:
-    ad_1 = ldr_1.read_u16() #Reads A/D value for LDR_1
-    ad_2 = ldr_2.read_u16() #Reads A/D value for LDR_2
-    
-    if ad_1 > threshold: #If the A/D value is higher than threshold, LED should be on
-        timer_1 += 50 #Start adding 50 ms (main loop execution time)
-        if timer_1 >= on_time: #1 second has elapsed
-            ledgreen.on() #Turn on green LED, indicating a module was connected
-    else: #Once A/D value goes below threshold, turn off LED (prevents accidentally thinking gate connected)
-        timer_1 = 0
-        ledgreen.off()
-        
-    if ad_2 > threshold: #If the A/D value is higher than threshold, LED should be on
-        timer_2 += 50 #Start adding 50 ms (main loop execution time)
-        if timer_2 >= on_time: #1 second has elapsed
-            ledblue.on() #Turn on green LED, indicating a module was connected
-    else: #Once A/D value goes below threshold, turn off LED (prevents accidentally thinking gate connected)
-        timer_2 = 0
-        ledblue.off()
+    #The scanner reports every change, nothing needs to be read here
+    name = scanner.get()
+    while name != -1:
+        if scanner.connected:
+            leds[name].on() #Module connected
+            print(f"{name} connected")
+        else:
+            leds[name].off() #Module disconnected
+            print(f"{name} disconnected")
+        name = scanner.get()
 
-    utime.sleep_ms(50) #Loop every 50ms
+    utime.sleep_ms(50)